@@ -0,0 +1,47 @@
+"""
+Coverage of road segments as sets of intervals along the segment.
+
+An interval set is a sorted (n, 2) array of disjoint [start, end] fractions of a
+segment's length. Sets are stored as packed little-endian float32 pairs.
+"""
+import numpy as np
+
+def merge_intervals(intervals):
+    """
+    Merge intervals into a sorted set of disjoint intervals
+
+    Args:
+        intervals: Array-like of (start, end) fractions; reversed intervals are allowed
+
+    Returns:
+        (n, 2) array of disjoint intervals clipped to [0, 1], sorted by start
+    """
+    intervals = np.clip(np.sort(np.asarray(intervals, dtype=float).reshape(-1, 2), axis=1), 0.0, 1.0)
+    if len(intervals) == 0:
+        return intervals
+
+    intervals = intervals[np.argsort(intervals[:, 0], kind='stable')]
+
+    # An interval starts a new group when it begins after every earlier interval has ended
+    reach = np.maximum.accumulate(intervals[:, 1])
+    group_starts = np.flatnonzero(np.concatenate(([True], intervals[1:, 0] > reach[:-1])))
+    return np.column_stack((intervals[group_starts, 0], np.maximum.reduceat(intervals[:, 1], group_starts)))
+
+def union_intervals(first, second):
+    """Union of two interval sets"""
+    return merge_intervals(np.concatenate((np.reshape(first, (-1, 2)), np.reshape(second, (-1, 2)))))
+
+def covered_fraction(intervals):
+    """Fraction of the segment covered by an interval set"""
+    intervals = np.reshape(intervals, (-1, 2))
+    return float(np.sum(intervals[:, 1] - intervals[:, 0]))
+
+def encode_intervals(intervals):
+    """Pack an interval set into bytes for storage"""
+    return np.asarray(intervals, dtype='<f4').tobytes()
+
+def decode_intervals(data):
+    """Unpack an interval set stored by encode_intervals; empty for None"""
+    if not data:
+        return np.empty((0, 2))
+    return np.frombuffer(data, dtype='<f4').reshape(-1, 2).astype(float)
@@ -0,0 +1,14 @@
+-- Spatial indexes for bounding box and distance filters
+-- (names match the ones GeoAlchemy2 gives tables created with create_all)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_road_segments_geometry ON road_segments USING GIST (geometry);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_road_segments_geometry ON user_road_segments USING GIST (geometry);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_gps_points_location ON gps_points USING GIST (location);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_activities_path ON activities USING GIST (path);
+
+-- Foreign keys used to look up and delete child rows
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_gps_points_activity_id ON gps_points (activity_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_routes_location_id ON routes (location_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_route_segments_segment_id ON route_segments (segment_id);
+
+-- A user's segments by run status
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_road_segments_user_run ON user_road_segments (user_id, has_been_run);
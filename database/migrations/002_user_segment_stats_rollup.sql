@@ -0,0 +1,83 @@
+-- Per-user rollup of road segment progress, kept up to date by triggers on user_road_segments
+CREATE TABLE IF NOT EXISTS user_segment_stats (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    total_segments INTEGER NOT NULL DEFAULT 0,
+    run_segments INTEGER NOT NULL DEFAULT 0,
+    total_length DOUBLE PRECISION NOT NULL DEFAULT 0,
+    run_length DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Add the rows a statement inserted and subtract the rows it deleted, using its transition tables
+CREATE OR REPLACE FUNCTION user_segment_stats_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO user_segment_stats AS s (user_id, total_segments, run_segments, total_length, run_length)
+        SELECT user_id,
+               COUNT(*),
+               COUNT(*) FILTER (WHERE has_been_run),
+               COALESCE(SUM(length), 0),
+               COALESCE(SUM(length) FILTER (WHERE has_been_run), 0)
+        FROM new_rows
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET total_segments = s.total_segments + EXCLUDED.total_segments,
+            run_segments = s.run_segments + EXCLUDED.run_segments,
+            total_length = s.total_length + EXCLUDED.total_length,
+            run_length = s.run_length + EXCLUDED.run_length,
+            updated_at = NOW();
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO user_segment_stats AS s (user_id, total_segments, run_segments, total_length, run_length)
+        SELECT user_id,
+               -COUNT(*),
+               -COUNT(*) FILTER (WHERE has_been_run),
+               -COALESCE(SUM(length), 0),
+               -COALESCE(SUM(length) FILTER (WHERE has_been_run), 0)
+        FROM old_rows
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET total_segments = s.total_segments + EXCLUDED.total_segments,
+            run_segments = s.run_segments + EXCLUDED.run_segments,
+            total_length = s.total_length + EXCLUDED.total_length,
+            run_length = s.run_length + EXCLUDED.run_length,
+            updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- Transition tables allow one event per trigger
+DROP TRIGGER IF EXISTS user_segment_stats_insert ON user_road_segments;
+CREATE TRIGGER user_segment_stats_insert
+    AFTER INSERT ON user_road_segments
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_segment_stats_apply();
+
+DROP TRIGGER IF EXISTS user_segment_stats_update ON user_road_segments;
+CREATE TRIGGER user_segment_stats_update
+    AFTER UPDATE ON user_road_segments
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_segment_stats_apply();
+
+DROP TRIGGER IF EXISTS user_segment_stats_delete ON user_road_segments;
+CREATE TRIGGER user_segment_stats_delete
+    AFTER DELETE ON user_road_segments
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_segment_stats_apply();
+
+-- Start from the current totals
+INSERT INTO user_segment_stats (user_id, total_segments, run_segments, total_length, run_length)
+SELECT user_id,
+       COUNT(*),
+       COUNT(*) FILTER (WHERE has_been_run),
+       COALESCE(SUM(length), 0),
+       COALESCE(SUM(length) FILTER (WHERE has_been_run), 0)
+FROM user_road_segments
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE
+SET total_segments = EXCLUDED.total_segments,
+    run_segments = EXCLUDED.run_segments,
+    total_length = EXCLUDED.total_length,
+    run_length = EXCLUDED.run_length,
+    updated_at = NOW();
@@ -1,8 +1,10 @@
-from sqlalchemy import Column, Integer, BigInteger, Float, String, DateTime, ForeignKey, Boolean, Table, UniqueConstraint
+from sqlalchemy import Column, Integer, BigInteger, Float, String, DateTime, ForeignKey, Boolean, Table, UniqueConstraint, Index, LargeBinary, event
 from sqlalchemy.orm import relationship
 from geoalchemy2 import Geometry
 from .config import Base
+from .sql_script import MIGRATIONS_FOLDER, read_statements
 from datetime import datetime
+import os
 
 # Association table for Route-RoadSegment many-to-many relationship
 route_segments = Table(
@@ -11,7 +13,8 @@ route_segments = Table(
     Column('route_id', Integer, ForeignKey('routes.id'), primary_key=True),
     Column('segment_id', String, ForeignKey('road_segments.segment_id'), nullable=False),
     Column('segment_order', Integer, primary_key=True),  # Order of segments within the route
-    Column('direction', Boolean, nullable=False)  # True for forward, False for reverse
+    Column('direction', Boolean, nullable=False),  # True for forward, False for reverse
+    Index('ix_route_segments_segment_id', 'segment_id')
 )
 
 class User(Base):
@@ -39,6 +42,10 @@ class UserRoadSegment(Base):
     first_run_activity_id = Column(Integer, ForeignKey('activities.id'))
     first_run_timestamp = Column(DateTime)
     
+    # Union of the parts of the segment run so far, see database.coverage
+    covered_intervals = Column(LargeBinary)
+    coverage = Column(Float, default=0.0)  # fraction of the segment covered, 0 to 1
+    
     # Geometry column for the road segment
     geometry = Column(Geometry('LINESTRING'))
     
@@ -54,8 +61,21 @@ class UserRoadSegment(Base):
     # Unique constraint to ensure one segment per user
     __table_args__ = (
         UniqueConstraint('user_id', 'segment_id', name='uix_user_segment'),
+        Index('ix_user_road_segments_user_run', 'user_id', 'has_been_run'),
     )
 
+# Per-user road segment totals, kept up to date by triggers on user_road_segments
+# (see database/migrations/002_user_segment_stats_rollup.sql)
+class UserSegmentStats(Base):
+    __tablename__ = 'user_segment_stats'
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    total_segments = Column(Integer, nullable=False, default=0)
+    run_segments = Column(Integer, nullable=False, default=0)
+    total_length = Column(Float, nullable=False, default=0.0)  # in meters
+    run_length = Column(Float, nullable=False, default=0.0)  # in meters
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 class Activity(Base):
     __tablename__ = 'activities'
 
@@ -73,12 +93,56 @@ class Activity(Base):
     # Geometry column for the activity path
     path = Column(Geometry('LINESTRING'))
     
+    # Bounding box of the activity path, used to skip activities outside an area
+    min_lat = Column(Float)
+    min_lon = Column(Float)
+    max_lat = Column(Float)
+    max_lon = Column(Float)
+    
+    # Compressed columnar GPS samples, see database.track_codec
+    track = Column(LargeBinary)
+    
+    # When the activity was map matched onto road segments (see activity_segments)
+    matched_at = Column(DateTime)
+    
     # Metadata
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
     user = relationship("User", back_populates="activities")
     gps_points = relationship("GPSPoint", back_populates="activity", cascade="all, delete-orphan")
+    segments = relationship("ActivitySegment", back_populates="activity", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index('ix_activities_user_bbox', 'user_id', 'min_lat', 'max_lat', 'min_lon', 'max_lon'),
+    )
+
+class ActivitySegment(Base):
+    __tablename__ = 'activity_segments'
+
+    activity_id = Column(Integer, ForeignKey('activities.id', ondelete='CASCADE'), primary_key=True)
+    segment_id = Column(String, primary_key=True)
+    coverage = Column(Float, nullable=False)  # fraction of the segment covered, 0 to 1
+    intervals = Column(LargeBinary)  # covered parts of the segment, see database.coverage
+    
+    # Relationship with activity
+    activity = relationship("Activity", back_populates="segments")
+    
+    __table_args__ = (
+        Index('ix_activity_segments_segment_id', 'segment_id'),
+    )
+
+class ImportedFile(Base):
+    __tablename__ = 'import_manifest'
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    path = Column(String, primary_key=True)
+    size = Column(BigInteger, nullable=False)  # in bytes
+    mtime = Column(Float, nullable=False)  # modification time, seconds since the epoch
+    content_hash = Column(String, nullable=False)  # SHA-256 of the file contents
+    activity_id = Column(Integer, ForeignKey('activities.id', ondelete='SET NULL'))
+    status = Column(String, nullable=False, default='imported')  # 'imported' or 'failed'
+    imported_at = Column(DateTime, default=datetime.utcnow)
 
 class GPSPoint(Base):
     __tablename__ = 'gps_points'
@@ -99,6 +163,10 @@ class GPSPoint(Base):
     
     # Relationship with activity
     activity = relationship("Activity", back_populates="gps_points")
+    
+    __table_args__ = (
+        Index('ix_gps_points_activity_id', 'activity_id'),
+    )
 
 class Location(Base):
     __tablename__ = 'locations'
@@ -144,6 +212,10 @@ class Route(Base):
         order_by=route_segments.c.segment_order,
         back_populates="routes"
     )
+    
+    __table_args__ = (
+        Index('ix_routes_location_id', 'location_id'),
+    )
 
 class RoadSegment(Base):
     __tablename__ = 'road_segments'
@@ -168,4 +240,18 @@ class RoadSegment(Base):
         "Route",
         secondary=route_segments,
         back_populates="road_segments"
-    ) 
\ No newline at end of file
+    ) 
+
+@event.listens_for(Base.metadata, 'after_create')
+def install_segment_stats_triggers(target, connection, **kw):
+    """Install the user_segment_stats rollup triggers whenever the tables are created.
+
+    create_all (init_db, clear_database) creates user_road_segments without the
+    triggers of migration 002, which schema_migrations may already list as applied,
+    so its statements are run again here. They are idempotent and end by
+    recomputing the rollup from the current rows.
+    """
+    if connection.dialect.name != 'postgresql':
+        return
+    for statement in read_statements(os.path.join(MIGRATIONS_FOLDER, '002_user_segment_stats_rollup.sql')):
+        connection.exec_driver_sql(statement)
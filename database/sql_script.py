@@ -0,0 +1,77 @@
+"""
+Reading SQL scripts such as the numbered files in database/migrations.
+
+Scripts are split into statements at semicolons, leaving string literals and
+dollar-quoted function bodies whole, so each statement can be run on its own
+(CREATE INDEX CONCURRENTLY cannot run inside a multi-statement transaction).
+"""
+import os
+import re
+
+MIGRATIONS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+_DOLLAR_QUOTE = re.compile(r'\$[A-Za-z_]*\$')
+
+def _quoted_end(sql, i):
+    """End of the string literal, quoted identifier or dollar-quoted body starting at i, or None"""
+    if sql[i] in ("'", '"'):
+        end = sql.find(sql[i], i + 1)
+        # A doubled quote is an escaped quote inside the literal
+        while end != -1 and sql.startswith(sql[i], end + 1):
+            end = sql.find(sql[i], end + 2)
+        return len(sql) if end == -1 else end + 1
+    match = _DOLLAR_QUOTE.match(sql, i) if sql[i] == '$' else None
+    if match:
+        end = sql.find(match.group(), match.end())
+        return len(sql) if end == -1 else end + len(match.group())
+    return None
+
+def strip_comments(sql):
+    """Remove -- and /* */ comments outside string literals and dollar-quoted bodies"""
+    stripped = []
+    i = 0
+    while i < len(sql):
+        if sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = len(sql) if end == -1 else end
+        elif sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = len(sql) if end == -1 else end + 2
+            stripped.append(' ')
+        elif (end := _quoted_end(sql, i)) is not None:
+            stripped.append(sql[i:end])
+            i = end
+        else:
+            stripped.append(sql[i])
+            i += 1
+    return ''.join(stripped)
+
+def created_indexes(statements):
+    """Names of the indexes created by CREATE INDEX statements"""
+    pattern = re.compile(
+        r'^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?("?[\w.]+"?)',
+        re.IGNORECASE
+    )
+    return [match.group(1) for match in map(pattern.match, statements) if match]
+
+def split_statements(sql):
+    """Split comment-free SQL into statements at semicolons outside quotes and dollar-quoted bodies"""
+    statements = []
+    start = 0
+    i = 0
+    while i < len(sql):
+        if sql[i] == ';':
+            statements.append(sql[start:i].strip())
+            start = i + 1
+            i += 1
+        elif (end := _quoted_end(sql, i)) is not None:
+            i = end
+        else:
+            i += 1
+    statements.append(sql[start:].strip())
+    return [statement for statement in statements if statement]
+
+def read_statements(path):
+    """Statements of a SQL script file, without comments"""
+    with open(path) as f:
+        return split_statements(strip_comments(f.read()))
@@ -0,0 +1,102 @@
+"""
+Compact storage of an activity's GPS samples in a single bytea column.
+
+Each column (latitude, longitude, elevation, time, heart rate, cadence) is scaled
+to integers, delta encoded so that consecutive samples become small numbers, and
+the whole track is zlib compressed. Missing values are kept in a per-column
+validity bitmap and decode to NaN.
+"""
+import struct
+import zlib
+from datetime import timezone
+import numpy as np
+
+TRACK_FORMAT_VERSION = 1
+
+# (column, scale to integer units, stored dtype)
+TRACK_COLUMNS = [
+    ('latitude', 1e7, '<i4'),    # 1e-7 degrees, about 1 cm
+    ('longitude', 1e7, '<i4'),
+    ('elevation', 100, '<i4'),   # centimeters
+    ('timestamp', 1000, '<i8'),  # milliseconds since the epoch
+    ('heart_rate', 1, '<i4'),
+    ('cadence', 1, '<i4'),
+]
+
+_HEADER = struct.Struct('<BI')
+
+def _point_value(point, column):
+    """Numeric value of a column in a GPS point dict, or None if missing"""
+    value = point.get(column)
+    if value is not None and column == 'timestamp':
+        # Naive datetimes are UTC, as when read back from gps_points
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return value
+
+def encode_track(gps_points_data):
+    """
+    Encode GPS points into compressed columnar bytes
+
+    Args:
+        gps_points_data: List of GPS point dicts with latitude, longitude and optionally
+            elevation, timestamp (datetime, naive values taken as UTC), heart_rate and cadence
+
+    Returns:
+        bytes to store in Activity.track
+    """
+    count = len(gps_points_data)
+    chunks = []
+    for column, scale, dtype in TRACK_COLUMNS:
+        values = np.array(
+            [np.nan if (value := _point_value(point, column)) is None else value for point in gps_points_data],
+            dtype=float
+        )
+        valid = ~np.isnan(values)
+
+        # Carry the last valid value over gaps so they cost nothing after delta encoding
+        last_valid = np.maximum.accumulate(np.where(valid, np.arange(count), 0))
+        filled = np.where(valid[last_valid], values[last_valid], 0.0) if count else values
+        scaled = np.round(filled * scale).astype(np.int64)
+
+        chunks.append(np.packbits(valid).tobytes())
+        chunks.append(np.diff(scaled, prepend=0).astype(dtype).tobytes())
+
+    return _HEADER.pack(TRACK_FORMAT_VERSION, count) + zlib.compress(b''.join(chunks), 6)
+
+def decode_track(data):
+    """
+    Decode bytes produced by encode_track
+
+    Args:
+        data: Contents of Activity.track
+
+    Returns:
+        Dictionary mapping each column name to a float NumPy array, with NaN for
+        missing values; timestamp is in seconds since the epoch
+    """
+    version, count = _HEADER.unpack_from(data)
+    if version != TRACK_FORMAT_VERSION:
+        raise ValueError(f"Unsupported track format version {version}")
+
+    payload = zlib.decompress(data[_HEADER.size:])
+    track = {}
+    offset = 0
+    for column, scale, dtype in TRACK_COLUMNS:
+        mask_size = (count + 7) // 8
+        valid = np.unpackbits(np.frombuffer(payload, dtype=np.uint8, count=mask_size, offset=offset), count=count).astype(bool)
+        offset += mask_size
+
+        deltas = np.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+        offset += deltas.nbytes
+
+        values = np.cumsum(deltas, dtype=np.int64) / scale
+        values[~valid] = np.nan
+        track[column] = values
+
+    return track
+
+def track_length(data):
+    """Number of GPS samples in bytes produced by encode_track, read from the header"""
+    return _HEADER.unpack_from(data)[1]
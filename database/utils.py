@@ -1,12 +1,19 @@
-from sqlalchemy import text, insert, func, and_
+from sqlalchemy import text, insert, func, and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from geoalchemy2.shape import from_shape, to_shape
 from geoalchemy2.functions import ST_Intersects, ST_Length, ST_LineSubstring
 from shapely.geometry import Point, LineString, mapping
 from shapely.ops import linemerge
-from .models import User, Location, Route, GPSPoint, RoadSegment, Activity, UserRoadSegment, route_segments
-from .config import engine, Base
-from datetime import datetime
+from .models import User, Location, Route, GPSPoint, RoadSegment, Activity, ActivitySegment, ImportedFile, UserRoadSegment, UserSegmentStats, route_segments
+from .config import engine, Base, STORE_GPS_POINTS
+from .track_codec import encode_track, decode_track, TRACK_COLUMNS
+from .coverage import merge_intervals, union_intervals, covered_fraction, encode_intervals, decode_intervals
+from datetime import datetime, timezone
+import csv
+import io
 import logging
+import math
+import numpy as np
 
 def init_db():
     """Initialize the database by creating all tables"""
@@ -141,6 +148,68 @@ def add_road_segment(db, osm_id, segment_id, node_u, node_v, name, road_type, co
     db.commit()
     return segment
 
+def add_road_segments(db, segments, batch_size=1000):
+    """
+    Insert many road segments at once, skipping those that already exist
+    
+    Rows are written with multi-row INSERT ... ON CONFLICT (segment_id) DO NOTHING
+    statements of up to batch_size rows. The caller commits.
+    
+    Args:
+        db: SQLAlchemy session
+        segments: List of dicts with the arguments of add_road_segment (osm_id,
+            segment_id, node_u, node_v, name, road_type, coordinates, and optionally
+            length and classification)
+        batch_size: Number of rows per INSERT statement
+        
+    Returns:
+        Number of segments inserted
+    """
+    rows = {}
+    for segment in segments:
+        if segment['segment_id'] in rows:
+            continue
+        rows[segment['segment_id']] = {
+            'osm_id': segment['osm_id'],
+            'segment_id': segment['segment_id'],
+            'node_u': segment['node_u'],
+            'node_v': segment['node_v'],
+            'name': segment['name'],
+            'road_type': segment['road_type'],
+            'length': segment.get('length'),
+            'classification': segment.get('classification'),
+            'geometry': from_shape(LineString(segment['coordinates'])),
+            'last_updated': datetime.utcnow()
+        }
+    rows = list(rows.values())
+    
+    inserted = 0
+    for start in range(0, len(rows), batch_size):
+        stmt = (
+            pg_insert(RoadSegment)
+            .values(rows[start:start + batch_size])
+            .on_conflict_do_nothing(index_elements=['segment_id'])
+            .returning(RoadSegment.segment_id)
+        )
+        inserted += len(db.execute(stmt).all())
+    return inserted
+
+def get_segment_lengths(db, segment_ids):
+    """
+    Get the lengths of road segments with one query
+    
+    Args:
+        db: SQLAlchemy session
+        segment_ids: Iterable of segment IDs
+        
+    Returns:
+        Dictionary of segment_id -> length in meters for the segments that exist
+    """
+    return dict(
+        db.query(RoadSegment.segment_id, RoadSegment.length)
+        .filter(RoadSegment.segment_id.in_(list(segment_ids)))
+    )
+
 def create_route_with_segments(db, location_id, name, description, segment_ids, segment_directions):
     """
     Create a new route from existing road segments
@@ -153,36 +222,72 @@ def create_route_with_segments(db, location_id, name, description, segment_ids,
         segment_ids: List of road segment IDs in order (using segment_id field)
         segment_directions: List of booleans indicating direction for each segment (True=forward, False=reverse)
     """
-    # Create the route
-    route = Route(
-        location_id=location_id,
-        name=name,
-        description=description
-    )
-    db.add(route)
-    db.flush()  # Get route ID
+    route_id, = create_routes_with_segments(db, location_id, [{
+        'name': name,
+        'description': description,
+        'segment_ids': segment_ids,
+        'segment_directions': segment_directions
+    }])
+    db.commit()
+    return db.get(Route, route_id)
+
+def create_routes_with_segments(db, location_id, routes, segment_lengths=None):
+    """
+    Create many routes from existing road segments with a few multi-row statements
     
-    # Add segments to route with order and direction
-    for order, (segment_id, direction) in enumerate(zip(segment_ids, segment_directions)):
-        stmt = insert(route_segments).values(
-            route_id=route.id,
-            segment_id=segment_id,
-            segment_order=order,
-            direction=direction
+    Each route's distance is the sum of its segments' lengths, counting repeated
+    segments every time they are traversed. The caller commits.
+    
+    Args:
+        db: SQLAlchemy session
+        location_id: ID of the location the routes belong to
+        routes: List of dicts with name, description, segment_ids, segment_directions
+            and optionally node_count
+        segment_lengths: Optional dict of segment_id -> length in meters; loaded
+            with one query when not given
+        
+    Returns:
+        List of the new route IDs, in the order of routes
+    """
+    if not routes:
+        return []
+    
+    if segment_lengths is None:
+        segment_lengths = get_segment_lengths(
+            db, {segment_id for route in routes for segment_id in route['segment_ids']}
         )
-        db.execute(stmt)
     
-    # Calculate total distance properly handling repeated segments
-    total_distance = 0
-    for segment_id in segment_ids:
-        segment = db.query(RoadSegment).filter(RoadSegment.segment_id == segment_id).first()
-        if segment and segment.length:
-            total_distance += segment.length
+    route_rows = [
+        {
+            'location_id': location_id,
+            'name': route['name'],
+            'description': route['description'],
+            'node_count': route.get('node_count', 0),
+            'distance': sum(segment_lengths.get(segment_id) or 0 for segment_id in route['segment_ids']),
+            'created_at': datetime.utcnow()
+        }
+        for route in routes
+    ]
+    route_ids = db.execute(
+        insert(Route).returning(Route.id, sort_by_parameter_order=True),
+        route_rows
+    ).scalars().all()
     
-    route.distance = total_distance
+    # Add segments to routes with order and direction
+    segment_rows = [
+        {
+            'route_id': route_id,
+            'segment_id': segment_id,
+            'segment_order': order,
+            'direction': direction
+        }
+        for route_id, route in zip(route_ids, routes)
+        for order, (segment_id, direction) in enumerate(zip(route['segment_ids'], route['segment_directions']))
+    ]
+    if segment_rows:
+        db.execute(insert(route_segments), segment_rows)
     
-    db.commit()
-    return route
+    return route_ids
 
 def get_route_segments(db, route_id):
     """
@@ -208,6 +313,88 @@ def get_location_routes(db, location_id):
     """Get all routes for a specific location"""
     return db.query(Route).filter(Route.location_id == location_id).all()
 
+def get_location_segment_ids(db, location_id):
+    """Get the IDs of the road segments used by a location's routes"""
+    return {
+        segment_id
+        for (segment_id,) in db.query(route_segments.c.segment_id)
+        .join(Route, Route.id == route_segments.c.route_id)
+        .filter(Route.location_id == location_id)
+        .distinct()
+    }
+
+def get_location_route_geometries(db, location_id):
+    """
+    Get every route of a location with its ordered segments and their coordinates
+
+    Segment geometries are returned as GeoJSON coordinates by the server, and the
+    extent of all segments is computed alongside them, so the whole location is
+    fetched in one round-trip however many routes it has.
+
+    Args:
+        db: SQLAlchemy session
+        location_id: ID of the location
+
+    Returns:
+        Tuple of (routes, extent) where routes is a list of dicts with id, name,
+        distance and segments in route order, each segment a dict with segment_id,
+        name, osm_id, road_type, length, direction, order and coords as a list of
+        (lat, lon) pairs, or None if it has no geometry; extent is
+        (min_lat, min_lon, max_lat, max_lon), or None if no segment has geometry
+    """
+    rows = db.execute(text("""
+        WITH segments AS (
+            SELECT rs.route_id, rs.segment_order, rs.direction,
+                   s.segment_id, s.name, s.osm_id, s.road_type, s.length, s.geometry
+            FROM route_segments rs
+            JOIN routes r ON r.id = rs.route_id
+            JOIN road_segments s ON s.segment_id = rs.segment_id
+            WHERE r.location_id = :location_id
+        ),
+        extent AS (
+            SELECT ST_Extent(geometry) AS box FROM segments
+        )
+        SELECT r.id, r.name, r.distance,
+               COALESCE((
+                   SELECT json_agg(json_build_object(
+                       'segment_id', s.segment_id,
+                       'name', s.name,
+                       'osm_id', s.osm_id,
+                       'road_type', s.road_type,
+                       'length', s.length,
+                       'direction', s.direction,
+                       'order', s.segment_order,
+                       'coords', ST_AsGeoJSON(s.geometry)::json -> 'coordinates'
+                   ) ORDER BY s.segment_order)
+                   FROM segments s
+                   WHERE s.route_id = r.id
+               ), '[]') AS segments,
+               ST_XMin(extent.box) AS min_lat, ST_YMin(extent.box) AS min_lon,
+               ST_XMax(extent.box) AS max_lat, ST_YMax(extent.box) AS max_lon
+        FROM routes r
+        CROSS JOIN extent
+        WHERE r.location_id = :location_id
+        ORDER BY r.id
+    """), {'location_id': location_id}).mappings().all()
+
+    routes = []
+    for row in rows:
+        # Segment geometry is stored as (lat, lon) in (x, y)
+        for segment in row['segments']:
+            if segment['coords'] is not None:
+                segment['coords'] = [(coord[0], coord[1]) for coord in segment['coords']]
+        routes.append({
+            'id': row['id'],
+            'name': row['name'],
+            'distance': row['distance'],
+            'segments': row['segments']
+        })
+
+    extent = None
+    if rows and rows[0]['min_lat'] is not None:
+        extent = (rows[0]['min_lat'], rows[0]['min_lon'], rows[0]['max_lat'], rows[0]['max_lon'])
+    return routes, extent
+
 def get_location_segments(db, location_id):
     """Get all road segments for a specific location"""
     return db.query(RoadSegment).filter(RoadSegment.location_id == location_id).all()
@@ -268,7 +455,8 @@ def add_segments_to_route(db, route_id, segment_osm_ids, segment_directions):
     db.commit()
 
 def create_activity(db, user_id, strava_id, name, activity_type, start_time, gps_points_data,
-                   distance=None, duration=None, elevation_gain=None, average_speed=None):
+                   distance=None, duration=None, elevation_gain=None, average_speed=None,
+                   store_points=None):
     """
     Create a new activity with GPS points from Strava data
     
@@ -286,7 +474,12 @@ def create_activity(db, user_id, strava_id, name, activity_type, start_time, gps
         duration: Total duration in seconds
         elevation_gain: Total elevation gain in meters
         average_speed: Average speed in meters per second
+        store_points: Whether to also store a gps_points row per point, defaults to
+            STORE_GPS_POINTS; the compressed track is always stored on the activity
     """
+    if store_points is None:
+        store_points = STORE_GPS_POINTS
+    
     # Create LineString from GPS points for the activity path
     line_points = [(p['longitude'], p['latitude']) for p in gps_points_data]
     line_string = LineString(line_points)
@@ -302,34 +495,136 @@ def create_activity(db, user_id, strava_id, name, activity_type, start_time, gps
         duration=duration,
         elevation_gain=elevation_gain,
         average_speed=average_speed,
-        path=from_shape(line_string)
+        path=from_shape(line_string),
+        min_lat=min(p['latitude'] for p in gps_points_data),
+        min_lon=min(p['longitude'] for p in gps_points_data),
+        max_lat=max(p['latitude'] for p in gps_points_data),
+        max_lon=max(p['longitude'] for p in gps_points_data),
+        track=encode_track(gps_points_data)
     )
     db.add(activity)
     db.flush()  # Get activity ID
     
     # Add GPS points
-    for point_data in gps_points_data:
-        point = GPSPoint(
-            activity_id=activity.id,
-            latitude=point_data['latitude'],
-            longitude=point_data['longitude'],
-            elevation=point_data.get('elevation'),
-            timestamp=point_data['timestamp'],
-            distance=point_data.get('distance'),
-            heart_rate=point_data.get('heart_rate'),
-            cadence=point_data.get('cadence'),
-            speed=point_data.get('speed'),
-            location=from_shape(Point(point_data['longitude'], point_data['latitude']))
-        )
-        db.add(point)
+    if store_points:
+        copy_gps_points(db, activity.id, gps_points_data)
     
     db.commit()
     return activity
 
+GPS_POINT_COLUMNS = ['latitude', 'longitude', 'elevation', 'timestamp', 'distance', 'heart_rate', 'cadence', 'speed']
+
+def copy_gps_points(db, activity_id, gps_points_data):
+    """
+    Bulk insert an activity's GPS points with COPY
+    
+    The points are streamed as CSV into a temporary staging table and moved into
+    gps_points with one INSERT ... SELECT that builds each location with
+    ST_MakePoint on the server. The caller commits.
+    
+    Args:
+        db: SQLAlchemy session
+        activity_id: ID of the activity the points belong to
+        gps_points_data: List of GPS point dicts as passed to create_activity
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for point_data in gps_points_data:
+        row = [point_data.get(column) for column in GPS_POINT_COLUMNS]
+        # gps_points.timestamp has no time zone and is read back as UTC, and a cast to
+        # it would drop the offset, so aware values are written as naive UTC
+        timestamp = row[3]
+        if timestamp is not None and timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        row[3] = timestamp.isoformat() if timestamp is not None else None
+        writer.writerow(['' if value is None else value for value in row])
+    buffer.seek(0)
+    
+    db.execute(text("""
+        CREATE TEMP TABLE IF NOT EXISTS gps_points_staging (
+            latitude double precision,
+            longitude double precision,
+            elevation double precision,
+            timestamp timestamp,
+            distance double precision,
+            heart_rate integer,
+            cadence integer,
+            speed double precision
+        ) ON COMMIT DELETE ROWS
+    """))
+    
+    # COPY goes through the DB-API cursor of the session's own connection, inside its transaction
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY gps_points_staging ({', '.join(GPS_POINT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+    
+    db.execute(text(f"""
+        INSERT INTO gps_points (activity_id, {', '.join(GPS_POINT_COLUMNS)}, location)
+        SELECT :activity_id, {', '.join(GPS_POINT_COLUMNS)}, ST_MakePoint(longitude, latitude)
+        FROM gps_points_staging
+    """), {'activity_id': activity_id})
+    db.execute(text("TRUNCATE gps_points_staging"))
+
 def get_user_activities(db, user_id):
     """Get all activities for a specific user"""
     return db.query(Activity).filter(Activity.user_id == user_id).order_by(Activity.start_time.desc()).all()
 
+def get_user_activities_in_bbox(db, user_id, min_lat, min_lon, max_lat, max_lon, margin=0):
+    """
+    Get a user's activities whose bounding box overlaps an area
+    
+    Activities imported before bounding boxes were stored have none and are always included.
+    
+    Args:
+        db: SQLAlchemy session
+        user_id: ID of the user
+        min_lat, min_lon, max_lat, max_lon: Bounds of the area in degrees
+        margin: Distance in meters to grow the area by on every side
+    """
+    lat_margin = margin / 111320
+    lon_margin = margin / (111320 * max(math.cos(math.radians((min_lat + max_lat) / 2)), 0.01))
+    
+    return db.query(Activity)\
+        .filter(Activity.user_id == user_id)\
+        .filter(or_(
+            Activity.min_lat.is_(None),
+            and_(
+                Activity.min_lat <= max_lat + lat_margin,
+                Activity.max_lat >= min_lat - lat_margin,
+                Activity.min_lon <= max_lon + lon_margin,
+                Activity.max_lon >= min_lon - lon_margin
+            )
+        ))\
+        .order_by(Activity.start_time.desc())\
+        .all()
+
+def get_user_activities_in_areas(db, user_id, areas, margin=0):
+    """
+    Get a user's activities whose bounding box overlaps any of several areas
+    
+    Each area is queried separately, so areas far apart (locations in different
+    cities) do not widen into one box covering everything between them.
+    
+    Args:
+        db: SQLAlchemy session
+        user_id: ID of the user
+        areas: Iterable of (min_lat, min_lon, max_lat, max_lon) bounds in degrees
+        margin: Distance in meters to grow each area by on every side
+        
+    Returns:
+        List of activities, newest first, each included once
+    """
+    activities = {}
+    for min_lat, min_lon, max_lat, max_lon in areas:
+        for activity in get_user_activities_in_bbox(db, user_id, min_lat, min_lon, max_lat, max_lon, margin):
+            activities[activity.id] = activity
+    return sorted(activities.values(), key=lambda activity: activity.start_time, reverse=True)
+
 def get_activity_by_strava_id(db, strava_id):
     """Get an activity by its Strava ID"""
     return db.query(Activity).filter(Activity.strava_id == strava_id).first()
@@ -345,6 +640,78 @@ def get_activity_gps_points(db, activity_id):
         .order_by(GPSPoint.timestamp)\
         .all()
 
+def get_activity_track(db, activity_id):
+    """
+    Get all GPS samples of an activity as NumPy arrays
+    
+    Reads the compressed track stored on the activity in one row fetch, falling
+    back to the gps_points rows for activities stored before tracks were.
+    
+    Args:
+        db: SQLAlchemy session
+        activity_id: ID of the activity
+        
+    Returns:
+        Dictionary of float arrays (see track_codec.decode_track) in chronological
+        order, or None if the activity does not exist
+    """
+    row = db.query(Activity.track).filter(Activity.id == activity_id).first()
+    if row is None:
+        return None
+    if row.track is not None:
+        return decode_track(row.track)
+    
+    columns = [column for column, _, _ in TRACK_COLUMNS]
+    rows = db.query(*[getattr(GPSPoint, column) for column in columns])\
+        .filter(GPSPoint.activity_id == activity_id)\
+        .order_by(GPSPoint.timestamp)\
+        .all()
+    track = {}
+    for column, values in zip(columns, zip(*rows) if rows else [()] * len(columns)):
+        if column == 'timestamp':
+            # Naive timestamps are UTC, as in track_codec.encode_track
+            values = [
+                (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp() if value else None
+                for value in values
+            ]
+        track[column] = np.array([np.nan if value is None else value for value in values], dtype=float)
+    return track
+
+def get_import_manifest(db, user_id):
+    """Get the files a user has imported, keyed by path"""
+    return {
+        entry.path: entry
+        for entry in db.query(ImportedFile).filter(ImportedFile.user_id == user_id)
+    }
+
+def record_imported_file(db, user_id, path, size, mtime, content_hash, activity_id, status='imported'):
+    """
+    Add or update a file in a user's import manifest; saved with the next commit
+    
+    Files that failed to load are recorded too, with status 'failed' and no
+    activity, so they are not retried until they change.
+    
+    Args:
+        db: SQLAlchemy session
+        user_id: ID of the user who imported the file
+        path: Path of the imported file
+        size: File size in bytes
+        mtime: File modification time in seconds since the epoch
+        content_hash: SHA-256 hex digest of the file contents
+        activity_id: ID of the activity the file was imported as, or None
+        status: 'imported', or 'failed' if the file could not be loaded
+    """
+    return db.merge(ImportedFile(
+        user_id=user_id,
+        path=path,
+        size=size,
+        mtime=mtime,
+        content_hash=content_hash,
+        activity_id=activity_id,
+        status=status,
+        imported_at=datetime.utcnow()
+    ))
+
 def get_user_activities_in_timerange(db, user_id, start_time, end_time):
     """Get all activities for a user within a specific time range"""
     return db.query(Activity)\
@@ -400,88 +767,328 @@ def sync_user_road_segments(db, user_id):
     """
     Synchronize user's road segments based on their locations and routes.
     This ensures UserRoadSegment table has all segments from user's locations/routes.
-    """
-    # Get all road segments from user's locations through routes
-    location_segments = (
-        db.query(RoadSegment)
-        .join(route_segments)
-        .join(Route)
-        .join(Location)
-        .filter(Location.user_id == user_id)
-        .distinct()
-        .all()
-    )
     
-    # For each segment, create or update UserRoadSegment
-    for segment in location_segments:
-        user_segment = (
-            db.query(UserRoadSegment)
-            .filter(
-                UserRoadSegment.user_id == user_id,
-                UserRoadSegment.segment_id == segment.segment_id
-            )
-            .first()
-        )
-        
-        if not user_segment:
-            user_segment = UserRoadSegment(
-                user_id=user_id,
-                segment_id=segment.segment_id,
-                name=segment.name,
-                road_type=segment.road_type,
-                length=segment.length,
-                classification=segment.classification,
-                geometry=segment.geometry
-            )
-            db.add(user_segment)
+    New segments are copied with a single INSERT ... SELECT on the server; segments
+    the user already has are left untouched.
     
+    Returns:
+        Number of segments added
+    """
     try:
+        result = db.execute(text("""
+            INSERT INTO user_road_segments (
+                user_id, segment_id, name, road_type, length, classification, geometry,
+                has_been_run, coverage, created_at, last_updated
+            )
+            SELECT DISTINCT ON (rs.segment_id)
+                :user_id, rs.segment_id, rs.name, rs.road_type, rs.length, rs.classification, rs.geometry,
+                false, 0, now() AT TIME ZONE 'utc', now() AT TIME ZONE 'utc'
+            FROM road_segments rs
+            JOIN route_segments rts ON rts.segment_id = rs.segment_id
+            JOIN routes r ON r.id = rts.route_id
+            JOIN locations l ON l.id = r.location_id
+            WHERE l.user_id = :user_id
+            ON CONFLICT (user_id, segment_id) DO NOTHING
+        """), {'user_id': user_id})
         db.commit()
+        return result.rowcount
     except Exception as e:
         db.rollback()
         print(f"Error syncing user road segments: {str(e)}")
+        return 0
+
+def _traversal_intervals(traversals):
+    """Merged interval set of each segment in a list of traversals"""
+    intervals = {}
+    for segment_id, start, end in traversals:
+        intervals.setdefault(segment_id, []).append((start, end))
+    return {segment_id: merge_intervals(segment_intervals) for segment_id, segment_intervals in intervals.items()}
+
+def _nearby_segment_traversals(db, user_id, activity_id, tolerance):
+    """
+    Parts of a user's unrun segments within tolerance meters of an activity's path
+    
+    Computed in PostGIS: candidates are found with the GiST index on the segment
+    geometry, confirmed with ST_DWithin on geography, and cut to the buffered path.
+    Segment geometry is stored as (lat, lon) and activity paths as (lon, lat), so
+    segments are flipped before they are compared.
+    
+    Returns:
+        List of (segment_id, start_fraction, end_fraction) traversals
+    """
+    rows = db.execute(text("""
+        WITH activity AS (
+            SELECT ST_SetSRID(path, 4326)::geography AS path,
+                   ST_Buffer(ST_SetSRID(path, 4326)::geography, :tolerance)::geometry AS area
+            FROM activities
+            WHERE id = :activity_id
+        ),
+        candidates AS (
+            SELECT urs.segment_id, ST_SetSRID(ST_FlipCoordinates(urs.geometry), 4326) AS line, activity.area
+            FROM user_road_segments urs, activity
+            WHERE urs.user_id = :user_id
+              AND urs.has_been_run IS NOT TRUE
+              AND urs.geometry && ST_SetSRID(ST_FlipCoordinates(ST_Envelope(activity.area)), 0)
+              AND ST_DWithin(ST_SetSRID(ST_FlipCoordinates(urs.geometry), 4326)::geography, activity.path, :tolerance)
+        ),
+        pieces AS (
+            SELECT segment_id, line, (ST_Dump(ST_Intersection(line, area))).geom AS piece
+            FROM candidates
+        )
+        SELECT segment_id,
+               ST_LineLocatePoint(line, ST_StartPoint(piece)),
+               ST_LineLocatePoint(line, ST_EndPoint(piece))
+        FROM pieces
+        WHERE ST_GeometryType(piece) = 'ST_LineString'
+    """), {'user_id': user_id, 'activity_id': activity_id, 'tolerance': tolerance})
+    return [tuple(row) for row in rows]
 
-def update_segment_run_status(db, user_id, activity_id):
+def store_activity_segments(db, activity_id, segment_intervals):
+    """
+    Record the road segments an activity covered in the activity_segments table
+    
+    Args:
+        db: SQLAlchemy session
+        activity_id: ID of the activity
+        segment_intervals: Dictionary mapping segment IDs to the interval set of the
+            segment the activity covered
+    """
+    db.query(ActivitySegment).filter(ActivitySegment.activity_id == activity_id).delete()
+    if segment_intervals:
+        db.execute(insert(ActivitySegment), [
+            {
+                'activity_id': activity_id,
+                'segment_id': segment_id,
+                'coverage': covered_fraction(intervals),
+                'intervals': encode_intervals(intervals)
+            }
+            for segment_id, intervals in segment_intervals.items()
+        ])
+    db.query(Activity).filter(Activity.id == activity_id).update({Activity.matched_at: datetime.utcnow()})
+
+def update_run_status_from_activity_segments(db, user_id, min_coverage=0.8):
+    """
+    Mark a user's road segments as run from the stored activity coverage
+    
+    Each segment covered by more than min_coverage in any matched activity is
+    marked as run, with the earliest such activity as its first run. For segments
+    still not run, the stored intervals of the activities are added up in start
+    time order; a segment whose union crosses min_coverage is marked as run with
+    the activity that took it over the threshold as its first run, and every such
+    segment's covered intervals are updated with the union.
+    
+    Args:
+        db: SQLAlchemy session
+        user_id: ID of the user
+        min_coverage: Fraction of a segment that must be covered to count as run
+        
+    Returns:
+        Number of segments updated
+    """
+    params = {'user_id': user_id, 'min_coverage': min_coverage}
+    result = db.execute(text("""
+        UPDATE user_road_segments urs
+        SET has_been_run = TRUE,
+            first_run_activity_id = first_run.activity_id,
+            first_run_timestamp = first_run.start_time,
+            last_updated = NOW()
+        FROM (
+            SELECT DISTINCT ON (s.segment_id) s.segment_id, a.id AS activity_id, a.start_time
+            FROM activity_segments s
+            JOIN activities a ON a.id = s.activity_id
+            WHERE a.user_id = :user_id AND s.coverage > :min_coverage
+            ORDER BY s.segment_id, a.start_time
+        ) first_run
+        WHERE urs.user_id = :user_id
+          AND urs.segment_id = first_run.segment_id
+          AND (urs.has_been_run IS NOT TRUE
+               OR urs.first_run_timestamp IS NULL
+               OR urs.first_run_timestamp > first_run.start_time)
+    """), params)
+    updated = result.rowcount
+    
+    # Segments still not run: add up the activities' intervals in the order they were run
+    rows = db.execute(text("""
+        SELECT s.segment_id, a.id AS activity_id, a.start_time, s.intervals, urs.covered_intervals
+        FROM activity_segments s
+        JOIN activities a ON a.id = s.activity_id
+        JOIN user_road_segments urs ON urs.user_id = :user_id AND urs.segment_id = s.segment_id
+        WHERE a.user_id = :user_id AND urs.has_been_run IS NOT TRUE
+        ORDER BY s.segment_id, a.start_time, a.id
+    """), params).all()
+    
+    segments = {}
+    for segment_id, activity_id, start_time, intervals, covered_so_far in rows:
+        segment = segments.setdefault(segment_id, {
+            'covered': np.empty((0, 2)), 'stored': covered_so_far, 'activity_id': None, 'start_time': None
+        })
+        segment['covered'] = union_intervals(segment['covered'], decode_intervals(intervals))
+        if segment['activity_id'] is None and covered_fraction(segment['covered']) > min_coverage:
+            segment['activity_id'] = activity_id
+            segment['start_time'] = start_time
+    
+    if segments:
+        segment_ids = list(segments)
+        covered = [union_intervals(decode_intervals(segments[s]['stored']), segments[s]['covered']) for s in segment_ids]
+        db.execute(text("""
+            UPDATE user_road_segments urs
+            SET covered_intervals = v.covered_intervals,
+                coverage = v.coverage,
+                last_updated = NOW(),
+                has_been_run = v.activity_id IS NOT NULL,
+                first_run_activity_id = v.activity_id,
+                first_run_timestamp = v.start_time
+            FROM unnest(
+                CAST(:segment_ids AS varchar[]), CAST(:covered_intervals AS bytea[]), CAST(:coverages AS float8[]),
+                CAST(:activity_ids AS integer[]), CAST(:start_times AS timestamp[])
+            ) AS v(segment_id, covered_intervals, coverage, activity_id, start_time)
+            WHERE urs.user_id = :user_id AND urs.segment_id = v.segment_id
+        """), {
+            'user_id': user_id,
+            'segment_ids': segment_ids,
+            'covered_intervals': [encode_intervals(intervals) for intervals in covered],
+            'coverages': [covered_fraction(intervals) for intervals in covered],
+            'activity_ids': [segments[s]['activity_id'] for s in segment_ids],
+            'start_times': [segments[s]['start_time'] for s in segment_ids]
+        })
+        updated += sum(1 for s in segment_ids if segments[s]['activity_id'] is not None)
+    
+    db.commit()
+    return updated
+
+def update_segment_run_status(db, user_id, activity_id, traversals=None, tolerance=15, min_coverage=0.8):
     """
     Update road segments' run status based on a specific activity.
     This should be called whenever a new activity is added.
+    
+    The parts of each segment the activity covered are added to the segment's
+    interval set, and a segment counts as run once the union of everything run on
+    it covers more than min_coverage, whether in one activity or several. All
+    segments are updated with a single UPDATE ... FROM statement.
+    
+    Args:
+        db: SQLAlchemy session
+        user_id: ID of the user
+        activity_id: ID of the activity
+        traversals: Optional (segment_id, start_fraction, end_fraction) traversals of
+            the activity from map_matching.match_track; when not given, the unrun
+            segments within tolerance meters of the activity path are found in PostGIS
+        tolerance: Distance in meters from the activity path within which a segment
+            counts as covered, when traversals are not given
+        min_coverage: Fraction of a segment that must be covered to count as run
     """
     activity = get_activity_by_id(db, activity_id)
     if not activity:
         return
     
-    # Get activity path as LineString
-    activity_line = to_shape(activity.path)
+    if traversals is None:
+        traversals = _nearby_segment_traversals(db, user_id, activity_id, tolerance)
+    segment_intervals = _traversal_intervals(traversals)
     
-    # Get all user's road segments that haven't been run yet
-    unrun_segments = (
-        db.query(UserRoadSegment)
+    store_activity_segments(db, activity_id, segment_intervals)
+    
+    # Add this activity's coverage to everything run on each segment so far
+    covered_so_far = dict(
+        db.query(UserRoadSegment.segment_id, UserRoadSegment.covered_intervals)
         .filter(
             UserRoadSegment.user_id == user_id,
-            UserRoadSegment.has_been_run == False
+            UserRoadSegment.segment_id.in_(list(segment_intervals))
         )
-        .all()
     )
+    segment_ids = []
+    covered_intervals = []
+    coverages = []
+    for segment_id, covered in covered_so_far.items():
+        covered = union_intervals(decode_intervals(covered), segment_intervals[segment_id])
+        segment_ids.append(segment_id)
+        covered_intervals.append(encode_intervals(covered))
+        coverages.append(covered_fraction(covered))
     
-    # Check each segment for intersection with activity path
-    for segment in unrun_segments:
-        segment_line = to_shape(segment.geometry)
-        
-        # If activity path intersects with segment
-        if activity_line.intersects(segment_line):
-            # Calculate what portion of the segment was covered
-            intersection = activity_line.intersection(segment_line)
-            if isinstance(intersection, (LineString, MultiLineString)):
-                coverage = intersection.length / segment_line.length
-                # If significant portion was covered (e.g., >80%)
-                if coverage > 0.8:
-                    segment.has_been_run = True
-                    segment.first_run_activity_id = activity_id
-                    segment.first_run_timestamp = activity.start_time
-                    segment.last_updated = datetime.utcnow()
+    if segment_ids:
+        db.execute(text("""
+            UPDATE user_road_segments urs
+            SET covered_intervals = v.covered_intervals,
+                coverage = v.coverage,
+                last_updated = NOW(),
+                has_been_run = urs.has_been_run IS TRUE OR v.coverage > :min_coverage,
+                first_run_activity_id = CASE WHEN urs.has_been_run IS NOT TRUE AND v.coverage > :min_coverage
+                                             THEN :activity_id ELSE urs.first_run_activity_id END,
+                first_run_timestamp = CASE WHEN urs.has_been_run IS NOT TRUE AND v.coverage > :min_coverage
+                                           THEN :start_time ELSE urs.first_run_timestamp END
+            FROM unnest(CAST(:segment_ids AS varchar[]), CAST(:covered_intervals AS bytea[]), CAST(:coverages AS float8[]))
+                AS v(segment_id, covered_intervals, coverage)
+            WHERE urs.user_id = :user_id AND urs.segment_id = v.segment_id
+        """), {
+            'user_id': user_id,
+            'activity_id': activity_id,
+            'start_time': activity.start_time,
+            'min_coverage': min_coverage,
+            'segment_ids': segment_ids,
+            'covered_intervals': covered_intervals,
+            'coverages': coverages
+        })
     
     db.commit()
 
+def get_user_segments_in_bbox(db, user_id, min_lat, min_lon, max_lat, max_lon, margin=0):
+    """
+    Get a user's road segments whose geometry overlaps an area
+    
+    Args:
+        db: SQLAlchemy session
+        user_id: ID of the user
+        min_lat, min_lon, max_lat, max_lon: Bounds of the area in degrees
+        margin: Distance in meters to grow the area by on every side
+    """
+    lat_margin = margin / 111320
+    lon_margin = margin / (111320 * max(math.cos(math.radians((min_lat + max_lat) / 2)), 0.01))
+    
+    # Segment geometry is stored as (lat, lon)
+    envelope = func.ST_MakeEnvelope(
+        min_lat - lat_margin, min_lon - lon_margin,
+        max_lat + lat_margin, max_lon + lon_margin
+    )
+    return db.query(UserRoadSegment)\
+        .filter(UserRoadSegment.user_id == user_id)\
+        .filter(UserRoadSegment.geometry.intersects(envelope))\
+        .all()
+
+def get_user_segment_extents(db, user_id, run_status=None):
+    """
+    Get the extent of a user's road segments in each of their locations
+    
+    Extents are computed in the database with ST_Extent, grouped by the location
+    whose routes use the segment; segments in no location share one extent.
+    
+    Args:
+        db: SQLAlchemy session
+        user_id: ID of the user
+        run_status: Optional boolean to only include segments with this has_been_run status
+        
+    Returns:
+        List of (min_lat, min_lon, max_lat, max_lon) bounds, one per location
+    """
+    run_filter = "" if run_status is None else "AND urs.has_been_run = :run_status"
+    rows = db.execute(text(f"""
+        SELECT ST_XMin(box), ST_YMin(box), ST_XMax(box), ST_YMax(box)
+        FROM (
+            SELECT loc.location_id, ST_Extent(urs.geometry) AS box
+            FROM user_road_segments urs
+            LEFT JOIN (
+                SELECT DISTINCT rs.segment_id, r.location_id
+                FROM route_segments rs
+                JOIN routes r ON r.id = rs.route_id
+                JOIN locations l ON l.id = r.location_id
+                WHERE l.user_id = :user_id
+            ) loc ON loc.segment_id = urs.segment_id
+            WHERE urs.user_id = :user_id AND urs.geometry IS NOT NULL {run_filter}
+            GROUP BY loc.location_id
+        ) extents
+    """), {'user_id': user_id, 'run_status': run_status}).all()
+    
+    # Segment geometry is stored as (lat, lon)
+    return [tuple(row) for row in rows]
+
 def get_user_road_segments(db, user_id, run_status=None):
     """
     Get user's road segments, optionally filtered by run status
@@ -498,37 +1105,43 @@ def get_user_road_segments(db, user_id, run_status=None):
     
     return query.all()
 
-def get_user_segment_stats(db, user_id):
-    """Get statistics about user's road segments"""
-    total_segments = (
-        db.query(func.count(UserRoadSegment.id))
-        .filter(UserRoadSegment.user_id == user_id)
-        .scalar()
-    )
+def get_user_segment_stats(db, user_id, from_rollup=False):
+    """
+    Get statistics about user's road segments
     
-    run_segments = (
-        db.query(func.count(UserRoadSegment.id))
-        .filter(
-            UserRoadSegment.user_id == user_id,
-            UserRoadSegment.has_been_run == True
+    Args:
+        db: SQLAlchemy session
+        user_id: ID of the user
+        from_rollup: Read the totals from the user_segment_stats rollup row kept up to
+            date by triggers (see database/migrations) instead of aggregating the
+            user's segments; falls back to aggregating when the user has no row
+    """
+    totals = None
+    if from_rollup:
+        totals = (
+            db.query(
+                UserSegmentStats.total_segments,
+                UserSegmentStats.run_segments,
+                UserSegmentStats.total_length,
+                UserSegmentStats.run_length
+            )
+            .filter(UserSegmentStats.user_id == user_id)
+            .first()
         )
-        .scalar()
-    )
-    
-    total_length = (
-        db.query(func.sum(UserRoadSegment.length))
-        .filter(UserRoadSegment.user_id == user_id)
-        .scalar() or 0
-    )
     
-    run_length = (
-        db.query(func.sum(UserRoadSegment.length))
-        .filter(
-            UserRoadSegment.user_id == user_id,
-            UserRoadSegment.has_been_run == True
+    if totals is None:
+        is_run = UserRoadSegment.has_been_run == True
+        totals = (
+            db.query(
+                func.count(UserRoadSegment.id),
+                func.count(UserRoadSegment.id).filter(is_run),
+                func.coalesce(func.sum(UserRoadSegment.length), 0),
+                func.coalesce(func.sum(UserRoadSegment.length).filter(is_run), 0)
+            )
+            .filter(UserRoadSegment.user_id == user_id)
+            .one()
         )
-        .scalar() or 0
-    )
+    total_segments, run_segments, total_length, run_length = totals
     
     return {
         'total_segments': total_segments,
@@ -562,6 +1175,8 @@ def get_location_cleanup_stats(db, location_id):
     """
     Get statistics about what will be cleaned up when removing a location.
     
+    Everything is computed in one query, however many routes the location has.
+    
     Args:
         db: SQLAlchemy session
         location_id: ID of the location to analyze
@@ -570,77 +1185,49 @@ def get_location_cleanup_stats(db, location_id):
         dict: Statistics about routes, segments, and user segments that will be affected
     """
     try:
-        # Get the location
-        location = db.query(Location).filter(Location.id == location_id).first()
-        if not location:
-            return None
-        
-        user_id = location.user_id
-        
-        # Count routes for this location
-        route_count = db.query(Route).filter(Route.location_id == location_id).count()
-        
-        # Count route segments for this location
-        route_segment_count = (
-            db.query(route_segments)
-            .join(Route)
-            .filter(Route.location_id == location_id)
-            .count()
-        )
-        
-        # Get all road segments used by this location
-        location_segments = (
-            db.query(RoadSegment.segment_id)
-            .join(route_segments)
-            .join(Route)
-            .filter(Route.location_id == location_id)
-            .distinct()
-            .all()
-        )
-        location_segment_ids = {segment.segment_id for segment in location_segments}
-        
-        # Get all road segments used by the user's remaining locations (excluding this one)
-        remaining_location_segments = (
-            db.query(RoadSegment.segment_id)
-            .join(route_segments)
-            .join(Route)
-            .join(Location)
-            .filter(
-                Location.user_id == user_id,
-                Location.id != location_id
-            )
-            .distinct()
-            .all()
-        )
-        remaining_segment_ids = {segment.segment_id for segment in remaining_location_segments}
-        
-        # Find user road segments that will become unused
-        unused_user_segments = []
-        if location_segment_ids:  # Only query if there are segments to check
-            unused_user_segments = (
-                db.query(UserRoadSegment)
-                .filter(
-                    UserRoadSegment.user_id == user_id,
-                    UserRoadSegment.segment_id.in_(location_segment_ids),
-                    ~UserRoadSegment.segment_id.in_(remaining_segment_ids)
-                )
-                .all()
+        row = db.execute(text("""
+            WITH target AS (
+                SELECT id, user_id, name FROM locations WHERE id = :location_id
+            ),
+            location_segments AS (
+                SELECT rs.segment_id
+                FROM route_segments rs
+                JOIN routes r ON r.id = rs.route_id
+                WHERE r.location_id = :location_id
+            ),
+            remaining_segments AS (
+                SELECT DISTINCT rs.segment_id
+                FROM route_segments rs
+                JOIN routes r ON r.id = rs.route_id
+                JOIN locations l ON l.id = r.location_id
+                JOIN target ON l.user_id = target.user_id AND l.id <> target.id
+            ),
+            unused AS (
+                SELECT urs.segment_id, urs.name, urs.has_been_run
+                FROM user_road_segments urs
+                JOIN target ON urs.user_id = target.user_id
+                WHERE urs.segment_id IN (SELECT segment_id FROM location_segments)
+                  AND urs.segment_id NOT IN (SELECT segment_id FROM remaining_segments)
             )
+            SELECT target.name AS location_name,
+                   (SELECT COUNT(*) FROM routes WHERE location_id = :location_id) AS route_count,
+                   (SELECT COUNT(*) FROM location_segments) AS route_segment_count,
+                   (SELECT COUNT(DISTINCT segment_id) FROM location_segments) AS unique_segments_used,
+                   (SELECT COALESCE(json_agg(json_build_object(
+                        'segment_id', segment_id, 'name', name, 'has_been_run', has_been_run
+                    )), '[]') FROM unused) AS unused_user_segments_details
+            FROM target
+        """), {'location_id': location_id}).mappings().first()
+        if not row:
+            return None
         
         return {
-            'location_name': location.name,
-            'route_count': route_count,
-            'route_segment_count': route_segment_count,
-            'unique_segments_used': len(location_segment_ids),
-            'unused_user_segments': len(unused_user_segments),
-            'unused_user_segments_details': [
-                {
-                    'segment_id': seg.segment_id,
-                    'name': seg.name,
-                    'has_been_run': seg.has_been_run
-                }
-                for seg in unused_user_segments
-            ]
+            'location_name': row['location_name'],
+            'route_count': row['route_count'],
+            'route_segment_count': row['route_segment_count'],
+            'unique_segments_used': row['unique_segments_used'],
+            'unused_user_segments': len(row['unused_user_segments_details']),
+            'unused_user_segments_details': row['unused_user_segments_details']
         }
         
     except Exception as e:
@@ -651,6 +1238,9 @@ def remove_location(db, location_id):
     """
     Remove a location and its associated routes, and clean up unused user road segments.
     
+    Routes, their segments and the user road segments no other location uses are
+    removed with set-based DELETE statements in one transaction.
+    
     Args:
         db: SQLAlchemy session
         location_id: ID of the location to remove
@@ -667,76 +1257,34 @@ def remove_location(db, location_id):
         
         user_id = location.user_id
         
-        # Get all routes for this location
-        routes = db.query(Route).filter(Route.location_id == location_id).all()
-        
-        # Delete route segments first
-        for route in routes:
-            try:
-                # Delete entries from route_segments association table
-                result = db.execute(
-                    route_segments.delete().where(route_segments.c.route_id == route.id)
-                )
-                logging.info(f"Deleted {result.rowcount} route segments for route {route.id}")
-            except Exception as e:
-                logging.warning(f"Error deleting route segments for route {route.id}: {str(e)}")
+        # Delete the location's route segments and routes
+        result = db.execute(
+            route_segments.delete()
+            .where(route_segments.c.route_id == Route.id, Route.location_id == location_id)
+        )
+        logging.info(f"Deleted {result.rowcount} route segments for location {location_id}")
         
-        # Now delete the routes
-        try:
-            deleted_routes = db.query(Route).filter(Route.location_id == location_id).delete()
-            logging.info(f"Deleted {deleted_routes} routes for location {location_id}")
-        except Exception as e:
-            logging.error(f"Error deleting routes for location {location_id}: {str(e)}")
-            raise
+        deleted_routes = db.query(Route).filter(Route.location_id == location_id).delete()
+        logging.info(f"Deleted {deleted_routes} routes for location {location_id}")
         
-        # Finally delete the location
-        try:
-            db.delete(location)
-            logging.info(f"Deleted location {location_id} ({location.name})")
-        except Exception as e:
-            logging.error(f"Error deleting location {location_id}: {str(e)}")
-            raise
+        # Then the location itself
+        db.delete(location)
+        db.flush()
+        logging.info(f"Deleted location {location_id} ({location.name})")
         
-        # Clean up unused user road segments
-        try:
-            # Get all road segments that are still used by the user's remaining locations
-            remaining_location_segments = (
-                db.query(RoadSegment.segment_id)
-                .join(route_segments)
-                .join(Route)
-                .join(Location)
-                .filter(Location.user_id == user_id)
-                .distinct()
-                .all()
-            )
-            
-            # Convert to set for efficient lookup
-            remaining_segment_ids = {segment.segment_id for segment in remaining_location_segments}
-            
-            # Find user road segments that are no longer used
-            unused_user_segments = (
-                db.query(UserRoadSegment)
-                .filter(
-                    UserRoadSegment.user_id == user_id,
-                    ~UserRoadSegment.segment_id.in_(remaining_segment_ids)
-                )
-                .all()
-            )
-            
-            # Delete unused user road segments
-            deleted_user_segments = 0
-            for unused_segment in unused_user_segments:
-                try:
-                    db.delete(unused_segment)
-                    deleted_user_segments += 1
-                except Exception as e:
-                    logging.warning(f"Error deleting user segment {unused_segment.segment_id}: {str(e)}")
-            
-            logging.info(f"Cleaned up {deleted_user_segments} unused user road segments")
-            
-        except Exception as e:
-            logging.error(f"Error cleaning up user road segments: {str(e)}")
-            # Don't raise here - we still want to commit the location removal
+        # Clean up user road segments no longer used by any of the user's locations
+        result = db.execute(text("""
+            DELETE FROM user_road_segments urs
+            WHERE urs.user_id = :user_id
+              AND NOT EXISTS (
+                  SELECT 1
+                  FROM route_segments rs
+                  JOIN routes r ON r.id = rs.route_id
+                  JOIN locations l ON l.id = r.location_id
+                  WHERE l.user_id = :user_id AND rs.segment_id = urs.segment_id
+              )
+        """), {'user_id': user_id})
+        logging.info(f"Cleaned up {result.rowcount} unused user road segments")
         
         db.commit()
         return True
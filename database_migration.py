@@ -3,13 +3,46 @@
 Database migration script to add new columns:
 - route_count to locations table
 - node_count to routes table
+- bounding box columns (min_lat, min_lon, max_lat, max_lon) to activities table
+- matched_at to activities table and the activity_segments coverage table
+- covered_intervals and coverage to user_road_segments, intervals to activity_segments
+- track (compressed GPS samples) to activities table
+- import_manifest table of imported GPX files
+
+It then applies the numbered SQL files in database/migrations (001_*.sql, ...)
+that are not yet recorded in the schema_migrations table, and reports how the
+query plans of the hot queries in database/utils.py changed.
 
 Run this script after updating the models to migrate existing data.
 """
 
+import json
+import os
+import re
 from database.config import SessionLocal, engine
+from database.sql_script import MIGRATIONS_FOLDER, read_statements, created_indexes
 from sqlalchemy import text
 
+# Hot queries from database/utils.py, with parameters filled from sample rows
+HOT_QUERIES = {
+    'activity GPS points': """
+        SELECT * FROM gps_points WHERE activity_id = :activity_id ORDER BY timestamp
+    """,
+    'location routes': """
+        SELECT * FROM routes WHERE location_id = :location_id
+    """,
+    'routes using a segment': """
+        SELECT route_id FROM route_segments WHERE segment_id = :segment_id
+    """,
+    'unrun user segments': """
+        SELECT * FROM user_road_segments WHERE user_id = :user_id AND has_been_run = false
+    """,
+    'user segments in a bounding box': """
+        SELECT segment_id FROM user_road_segments
+        WHERE user_id = :user_id AND geometry && ST_MakeEnvelope(:min_x, :min_y, :max_x, :max_y)
+    """,
+}
+
 def migrate_database():
     """Add new columns to existing tables and fix route_segments primary key"""
     
@@ -99,6 +132,113 @@ def migrate_database():
             except:
                 pass
         
+        # Add bounding box columns to activities table
+        for column in ['min_lat', 'min_lon', 'max_lat', 'max_lon']:
+            try:
+                db.execute(text(f"ALTER TABLE activities ADD COLUMN {column} DOUBLE PRECISION"))
+                print(f"✅ Added {column} column to activities table")
+            except Exception as e:
+                if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
+                    print(f"⚠️  {column} column already exists in activities table")
+                else:
+                    print(f"❌ Error adding {column} column: {e}")
+        
+        # Fill in bounding boxes of existing activities from their paths (stored as lon, lat)
+        try:
+            result = db.execute(text("""
+                UPDATE activities
+                SET min_lat = ST_YMin(path::box3d),
+                    min_lon = ST_XMin(path::box3d),
+                    max_lat = ST_YMax(path::box3d),
+                    max_lon = ST_XMax(path::box3d)
+                WHERE min_lat IS NULL AND path IS NOT NULL
+            """))
+            print(f"✅ Updated bounding boxes for {result.rowcount} activities")
+        except Exception as e:
+            print(f"❌ Error updating activity bounding boxes: {e}")
+        
+        try:
+            db.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_activities_user_bbox
+                ON activities (user_id, min_lat, max_lat, min_lon, max_lon)
+            """))
+            print("✅ Created activity bounding box index")
+        except Exception as e:
+            print(f"❌ Error creating activity bounding box index: {e}")
+        
+        # Add matched_at column to activities table
+        try:
+            db.execute(text("ALTER TABLE activities ADD COLUMN matched_at TIMESTAMP"))
+            print("✅ Added matched_at column to activities table")
+        except Exception as e:
+            if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
+                print("⚠️  matched_at column already exists in activities table")
+            else:
+                print(f"❌ Error adding matched_at column: {e}")
+        
+        # Create activity_segments table holding the segment coverage of each activity
+        try:
+            db.execute(text("""
+                CREATE TABLE IF NOT EXISTS activity_segments (
+                    activity_id INTEGER NOT NULL REFERENCES activities(id) ON DELETE CASCADE,
+                    segment_id VARCHAR NOT NULL,
+                    coverage DOUBLE PRECISION NOT NULL,
+                    intervals BYTEA,
+                    PRIMARY KEY (activity_id, segment_id)
+                )
+            """))
+            db.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_activity_segments_segment_id
+                ON activity_segments (segment_id)
+            """))
+            print("✅ Created activity_segments table")
+        except Exception as e:
+            print(f"❌ Error creating activity_segments table: {e}")
+        
+        # Add interval coverage and compressed track columns
+        for table, column, column_type in [
+            ('user_road_segments', 'covered_intervals', 'BYTEA'),
+            ('user_road_segments', 'coverage', 'DOUBLE PRECISION DEFAULT 0'),
+            ('activity_segments', 'intervals', 'BYTEA'),
+            ('activities', 'track', 'BYTEA'),
+        ]:
+            try:
+                db.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+                print(f"✅ Added {column} column to {table} table")
+            except Exception as e:
+                if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
+                    print(f"⚠️  {column} column already exists in {table} table")
+                else:
+                    print(f"❌ Error adding {column} column: {e}")
+        
+        # Create import_manifest table recording which files were imported as which activity
+        try:
+            db.execute(text("""
+                CREATE TABLE IF NOT EXISTS import_manifest (
+                    user_id INTEGER NOT NULL REFERENCES users(id),
+                    path VARCHAR NOT NULL,
+                    size BIGINT NOT NULL,
+                    mtime DOUBLE PRECISION NOT NULL,
+                    content_hash VARCHAR NOT NULL,
+                    activity_id INTEGER REFERENCES activities(id) ON DELETE SET NULL,
+                    imported_at TIMESTAMP,
+                    PRIMARY KEY (user_id, path)
+                )
+            """))
+            print("✅ Created import_manifest table")
+        except Exception as e:
+            print(f"❌ Error creating import_manifest table: {e}")
+        
+        # Add status column recording files that failed to import
+        try:
+            db.execute(text("ALTER TABLE import_manifest ADD COLUMN status VARCHAR NOT NULL DEFAULT 'imported'"))
+            print("✅ Added status column to import_manifest table")
+        except Exception as e:
+            if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
+                print("⚠️  status column already exists in import_manifest table")
+            else:
+                print(f"❌ Error adding status column: {e}")
+        
         # Update existing locations with current route counts
         try:
             result = db.execute(text("""
@@ -125,5 +265,120 @@ def migrate_database():
     finally:
         db.close()
 
+def _numbered_migrations(folder=MIGRATIONS_FOLDER):
+    """(version, file name) of the numbered SQL migration files, in version order"""
+    migrations = []
+    for filename in os.listdir(folder):
+        match = re.match(r'^(\d+)_.*\.sql$', filename)
+        if match:
+            migrations.append((match.group(1), filename))
+    return sorted(migrations, key=lambda migration: int(migration[0]))
+
+def _sample_query_parameters(conn):
+    """Parameters for HOT_QUERIES taken from existing rows, so plans reflect real values"""
+    params = conn.execute(text("""
+        SELECT (SELECT COALESCE(MIN(id), 0) FROM users) AS user_id,
+               (SELECT COALESCE(MIN(id), 0) FROM activities) AS activity_id,
+               (SELECT COALESCE(MIN(id), 0) FROM locations) AS location_id,
+               (SELECT COALESCE(MIN(segment_id), '') FROM road_segments) AS segment_id
+    """)).mappings().one()
+    params = dict(params)
+    
+    # A small box around one of the user's segments (stored as lat, lon)
+    box = conn.execute(text("""
+        SELECT ST_XMin(geometry::box2d), ST_YMin(geometry::box2d), ST_XMax(geometry::box2d), ST_YMax(geometry::box2d)
+        FROM user_road_segments WHERE user_id = :user_id LIMIT 1
+    """), params).first() or (0, 0, 0, 0)
+    params.update(min_x=box[0] - 0.005, min_y=box[1] - 0.005, max_x=box[2] + 0.005, max_y=box[3] + 0.005)
+    return params
+
+def _query_plans(conn, params):
+    """Estimated total cost and top plan node of each hot query, or None where it could not be planned"""
+    plans = {}
+    for name, query in HOT_QUERIES.items():
+        try:
+            plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), params).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            node = plan[0]['Plan']
+            while node.get('Plans') and node['Node Type'] in ('Sort', 'Bitmap Heap Scan'):
+                node = node['Plans'][0]
+            plans[name] = (plan[0]['Plan']['Total Cost'], node['Node Type'])
+        except Exception as e:
+            print(f"⚠️  Could not plan '{name}': {e}")
+            plans[name] = None
+    return plans
+
+def run_versioned_migrations(folder=MIGRATIONS_FOLDER):
+    """
+    Apply numbered SQL migrations that have not been applied yet
+    
+    Each file's statements run in autocommit mode so indexes can be built with
+    CREATE INDEX CONCURRENTLY without blocking writes. A migration's version is
+    recorded in schema_migrations only once all of its statements succeeded; a
+    failed one stops the run and is retried next time.
+    
+    Returns:
+        List of the versions applied
+    """
+    applied = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version VARCHAR PRIMARY KEY,
+                name VARCHAR NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """))
+        done = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+        pending = [(version, filename) for version, filename in _numbered_migrations(folder) if version not in done]
+        if not pending:
+            print("⚠️  No pending versioned migrations")
+            return applied
+        
+        params = _sample_query_parameters(conn)
+        plans_before = _query_plans(conn, params)
+        
+        for version, filename in pending:
+            statements = read_statements(os.path.join(folder, filename))
+            
+            try:
+                for statement in statements:
+                    conn.execute(text(statement))
+            except Exception as e:
+                print(f"❌ Migration {filename} failed: {e}")
+                
+                # A failed concurrent build leaves an invalid index behind, which IF NOT
+                # EXISTS would then skip; drop it so a rerun builds it again. Only this
+                # file's indexes are considered, so builds running in other sessions
+                # and unrelated invalid indexes are left alone
+                for index_name in created_indexes(statements):
+                    invalid = conn.execute(text(
+                        "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(:name) AND NOT indisvalid"
+                    ), {'name': index_name}).first()
+                    if invalid:
+                        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+                        print(f"⚠️  Dropped invalid index {index_name}")
+                break
+            
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                {'version': version, 'name': filename}
+            )
+            applied.append(version)
+            print(f"✅ Applied migration {filename} ({len(statements)} statements)")
+        
+        # Refresh statistics so the planner sees the new indexes, then compare plans
+        conn.execute(text("ANALYZE"))
+        plans_after = _query_plans(conn, params)
+        print("\n📊 Query plans of hot queries (estimated cost, top scan):")
+        for name in HOT_QUERIES:
+            before, after = plans_before[name], plans_after[name]
+            if before and after:
+                print(f"   {name}: {before[0]:.1f} ({before[1]}) → {after[0]:.1f} ({after[1]})")
+    
+    return applied
+
 if __name__ == "__main__":
-    migrate_database() 
\ No newline at end of file
+    migrate_database()
+    run_versioned_migrations() 
\ No newline at end of file
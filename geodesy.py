@@ -0,0 +1,129 @@
+import numpy as np
+from projection import WGS84_A
+
+EARTH_RADIUS = 6371000.0  # mean radius in meters
+WGS84_F = 1 / 298.257223563  # flattening
+
+def _latlon_radians(latlon):
+    """Latitude and longitude arrays in radians from (..., 2) (lat, lon) pairs in degrees."""
+    latlon = np.radians(np.asarray(latlon, dtype=float))
+    return latlon[..., 0], latlon[..., 1]
+
+def _central_angle(lat1, lon1, lat2, lon2):
+    """Haversine central angle in radians between points given in radians."""
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def haversine_distance(start, end):
+    """
+    Great-circle distance on a sphere of radius EARTH_RADIUS.
+
+    Parameters:
+        start: Array-like of (lat, lon) pairs in degrees, shape (..., 2).
+        end: Array-like of (lat, lon) pairs in degrees, broadcastable against start.
+
+    Returns:
+        np.ndarray: Distance in meters between matching rows of start and end.
+    """
+    lat1, lon1 = _latlon_radians(start)
+    lat2, lon2 = _latlon_radians(end)
+    return EARTH_RADIUS * _central_angle(lat1, lon1, lat2, lon2)
+
+def geodesic_distance(start, end):
+    """
+    Distance on the WGS84 ellipsoid using Lambert's approximation.
+
+    The spherical distance between reduced latitudes is corrected to first order in
+    the ellipsoid's flattening. This stays within a few millimetres per kilometre of
+    the exact (Vincenty/Karney) geodesic while remaining closed-form, so it can be
+    evaluated on whole arrays at once.
+
+    Parameters:
+        start: Array-like of (lat, lon) pairs in degrees, shape (..., 2).
+        end: Array-like of (lat, lon) pairs in degrees, broadcastable against start.
+
+    Returns:
+        np.ndarray: Distance in meters between matching rows of start and end.
+    """
+    lat1, lon1 = _latlon_radians(start)
+    lat2, lon2 = _latlon_radians(end)
+    beta1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    beta2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sigma = _central_angle(beta1, lon1, beta2, lon2)
+
+    p = (beta1 + beta2) / 2
+    q = (beta2 - beta1) / 2
+    sin_half = np.sin(sigma / 2) ** 2
+    cos_half = np.cos(sigma / 2) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2 / cos_half
+        y = (sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2 / sin_half
+    correction = np.where(sigma > 0, x + y, 0.0)
+    return WGS84_A * (sigma - WGS84_F / 2 * correction)
+
+def pairwise_distances(first, second, ellipsoidal=True):
+    """
+    Distance between every point of first and every point of second.
+
+    Parameters:
+        first: Array-like of (lat, lon) pairs in degrees, shape (n, 2).
+        second: Array-like of (lat, lon) pairs in degrees, shape (m, 2).
+        ellipsoidal (bool): Use geodesic_distance rather than haversine_distance.
+
+    Returns:
+        np.ndarray: (n, m) distances in meters.
+    """
+    first = np.asarray(first, dtype=float).reshape(-1, 2)
+    second = np.asarray(second, dtype=float).reshape(-1, 2)
+    distance = geodesic_distance if ellipsoidal else haversine_distance
+    return distance(first[:, None, :], second[None, :, :])
+
+def consecutive_distances(latlon, ellipsoidal=True):
+    """
+    Distance between each point of a path and the next.
+
+    Parameters:
+        latlon: Array-like of (lat, lon) pairs in degrees, shape (n, 2).
+        ellipsoidal (bool): Use geodesic_distance rather than haversine_distance.
+
+    Returns:
+        np.ndarray: (n - 1,) distances in meters.
+    """
+    latlon = np.asarray(latlon, dtype=float).reshape(-1, 2)
+    distance = geodesic_distance if ellipsoidal else haversine_distance
+    return distance(latlon[:-1], latlon[1:])
+
+def cumulative_distances(latlon, ellipsoidal=True):
+    """
+    Distance along a path from its first point to each point.
+
+    Parameters:
+        latlon: Array-like of (lat, lon) pairs in degrees, shape (n, 2).
+        ellipsoidal (bool): Use geodesic_distance rather than haversine_distance.
+
+    Returns:
+        np.ndarray: (n,) distances in meters, starting at 0.
+    """
+    return np.concatenate(([0.0], np.cumsum(consecutive_distances(latlon, ellipsoidal))))
+
+def path_lengths(coords, offsets, ellipsoidal=True):
+    """
+    Lengths of many paths stored back to back in one coordinate array.
+
+    Parameters:
+        coords: Array-like of (lat, lon) pairs in degrees, shape (n, 2).
+        offsets: Array-like of path boundaries; path i is coords[offsets[i]:offsets[i + 1]].
+        ellipsoidal (bool): Use geodesic_distance rather than haversine_distance.
+
+    Returns:
+        np.ndarray: Length of each path in meters; 0 for paths with fewer than two points.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if len(offsets) < 2:
+        return np.zeros(0)
+
+    # Segments joining the last point of one path to the first of the next are left out
+    coord_paths = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    within_path = coord_paths[:-1] == coord_paths[1:]
+    steps = consecutive_distances(coords, ellipsoidal)
+    return np.bincount(coord_paths[:-1][within_path], weights=steps[within_path], minlength=len(offsets) - 1)
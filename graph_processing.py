@@ -1,7 +1,6 @@
 import osmnx as ox
 import networkx as nx
 from geopy.geocoders import Nominatim
-from geopy.distance import geodesic
 import numpy as np
 import logging
 import time
@@ -1,7 +1,10 @@
 import networkx as nx
 from collections import defaultdict
 import copy
-import math
+import numpy as np
+from scipy.spatial import cKDTree
+from projection import local_origin, project
+from geodesy import geodesic_distance
 
 def deep_copy_multidigraph(
     original_graph: nx.MultiDiGraph,
@@ -101,22 +104,74 @@ def edge_line_graph(
     return H
 
 def node_distance(G: nx.MultiDiGraph, u, v) -> float:
-    lat1, lon1 = G.nodes[u]["x"], G.nodes[u]["y"]
-    lat2, lon2 = G.nodes[v]["x"], G.nodes[v]["y"]
-    R = 6371000  
+    """
+    Geodesic distance in meters between two nodes, whose x and y hold longitude and latitude.
+    """
+    start = (G.nodes[u]["y"], G.nodes[u]["x"])
+    end = (G.nodes[v]["y"], G.nodes[v]["x"])
+    return float(geodesic_distance(start, end))
+
 
-    # Convert degrees to radians
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
+def get_node_index(G: nx.MultiDiGraph) -> dict:
+    """
+    Returns the spatial index over the nodes of G, building it on first use.
+
+    The index is a KD-tree over node coordinates projected to meters with
+    projection.project, cached in G.graph['node_index'] so later lookups on the same
+    graph reuse it. It is rebuilt if the number of nodes in G has changed since it
+    was built.
 
-    # Haversine formula
-    a = math.sin(delta_phi / 2.0) ** 2 + \
-        math.cos(phi1) * math.cos(phi2) * \
-        math.sin(delta_lambda / 2.0) ** 2
+    Parameters:
+        G (nx.MultiDiGraph): Graph whose nodes have "x" (lon) and "y" (lat) attributes.
 
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    Returns:
+        dict: The index, with keys:
+            nodes: array of node IDs in index order
+            positions: dict mapping node ID to its row in the index
+            latlon: array of (lat, lon) node coordinates
+            origin: (lat, lon) origin of the projection
+            xy: array of projected node coordinates in meters
+            tree: cKDTree over xy
+    """
+    index = G.graph.get('node_index')
+    if index is not None and len(index['nodes']) == G.number_of_nodes():
+        return index
+
+    nodes = list(G.nodes())
+    latlon = np.array([(G.nodes[n]['y'], G.nodes[n]['x']) for n in nodes], dtype=float)
+    origin = local_origin(latlon)
+    xy = project(latlon, origin)
+
+    index = {
+        'nodes': np.array(nodes),
+        'positions': {node: i for i, node in enumerate(nodes)},
+        'latlon': latlon,
+        'origin': origin,
+        'xy': xy,
+        'tree': cKDTree(xy),
+    }
+    G.graph['node_index'] = index
+    return index
+
+
+def nearest_nodes(G: nx.MultiDiGraph, points, return_dist: bool = False):
+    """
+    Finds the nearest graph node to each of a batch of (lat, lon) points.
 
-    return R * c
+    Parameters:
+        G (nx.MultiDiGraph): Graph whose nodes have "x" (lon) and "y" (lat) attributes.
+        points: Sequence or array of (lat, lon) pairs.
+        return_dist (bool): Also return the distance to each nearest node in meters.
 
+    Returns:
+        np.ndarray: Node IDs, one per point, or a (node IDs, distances) tuple if
+        return_dist is True.
+    """
+    index = get_node_index(G)
+    query_xy = project(points, index['origin'])
+    distances, rows = index['tree'].query(query_xy, k=1, workers=-1)
+    node_ids = index['nodes'][rows]
+
+    if return_dist:
+        return node_ids, distances
+    return node_ids
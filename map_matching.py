@@ -0,0 +1,380 @@
+"""
+Streaming HMM map matching of GPS tracks onto road edges.
+
+Each GPS point is a noisy observation of a position on some road edge. Candidate
+positions come from a spatial index over the edges (the k nearest edges within a
+search radius), and a Viterbi pass picks the most likely sequence of positions:
+positions close to their GPS point are likely, and moves between consecutive
+positions are likely when the distance along the road network matches the
+straight-line distance between the GPS points (Newson & Krumm, 2009).
+
+Tracks are processed in fixed-size windows so memory stays constant however long
+the activity is. The matched path is returned as edge traversals.
+"""
+import logging
+from itertools import islice
+
+import numpy as np
+import shapely
+from geoalchemy2.shape import to_shape
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+from scipy.spatial import cKDTree
+
+from projection import local_origin, project
+
+def build_edge_index(edge_ids, edge_coords, origin=None, snap_tolerance=1.0):
+    """
+    Build the spatial index and road topology used for map matching.
+
+    Edges are connected where their end points meet, so the index can be built from
+    any set of road geometries, e.g. stored road segments, without the source graph.
+
+    Parameters:
+        edge_ids: Sequence of edge identifiers, e.g. road segment IDs.
+        edge_coords: Sequence of (lat, lon) coordinate sequences, one per edge.
+        origin: (lat, lon) origin of the metric projection, defaults to the centre of the edges.
+        snap_tolerance: End points closer than this many meters are treated as one node.
+
+    Returns:
+        dict: Edge index with keys ids, origin, lines (projected shapely LineStrings),
+        lengths, start_nodes, end_nodes, node_xy, node_tree, tree (STRtree over lines),
+        graph (sparse node adjacency weighted by edge length) and node_edges (shortest
+        edge between each pair of connected nodes).
+    """
+    ids = []
+    coords = []
+    for edge_id, edge in zip(edge_ids, edge_coords):
+        edge = np.asarray(edge, dtype=float).reshape(-1, 2)
+        if len(edge) >= 2:
+            ids.append(edge_id)
+            coords.append(edge)
+    if not coords:
+        raise ValueError("No edges with at least two coordinates to index")
+
+    if origin is None:
+        origin = local_origin(np.concatenate(coords))
+    lines = np.array([shapely.linestrings(project(edge, origin)) for edge in coords])
+    lengths = shapely.length(lines)
+
+    # Snap end points that meet into shared nodes
+    num_edges = len(lines)
+    end_points = np.concatenate([
+        shapely.get_coordinates(shapely.get_point(lines, 0)),
+        shapely.get_coordinates(shapely.get_point(lines, -1))
+    ])
+    pairs = cKDTree(end_points).query_pairs(snap_tolerance, output_type='ndarray')
+    snapped = coo_matrix(
+        (np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+        shape=(len(end_points), len(end_points))
+    )
+    num_nodes, labels = connected_components(snapped, directed=False)
+    start_nodes, end_nodes = labels[:num_edges], labels[num_edges:]
+    node_xy = np.column_stack([
+        np.bincount(labels, weights=end_points[:, i], minlength=num_nodes) for i in range(2)
+    ]) / np.bincount(labels, minlength=num_nodes)[:, None]
+
+    # Node adjacency weighted by the shortest edge between each pair of nodes
+    node_edges = {}
+    for edge in np.argsort(lengths)[::-1]:
+        a, b = sorted((int(start_nodes[edge]), int(end_nodes[edge])))
+        if a != b:
+            node_edges[(a, b)] = int(edge)
+    node_pairs = np.array(list(node_edges.keys()), dtype=np.int64).reshape(-1, 2)
+    weights = np.maximum(lengths[list(node_edges.values())], 1e-3)
+    graph = coo_matrix((weights, (node_pairs[:, 0], node_pairs[:, 1])), shape=(num_nodes, num_nodes)).tocsr()
+
+    logging.info(f"Indexed {num_edges} edges with {num_nodes} nodes for map matching")
+
+    return {
+        'ids': ids,
+        'origin': origin,
+        'lines': lines,
+        'lengths': lengths,
+        'start_nodes': start_nodes,
+        'end_nodes': end_nodes,
+        'node_xy': node_xy,
+        'node_tree': cKDTree(node_xy),
+        'tree': shapely.STRtree(lines),
+        'graph': graph,
+        'node_edges': node_edges
+    }
+
+def edge_index_from_segments(segments, **kwargs):
+    """
+    Build an edge index from stored road segments.
+
+    Parameters:
+        segments: RoadSegment or UserRoadSegment rows; their geometry holds (lat, lon) coordinates.
+        **kwargs: Passed on to build_edge_index.
+
+    Returns:
+        dict: Edge index keyed by segment_id (see build_edge_index).
+    """
+    segments = [segment for segment in segments if segment.geometry is not None]
+    return build_edge_index(
+        [segment.segment_id for segment in segments],
+        [to_shape(segment.geometry).coords for segment in segments],
+        **kwargs
+    )
+
+def _candidates(edge_index, points_xy, k, search_radius):
+    """
+    Find the k nearest edge positions within search_radius of each point.
+
+    Returns:
+        list: One (edges, offsets, distances) tuple of arrays per point; offsets are
+        meters along the edge from its first coordinate.
+    """
+    points = shapely.points(points_xy)
+    point_idx, edges = edge_index['tree'].query(points, predicate='dwithin', distance=search_radius)
+    distances = shapely.distance(points[point_idx], edge_index['lines'][edges])
+    offsets = shapely.line_locate_point(edge_index['lines'][edges], points[point_idx])
+
+    # Keep the k closest edges of each point
+    order = np.lexsort((distances, point_idx))
+    point_idx, edges, distances, offsets = point_idx[order], edges[order], distances[order], offsets[order]
+    bounds = np.searchsorted(point_idx, np.arange(len(points_xy) + 1))
+    return [
+        (edges[start:min(end, start + k)], offsets[start:min(end, start + k)], distances[start:min(end, start + k)])
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+def _end_distances(edge_index, edges, offsets):
+    """Distance from positions on edges to the (start, end) node of each edge, shape (n, 2)."""
+    return np.column_stack([offsets, edge_index['lengths'][edges] - offsets])
+
+def _end_nodes(edge_index, edges):
+    """The (start, end) node of each edge, shape (n, 2)."""
+    return np.column_stack([edge_index['start_nodes'][edges], edge_index['end_nodes'][edges]])
+
+def _route_distances(edge_index, previous, current, routes):
+    """
+    Network distance from each previous candidate position to each current one.
+
+    Parameters:
+        previous, current: (edges, offsets) arrays of candidate positions.
+        routes: The window's shortest paths from _window_routes.
+
+    Returns:
+        np.ndarray: Distances in meters, shape (len(previous), len(current)), inf when unreachable.
+    """
+    previous_ends = _end_distances(edge_index, *previous)
+    current_ends = _end_distances(edge_index, *current)
+    between = routes['distances'][
+        np.searchsorted(routes['sources'], _end_nodes(edge_index, previous[0]))[:, :, None, None],
+        np.searchsorted(routes['nodes'], _end_nodes(edge_index, current[0]))[None, None, :, :]
+    ]
+    distances = (previous_ends[:, :, None, None] + between + current_ends[None, None, :, :]).min(axis=(1, 3))
+
+    # Moving along the same edge does not pass through a node
+    same_edge = previous[0][:, None] == current[0][None, :]
+    along_edge = np.abs(current[1][None, :] - previous[1][:, None])
+    return np.where(same_edge, np.minimum(distances, along_edge), distances)
+
+def _connect(edge_index, previous, current, routes):
+    """
+    Edge traversals between two matched positions on different edges.
+
+    Returns:
+        tuple: (exit, traversals, entry) where exit is the offset at which the previous
+        edge is left, traversals are the (edge, enter, exit) edges driven in full in
+        between and entry is the offset at which the current edge is entered.
+    """
+    previous_edge, previous_offset = previous
+    current_edge, current_offset = current
+    previous_ends = _end_distances(edge_index, np.array([previous_edge]), np.array([previous_offset]))[0]
+    current_ends = _end_distances(edge_index, np.array([current_edge]), np.array([current_offset]))[0]
+    previous_nodes = _end_nodes(edge_index, np.array([previous_edge]))[0]
+    current_nodes = _end_nodes(edge_index, np.array([current_edge]))[0]
+
+    totals = (
+        previous_ends[:, None]
+        + routes['distances'][np.searchsorted(routes['sources'], previous_nodes)][:, np.searchsorted(routes['nodes'], current_nodes)]
+        + current_ends[None, :]
+    )
+    i, j = np.unravel_index(np.argmin(totals), totals.shape)
+    exit_offset = 0.0 if i == 0 else edge_index['lengths'][previous_edge]
+    entry_offset = 0.0 if j == 0 else edge_index['lengths'][current_edge]
+
+    # Walk the shortest path back from the current edge's node to the previous edge's node
+    row = np.searchsorted(routes['sources'], previous_nodes[i])
+    path = [np.searchsorted(routes['nodes'], current_nodes[j])]
+    target = np.searchsorted(routes['nodes'], previous_nodes[i])
+    while path[-1] != target:
+        path.append(routes['predecessors'][row, path[-1]])
+    path = routes['nodes'][path[::-1]]
+
+    traversals = []
+    for a, b in zip(path[:-1], path[1:]):
+        edge = edge_index['node_edges'][tuple(sorted((int(a), int(b))))]
+        length = edge_index['lengths'][edge]
+        if edge_index['start_nodes'][edge] == a:
+            traversals.append((edge, 0.0, length))
+        else:
+            traversals.append((edge, length, 0.0))
+    return exit_offset, traversals, entry_offset
+
+def _chain_traversals(edge_index, states, routes):
+    """Turn a chain of matched (edge, offset) positions into (edge, enter, exit) traversals."""
+    traversals = []
+    edge, enter, exit_offset = states[0][0], states[0][1], states[0][1]
+    for next_edge, offset in states[1:]:
+        if next_edge == edge:
+            exit_offset = offset
+            continue
+        exit_offset, between, entry = _connect(edge_index, (edge, exit_offset), (next_edge, offset), routes)
+        traversals.append((edge, enter, exit_offset))
+        traversals.extend(between)
+        edge, enter, exit_offset = next_edge, entry, offset
+    traversals.append((edge, enter, exit_offset))
+    return traversals
+
+def _window_routes(edge_index, points_xy, steps, search_radius, max_route):
+    """
+    Shortest network distances between the nodes a window's candidates can reach.
+
+    The search is limited to nodes within max_route (plus the search radius) of the
+    window's points, which keeps its cost independent of the size of the network.
+
+    Returns:
+        dict: nodes (sorted node numbers searched), sources (sorted candidate edge end
+        nodes), distances (meters from each source to each searched node) and
+        predecessors (positions in nodes) of the shortest paths.
+    """
+    nearby = edge_index['node_tree'].query_ball_point(points_xy, max_route + search_radius)
+    candidate_edges = np.concatenate([edges for edges, _, _ in steps])
+    local_nodes = np.unique(np.concatenate(
+        [np.concatenate(nearby).astype(np.int64), _end_nodes(edge_index, candidate_edges).ravel()]
+    ))
+    local_graph = edge_index['graph'][local_nodes][:, local_nodes]
+
+    sources = np.unique(_end_nodes(edge_index, candidate_edges))
+    local_rows = np.searchsorted(local_nodes, sources)
+    distances, predecessors = dijkstra(
+        local_graph, directed=False, indices=local_rows, limit=max_route, return_predecessors=True
+    )
+    return {
+        'nodes': local_nodes,
+        'sources': sources,
+        'distances': distances,
+        'predecessors': predecessors
+    }
+
+def _match_window(edge_index, points_xy, carried, k, search_radius, sigma, beta, max_route):
+    """
+    Run Viterbi over one window of points.
+
+    Parameters:
+        carried: (edge, offset, xy) of the last matched position of the previous window, or None.
+
+    Returns:
+        tuple: (chains, carried, continued) where chains is a list of traversal lists
+        (a new chain starts wherever the track cannot be followed along the network),
+        carried is the last matched position and continued tells whether the first
+        chain continues from the carried position.
+    """
+    steps = []
+    step_xy = []
+    if carried is not None:
+        steps.append((np.array([carried[0]]), np.array([carried[1]]), np.zeros(1)))
+        step_xy.append(carried[2])
+    for xy, (edges, offsets, distances) in zip(points_xy, _candidates(edge_index, points_xy, k, search_radius)):
+        if len(edges):
+            steps.append((edges, offsets, distances))
+            step_xy.append(xy)
+    if not steps or (carried is not None and len(steps) == 1):
+        return [], carried, False
+
+    routes = _window_routes(edge_index, np.array(step_xy), steps, search_radius, max_route)
+
+    def emission(distances):
+        return -0.5 * (distances / sigma) ** 2
+
+    chains = []
+    chain_start = 0
+    scores = np.zeros(1) if carried is not None else emission(steps[0][2])
+    back = [None]
+
+    def backtrack(end):
+        state = int(np.argmax(scores))
+        states = []
+        for t in range(end, chain_start - 1, -1):
+            edges, offsets, _ = steps[t]
+            states.append((int(edges[state]), float(offsets[state])))
+            if t > chain_start:
+                state = back[t - chain_start][state]
+        states.reverse()
+        return states
+
+    for t in range(1, len(steps)):
+        straight = np.hypot(*(step_xy[t] - step_xy[t - 1]))
+        routes_between = _route_distances(edge_index, steps[t - 1][:2], steps[t][:2], routes)
+        transitions = -np.abs(routes_between - straight) / beta
+
+        totals = scores[:, None] + transitions
+        best = totals.max(axis=0)
+        if not np.isfinite(best).any():
+            # The track left the network or jumped; close this chain and start again
+            chains.append(_chain_traversals(edge_index, backtrack(t - 1), routes))
+            chain_start = t
+            back = [None]
+            scores = emission(steps[t][2])
+            continue
+        back.append(totals.argmax(axis=0))
+        scores = best + emission(steps[t][2])
+        scores -= scores.max()
+
+    states = backtrack(len(steps) - 1)
+    chains.append(_chain_traversals(edge_index, states, routes))
+    edge, offset = states[-1]
+    return chains, (edge, offset, step_xy[-1]), carried is not None
+
+def match_track(edge_index, points, k=5, search_radius=30, sigma=5.0, beta=10.0, max_route=500, window_size=200):
+    """
+    Map match a GPS track onto the edges of an edge index.
+
+    Points are consumed window by window, so they can be streamed from a generator
+    and memory use does not grow with the length of the track.
+
+    Parameters:
+        edge_index: Index from build_edge_index or edge_index_from_segments.
+        points: Iterable of (lat, lon) points in track order.
+        k: Maximum number of candidate edges per point.
+        search_radius: Maximum distance in meters from a point to its candidate edges.
+        sigma: Standard deviation of GPS noise in meters.
+        beta: Scale in meters of the allowed difference between network and straight-line
+            distance between consecutive points.
+        max_route: Longest network distance in meters considered between consecutive points.
+        window_size: Number of points decoded together.
+
+    Returns:
+        list: (edge_id, start_fraction, end_fraction) traversals in track order, where the
+        fractions give the part of the edge covered, measured from its first coordinate
+        (start_fraction > end_fraction when it was travelled backwards). Positions that
+        only touch an edge at a single point are left out.
+    """
+    points = iter(points)
+    traversals = []
+    carried = None
+    while True:
+        window = list(islice(points, window_size))
+        if not window:
+            break
+        points_xy = project(window, edge_index['origin'])
+        chains, carried, continued = _match_window(
+            edge_index, points_xy, carried, k, search_radius, sigma, beta, max_route
+        )
+        for i, chain in enumerate(chains):
+            if i == 0 and continued and traversals and traversals[-1][0] == chain[0][0]:
+                # The window starts where the previous one ended
+                edge, enter, _ = traversals.pop()
+                chain = [(edge, enter, chain[0][2])] + chain[1:]
+            traversals.extend(chain)
+
+    lengths = edge_index['lengths']
+    return [
+        (edge_index['ids'][edge], enter / lengths[edge] if lengths[edge] else 0.0, exit_offset / lengths[edge] if lengths[edge] else 0.0)
+        for edge, enter, exit_offset in traversals
+        if enter != exit_offset
+    ]
@@ -0,0 +1,66 @@
+import numpy as np
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0  # semi-major axis in meters
+WGS84_E2 = 6.69437999014e-3  # first eccentricity squared
+
+def local_origin(latlon):
+    """
+    Pick a projection origin for a set of points: the centre of their bounding box.
+
+    Parameters:
+        latlon: Array-like of (lat, lon) pairs in degrees.
+
+    Returns:
+        np.ndarray: (lat, lon) of the origin in degrees.
+    """
+    latlon = np.asarray(latlon, dtype=float).reshape(-1, 2)
+    return (latlon.min(axis=0) + latlon.max(axis=0)) / 2
+
+def _radii(lat0):
+    """Meridional and prime vertical radii of curvature (meters) at latitude lat0 (degrees)."""
+    sin_lat = np.sin(np.radians(lat0))
+    w = 1 - WGS84_E2 * sin_lat ** 2
+    meridional = WGS84_A * (1 - WGS84_E2) / w ** 1.5
+    prime_vertical = WGS84_A / np.sqrt(w)
+    return meridional, prime_vertical
+
+def project(latlon, origin):
+    """
+    Project (lat, lon) pairs onto a local plane in meters centred on origin.
+
+    The plane is tangent to the WGS84 ellipsoid at the origin, scaled by the
+    ellipsoid's radii of curvature there, so east-west and north-south distances
+    are both true to within a few centimetres per kilometre over the area of a
+    location. It is linear in lat/lon, so straight lines between projected
+    points match straight lines interpolated in degrees.
+
+    Parameters:
+        latlon: Array-like of (lat, lon) pairs in degrees, shape (n, 2).
+        origin: (lat, lon) of the plane's origin in degrees.
+
+    Returns:
+        np.ndarray: Array of shape (n, 2) holding (x, y) in meters east and north of origin.
+    """
+    latlon = np.asarray(latlon, dtype=float).reshape(-1, 2)
+    meridional, prime_vertical = _radii(origin[0])
+    x = np.radians(latlon[:, 1] - origin[1]) * prime_vertical * np.cos(np.radians(origin[0]))
+    y = np.radians(latlon[:, 0] - origin[0]) * meridional
+    return np.column_stack((x, y))
+
+def unproject(xy, origin):
+    """
+    Convert local plane coordinates back to (lat, lon).
+
+    Parameters:
+        xy: Array-like of (x, y) pairs in meters, shape (n, 2).
+        origin: (lat, lon) of the plane's origin in degrees.
+
+    Returns:
+        np.ndarray: Array of shape (n, 2) holding (lat, lon) in degrees.
+    """
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    meridional, prime_vertical = _radii(origin[0])
+    lat = origin[0] + np.degrees(xy[:, 1] / meridional)
+    lon = origin[1] + np.degrees(xy[:, 0] / (prime_vertical * np.cos(np.radians(origin[0]))))
+    return np.column_stack((lat, lon))
@@ -3,7 +3,6 @@ import osmnx as ox
 import folium
 import gpxpy
 import os
-from geopy.distance import geodesic
 from visualization import visualize_solution
 from metrics import print_metrics
 from graph_processing import (
@@ -13,18 +12,34 @@ from graph_processing import (
     calculate_solution_metrics,
     analyze_excluded_edges
 )
-from strava_analysis import classify_road_segments, match_points_to_edges
+from strava_analysis import (
+    classify_road_segments,
+    match_points_to_edges,
+    build_edge_samples,
+    save_edge_samples,
+    load_edge_samples,
+    remove_edge_samples,
+    sample_edges,
+    edge_samples_path
+)
+from graph_utils import nearest_nodes
+from map_matching import edge_index_from_segments, match_track
+from projection import local_origin, project
+from track_processing import filter_track, simplify_track, archive_raw_track, densify_track, matching_points
+from geodesy import consecutive_distances
+from database.track_codec import track_length
 from not_run_analysis import analyze_not_run_edges
 from database.config import SessionLocal
 from database.utils import (
     create_user,
     create_location,
-    add_road_segment,
     sync_user_road_segments,
     get_user_by_username,
     get_user_segment_stats,
     remove_location,
-    create_route_with_segments,
+    create_routes_with_segments,
+    get_segment_lengths,
+    add_road_segments,
     clear_database,
     get_activity_by_strava_id,
     create_activity,
@@ -32,14 +47,25 @@ from database.utils import (
     get_activity_by_id,
     get_user_road_segments,
     get_user_activities,
-    get_activity_gps_points,
-    get_location_cleanup_stats
+    get_user_activities_in_areas,
+    get_user_segment_extents,
+    get_user_segments_in_bbox,
+    update_run_status_from_activity_segments,
+    get_activity_track,
+    get_import_manifest,
+    record_imported_file,
+    get_location_cleanup_stats,
+    get_location_segment_ids,
+    get_location_route_geometries
 )
-from database.models import User, RoadSegment, Route, route_segments, Location
+from database.models import User, RoadSegment, Route, route_segments, Location, Activity
 from datetime import datetime, timezone
 from collections import defaultdict
 import csv
+import hashlib
 import shutil
+import time
+import numpy as np
 
 # Configure logging
 logging.basicConfig(
@@ -147,6 +173,7 @@ def display_menu(username):
     print("9. Visualize all road segments in database")
     print("10. Visualize specific route (debugging)")
     print("11. Clean up and organize files")
+    print("12. Watch Strava folder and import new GPS data automatically")
     print("0. Reset database (WARNING: Deletes all data)")
     print("00. Exit")
     return input("\nSelect an option: ")
@@ -293,25 +320,26 @@ def create_normalized_segment_id(osm_id, node_u, node_v):
         return f"{osm_id}_{v_str}_{u_str}" if osm_id else f"no_osm_{v_str}_{u_str}"
 
 def store_road_segments(db, G, location_id):
-    """Store road segments from the network graph"""
+    """
+    Store road segments from the network graph
+    
+    Returns:
+        Dictionary of segment_id -> length in meters for every stored segment of the
+        graph, empty if storing failed
+    """
     print("Storing road segments...")
-    segments_added = 0
-    segments_skipped = 0
     error_count = 0
     
-    # First, delete all existing routes for this location
-    existing_routes = db.query(Route).filter(Route.location_id == location_id).all()
-    for route in existing_routes:
-        # Delete route segments first
-        db.execute(
-            route_segments.delete().where(route_segments.c.route_id == route.id)
-        )
-        # Delete the route
-        db.delete(route)
+    # First, delete all existing routes for this location, their route segments first
+    location_route_ids = db.query(Route.id).filter(Route.location_id == location_id)
+    db.execute(route_segments.delete().where(route_segments.c.route_id.in_(location_route_ids.scalar_subquery())))
+    db.query(Route).filter(Route.location_id == location_id).delete(synchronize_session=False)
     
     total_edges = len(G.edges())
     print(f"Total edges in graph: {total_edges}")
     
+    # Build every segment row in memory, then write them in bulk
+    segments = []
     for u, v, data in G.edges(data=True):
         try:
             # Get coordinates for this edge
@@ -322,69 +350,53 @@ def store_road_segments(db, G, location_id):
                 
             # Get edge properties and convert numpy types to Python native types
             osm_id = str(data.get('osmid', ''))  # Keep original OSM ID
-            # Create unique segment identifier: osmid_nodeU_nodeV
-            segment_id = create_normalized_segment_id(osm_id, u, v)
-            name = str(data.get('name', ''))
-            road_type = str(data.get('highway', ''))
-            length = float(data.get('length', 0))
             
             # Store node information for the segment in normalized order
-            u_str = str(u)
-            v_str = str(v)
-            if u_str < v_str:
-                node_u = u_str
-                node_v = v_str
-            else:
-                node_u = v_str
-                node_v = u_str
-            
-            # Check if segment already exists
-            existing_segment = (
-                db.query(RoadSegment)
-                .filter(RoadSegment.segment_id == segment_id)
-                .first()
-            )
-            
-            if existing_segment:
-                segments_skipped += 1
-            else:
-                # Create new segment
-                segment = add_road_segment(
-                    db,
-                    osm_id,           # Original OSM ID
-                    segment_id,       # Unique segment identifier
-                    node_u,           # Start node
-                    node_v,           # End node
-                    name,
-                    road_type,
-                    coords,
-                    length
-                )
-                if segment:
-                    segments_added += 1
-                else:
-                    print(f"Warning: Failed to add segment {segment_id} (no error thrown)")
-                    error_count += 1
-                    
+            node_u, node_v = sorted((str(u), str(v)))
+            
+            segments.append({
+                'osm_id': osm_id,
+                # Unique segment identifier: osmid_nodeU_nodeV
+                'segment_id': create_normalized_segment_id(osm_id, u, v),
+                'node_u': node_u,
+                'node_v': node_v,
+                'name': str(data.get('name', '')),
+                'road_type': str(data.get('highway', '')),
+                'coordinates': coords,
+                'length': float(data.get('length', 0))
+            })
         except Exception as e:
             print(f"Error processing edge {u}->{v}: {str(e)}")
             error_count += 1
             continue
     
     try:
+        segments_added = add_road_segments(db, segments)
+        segments_skipped = len(segments) - segments_added
         db.commit()
+        
+        # Segments that already existed keep their stored lengths
+        segment_lengths = get_segment_lengths(db, {segment['segment_id'] for segment in segments})
         print("\nRoad segment processing summary:")
         print(f"Total edges in graph: {total_edges}")
         print(f"New segments added: {segments_added}")
         print(f"Existing segments reused: {segments_skipped}")
         print(f"Errors encountered: {error_count}")
         print(f"Total segments: {segments_added + segments_skipped}")
-        return segments_added + segments_skipped
-        
     except Exception as e:
         db.rollback()
         print(f"Error committing road segments: {str(e)}")
-        return 0
+        return {}
+    
+    # Precompute the edge sample arrays used to match GPS data against this location
+    try:
+        edge_samples = build_edge_samples(G, segment_id=create_normalized_segment_id)
+        save_edge_samples(edge_samples, edge_samples_path(location_id))
+        print(f"Cached {len(edge_samples['samples'])} edge sample points for GPS matching")
+    except Exception as e:
+        print(f"Warning: Could not cache edge samples: {str(e)}")
+    
+    return segment_lengths
 
 def process_location_routes(db, location):
     """Calculate and store routes for a location"""
@@ -400,13 +412,13 @@ def process_location_routes(db, location):
         G = get_road_network(center_point, distance)
         
         # Store road segments first
-        num_segments = store_road_segments(db, G, location.id)
-        if num_segments == 0:
+        segment_lengths = store_road_segments(db, G, location.id)
+        if not segment_lengths:
             print("Warning: No road segments were stored")
             return False
         
         # Find nearest node to start point
-        start_node = ox.nearest_nodes(G, center_point[1], center_point[0])
+        start_node = nearest_nodes(G, [center_point])[0]
         
         # Calculate edge cover solution
         print(f"Calculating routes (max distance: {max_distance/1000:.1f}km)...")
@@ -470,10 +482,9 @@ def process_location_routes(db, location):
         except Exception as e:
             print(f"Warning: Failed to export cycles data: {str(e)}")
         
-        # Store each cycle as a route
+        # Resolve each cycle to road segments, then store all routes together
         print("\nStoring routes...")
-        routes_created = 0
-        created_routes = []  # Keep track of created routes
+        routes = []
         
         for i, cycle in enumerate(cycles, 1):
             # Get the road segments for this cycle
@@ -501,16 +512,10 @@ def process_location_routes(db, location):
                     osm_id = str(edge_data.get('osmid', ''))
                     segment_id = create_normalized_segment_id(osm_id, u, v)
                 
-                    # Find the corresponding road segment using segment_id
-                    segment = (
-                        db.query(RoadSegment)
-                        .filter(RoadSegment.segment_id == segment_id)
-                        .first()
-                    )
-                    
-                    if segment:
+                    # Look the segment up among those just stored
+                    if segment_id in segment_lengths:
                         # Always add the segment - routes can traverse same segment multiple times
-                        segment_ids.append(segment.segment_id)
+                        segment_ids.append(segment_id)
                         
                         # Determine direction based on node order
                         # This is a simplified direction - could be enhanced to check actual geometry
@@ -528,42 +533,30 @@ def process_location_routes(db, location):
             print(f"    Edges: {edges_processed} processed, {edges_found} found, {edges_skipped} skipped")
             
             if segment_ids:
-                try:
-                    # Create route name and description
-                    route_name = f"Route {i} from {location.name}"
-                    description = f"Generated route {i} of {len(cycles)} for location {location.name}"
-                    
-                    # Store the route with its segments
-                    route = create_route_with_segments(
-                        db,
-                        location.id,
-                        route_name,
-                        description,
-                        segment_ids,
-                        segment_directions
-                    )
-                    
-                    if route:
-                        # Update the route with node count for debugging
-                        route.node_count = len(cycle)
-                        routes_created += 1
-                        created_routes.append(route)  # Add to our list of created routes
-                        print(f"    ✓ Created route with {len(segment_ids)} segments (from {len(cycle)} nodes)")
-                        db.commit()  # Commit after each successful route creation
-                    else:
-                        print(f"    ✗ Failed to create route")
-                except Exception as e:
-                    print(f"Error creating route {i}: {str(e)}")
-                    db.rollback()  # Rollback on error
-                    continue
+                routes.append({
+                    'name': f"Route {i} from {location.name}",
+                    'description': f"Generated route {i} of {len(cycles)} for location {location.name}",
+                    'segment_ids': segment_ids,
+                    'segment_directions': segment_directions,
+                    'node_count': len(cycle)  # Node count for debugging
+                })
+                print(f"    ✓ Prepared route with {len(segment_ids)} segments (from {len(cycle)} nodes)")
             else:
                 print(f"    ✗ No valid segments found for cycle {i}")
         
-        print(f"Successfully created {routes_created} routes!")
+        # Store all routes with their segments and update the location's route count in one transaction
+        try:
+            route_ids = create_routes_with_segments(db, location.id, routes, segment_lengths)
+            location.route_count = len(route_ids)
+            db.commit()
+        except Exception as e:
+            print(f"Error creating routes: {str(e)}")
+            db.rollback()
+            return False
+        created_routes = [(route_id, route['name']) for route_id, route in zip(route_ids, routes)]
+        routes_created = len(created_routes)
         
-        # Update location with route count
-        location.route_count = routes_created
-        db.commit()
+        print(f"Successfully created {routes_created} routes!")
         
         # Sync user road segments
         print("Syncing user road segments...")
@@ -584,11 +577,11 @@ def process_location_routes(db, location):
                 writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
                 writer.writeheader()
                 
-                for route in created_routes:  # Use our list of created routes
+                for route_id, route_name in created_routes:  # Use our list of created routes
                     segments = (
                         db.query(RoadSegment, route_segments.c.direction, route_segments.c.segment_order)
                         .join(route_segments)
-                        .filter(route_segments.c.route_id == route.id)
+                        .filter(route_segments.c.route_id == route_id)
                         .order_by(route_segments.c.segment_order)
                         .all()
                     )
@@ -600,8 +593,8 @@ def process_location_routes(db, location):
                     will_visualize = segments_with_geo > 0
                     
                     writer.writerow({
-                        'route_id': route.id,
-                        'route_name': route.name,
+                        'route_id': route_id,
+                        'route_name': route_name,
                         'total_segments': total_segments,
                         'segments_with_geometry': segments_with_geo,
                         'segments_without_geometry': segments_without_geo,
@@ -711,6 +704,8 @@ def remove_user_location(db, user):
                 confirm = input("\nContinue? (y/n): ")
                 if confirm.lower() == 'y':
                     if remove_location(db, location.id):
+                        # Location ids can be reused, so a stale cache must not outlive its location
+                        remove_edge_samples(location.id)
                         print(f"\n✅ Location '{location.name}' has been removed successfully!")
                         print(f"📊 Cleanup summary:")
                         print(f"  - Removed {cleanup_stats['route_count']} routes")
@@ -734,8 +729,8 @@ def visualize_location_data(db, location):
     print(f"\nVisualizing data for location: {location.name}")
     
     try:
-        # Get all routes for this location
-        routes = db.query(Route).filter(Route.location_id == location.id).all()
+        # Routes, their ordered segments, coordinates and extent in one query
+        routes, extent = get_location_route_geometries(db, location.id)
         
         if not routes:
             print("No routes found for this location.")
@@ -750,19 +745,12 @@ def visualize_location_data(db, location):
         routes_with_segments = []
         
         for route in routes:
-            # Count segments in route_segments table
-            segment_count = (
-                db.query(route_segments)
-                .filter(route_segments.c.route_id == route.id)
-                .count()
-            )
-            
-            if segment_count == 0:
+            if not route['segments']:
                 routes_with_no_segments.append(route)
-                print(f"  ❌ Route {route.id} ({route.name}) has 0 segments in route_segments table")
+                print(f"  ❌ Route {route['id']} ({route['name']}) has 0 segments in route_segments table")
             else:
                 routes_with_segments.append(route)
-                print(f"  ✅ Route {route.id} ({route.name}) has {segment_count} segments")
+                print(f"  ✅ Route {route['id']} ({route['name']}) has {len(route['segments'])} segments")
         
         print(f"\nRoute-Segments Summary:")
         print(f"  Routes with segments: {len(routes_with_segments)}")
@@ -772,51 +760,24 @@ def visualize_location_data(db, location):
             print(f"\n⚠️  CRITICAL: {len(routes_with_no_segments)} routes have no segments!")
             print("  This explains why they don't render. The route_segments table is missing entries.")
             for route in routes_with_no_segments[:3]:  # Show first 3
-                print(f"    - Route {route.id}: {route.name}")
-        
-        # Get all unique segments used by these routes
-        all_route_segments = set()
-        route_segment_data = {}
-        
-        for route in routes:
-            segments = (
-                db.query(RoadSegment, route_segments.c.direction, route_segments.c.segment_order)
-                .join(route_segments)
-                .filter(route_segments.c.route_id == route.id)
-                .order_by(route_segments.c.segment_order)
-                .all()
-            )
-            
-            # Debug: Check if route has segments
-            print(f"DEBUG: Route {route.id} ({route.name}) has {len(segments)} segments")
-            
-            if segments:
-                route_segment_data[route.id] = segments
-                for segment, _, _ in segments:
-                    all_route_segments.add(segment.segment_id)
-            else:
-                print(f"WARNING: Route {route.id} ({route.name}) has no segments!")
+                print(f"    - Route {route['id']}: {route['name']}")
         
+        all_route_segments = {segment['segment_id'] for route in routes_with_segments for segment in route['segments']}
         print(f"Found {len(all_route_segments)} unique segments across all routes")
-        print(f"Routes with segments: {len(route_segment_data)}/{len(routes)}")
+        print(f"Routes with segments: {len(routes_with_segments)}/{len(routes)}")
         
         # Check geometry data
         segments_with_geometry = 0
         segments_without_geometry = 0
         routes_with_issues = []
         
-        for route_id, segments in route_segment_data.items():
-            route_geometry_issues = 0
-            for segment, _, _ in segments:
-                if segment.geometry:
-                    segments_with_geometry += 1
-                else:
-                    segments_without_geometry += 1
-                    route_geometry_issues += 1
+        for route in routes_with_segments:
+            route_geometry_issues = sum(1 for segment in route['segments'] if not segment['coords'])
+            segments_with_geometry += len(route['segments']) - route_geometry_issues
+            segments_without_geometry += route_geometry_issues
             
             if route_geometry_issues > 0:
-                route_name = next(r.name for r in routes if r.id == route_id)
-                routes_with_issues.append(f"Route {route_id} ({route_name}): {route_geometry_issues} segments missing geometry")
+                routes_with_issues.append(f"Route {route['id']} ({route['name']}): {route_geometry_issues} segments missing geometry")
         
         print(f"Segments with geometry: {segments_with_geometry}")
         print(f"Segments without geometry: {segments_without_geometry}")
@@ -828,40 +789,16 @@ def visualize_location_data(db, location):
             if len(routes_with_issues) > 5:
                 print(f"  ... and {len(routes_with_issues) - 5} more routes with issues")
         
-        if segments_with_geometry == 0:
+        if segments_with_geometry == 0 or extent is None:
             print("❌ No segments have geometry data. Cannot create visualization.")
             return
         
-        # Create visualization using Folium
-        from geoalchemy2.shape import to_shape
-        import folium
-        import numpy as np
-        
         print("Creating route visualization...")
         
-        # Calculate map center from all segments
-        all_coords = []
-        
-        for route_id, segments in route_segment_data.items():
-            for segment, _, _ in segments:
-                if segment.geometry:
-                    try:
-                        segment_line = to_shape(segment.geometry)
-                        if hasattr(segment_line, 'coords'):
-                            for coord in segment_line.coords:
-                                all_coords.append((coord[0], coord[1]))  # Based on debug: geometry is (lat, lon)
-                    except Exception as e:
-                        print(f"  Warning: Error processing geometry for segment {segment.segment_id}: {e}")
-                        continue
-        
-        if not all_coords:
-            print("❌ No valid segment geometries found.")
-            return
-        
-        # Calculate center point
-        coords_array = np.array(all_coords)
-        center_lat = np.mean(coords_array[:, 0])
-        center_lon = np.mean(coords_array[:, 1])
+        # Centre the map on the extent of all segments, computed by the database
+        min_lat, min_lon, max_lat, max_lon = extent
+        center_lat = (min_lat + max_lat) / 2
+        center_lon = (min_lon + max_lon) / 2
         
         print(f"Creating map centered at ({center_lat:.4f}, {center_lon:.4f})")
         
@@ -899,15 +836,16 @@ def visualize_location_data(db, location):
         }
         
         print(f"\n🔍 MULTI-ROUTE VISUALIZATION DEBUG:")
-        print(f"Processing {len(route_segment_data)} routes for visualization...")
+        print(f"Processing {len(routes_with_segments)} routes for visualization...")
         
-        for i, (route_id, segments) in enumerate(route_segment_data.items()):
+        for i, route in enumerate(routes_with_segments):
             rendering_stats['routes_attempted'] += 1
             color = colors[i % len(colors)]
-            route = next(r for r in routes if r.id == route_id)
+            route_id = route['id']
+            segments = route['segments']
             
             print(f"\n--- Route {route_id} Processing ---")
-            print(f"Route name: {route.name}")
+            print(f"Route name: {route['name']}")
             print(f"Color assigned: {color}")
             print(f"Segments to process: {len(segments)}")
             
@@ -928,62 +866,58 @@ def visualize_location_data(db, location):
             
             rendering_stats['routes_with_segments'] += 1
             
-            for segment, direction, order in segments:
-                if not segment.geometry:
+            for segment in segments:
+                coords = segment['coords']  # (lat, lon)
+                if not coords:
                     route_segments_skipped += 1
                     continue
                     
                 try:
-                    segment_line = to_shape(segment.geometry)
+                    # Validate coordinates
+                    valid_coords = True
+                    for lat, lon in coords:
+                        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                            valid_coords = False
+                            rendering_stats['coordinate_errors'] += 1
+                            print(f"    WARNING: Invalid coordinates for segment {segment['segment_id']}: ({lat}, {lon})")
+                            break
                     
-                    if hasattr(segment_line, 'coords'):
-                        coords = [(coord[0], coord[1]) for coord in segment_line.coords]  # (lat, lon)
-                        
-                        # Validate coordinates
-                        valid_coords = True
-                        for lat, lon in coords:
-                            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
-                                valid_coords = False
-                                rendering_stats['coordinate_errors'] += 1
-                                print(f"    WARNING: Invalid coordinates for segment {segment.segment_id}: ({lat}, {lon})")
-                                break
-                        
-                        if not valid_coords:
-                            route_segments_skipped += 1
-                            continue
-                        
-                        # Create popup text
-                        popup_text = f"""
-                        <b>Route {route_id} - Segment {order}</b><br>
-                        {segment.name or 'Unnamed Road'}<br>
-                        Segment ID: {segment.segment_id}<br>
-                        OSM ID: {segment.osm_id}<br>
-                        Type: {segment.road_type or 'Unknown'}<br>
-                        Length: {segment.length:.0f}m<br>
-                        Direction: {'Forward' if direction else 'Reverse'}
-                        """
-                        
-                        # Add line to the route's feature group instead of directly to map
-                        polyline = folium.PolyLine(
-                            locations=coords,
-                            color=color,
-                            weight=4,
-                            opacity=0.7,
-                            popup=folium.Popup(popup_text, max_width=300)
-                        )
-                        polyline.add_to(route_layer)  # Add to route layer, not main map
-                        
-                        route_distance += segment.length
-                        route_segments_added += 1
-                        segments_visualized += 1
-                        polylines_created_for_route += 1
-                        rendering_stats['total_polylines_created'] += 1
+                    if not valid_coords:
+                        route_segments_skipped += 1
+                        continue
+                    
+                    # Create popup text
+                    popup_text = f"""
+                    <b>Route {route_id} - Segment {segment['order']}</b><br>
+                    {segment['name'] or 'Unnamed Road'}<br>
+                    Segment ID: {segment['segment_id']}<br>
+                    OSM ID: {segment['osm_id']}<br>
+                    Type: {segment['road_type'] or 'Unknown'}<br>
+                    Length: {segment['length']:.0f}m<br>
+                    Direction: {'Forward' if segment['direction'] else 'Reverse'}
+                    """
+                    
+                    # Add line to the route's feature group instead of directly to map
+                    polyline = folium.PolyLine(
+                        locations=coords,
+                        color=color,
+                        weight=4,
+                        opacity=0.7,
+                        popup=folium.Popup(popup_text, max_width=300)
+                    )
+                    polyline.add_to(route_layer)  # Add to route layer, not main map
+                    
+                    route_distance += segment['length']
+                    route_segments_added += 1
+                    segments_visualized += 1
+                    polylines_created_for_route += 1
+                    rendering_stats['total_polylines_created'] += 1
                         
                 except Exception as e:
-                    print(f"    Warning: Error processing segment {segment.segment_id}: {str(e)}")
+                    print(f"    Warning: Error processing segment {segment['segment_id']}: {str(e)}")
                     route_segments_skipped += 1
                     continue
-            
+
             if route_segments_added > 0:
                 total_route_distance += route_distance
                 routes_visualized += 1
@@ -1027,9 +961,9 @@ def visualize_location_data(db, location):
                         
                         # Show details of a few skipped segments
                         skipped_count = 0
-                        for segment, direction, order in segments:
-                            if not segment.geometry and skipped_count < 2:  # Show first 2 skipped
-                                print(f"      Skipped segment {order}: {segment.segment_id} ({segment.name or 'Unnamed'}) - No geometry")
+                        for segment in segments:
+                            if not segment['coords'] and skipped_count < 2:  # Show first 2 skipped
+                                print(f"      Skipped segment {segment['order']}: {segment['segment_id']} ({segment['name'] or 'Unnamed'}) - No geometry")
                                 skipped_count += 1
                         
                         if route_segments_skipped > 2:
@@ -1053,44 +987,33 @@ def visualize_location_data(db, location):
                 
                 # Debug failed routes in detail
                 print(f"    🔍 DEBUGGING FAILED ROUTE {route_id}:")
-                print(f"      Route name: {route.name}")
+                print(f"      Route name: {route['name']}")
                 print(f"      Total segments: {len(segments)}")
                 
-                for seg_idx, (segment, direction, order) in enumerate(segments[:3]):  # Check first 3 segments
-                    print(f"      Segment {seg_idx + 1} (Order {order}):")
-                    print(f"        Segment ID: {segment.segment_id}")
-                    print(f"        Name: {segment.name or 'Unnamed'}")
-                    print(f"        Has geometry: {segment.geometry is not None}")
+                for seg_idx, segment in enumerate(segments[:3]):  # Check first 3 segments
+                    coords_list = segment['coords']
+                    print(f"      Segment {seg_idx + 1} (Order {segment['order']}):")
+                    print(f"        Segment ID: {segment['segment_id']}")
+                    print(f"        Name: {segment['name'] or 'Unnamed'}")
+                    print(f"        Has geometry: {coords_list is not None}")
                     
-                    if segment.geometry:
-                        try:
-                            segment_line = to_shape(segment.geometry)
-                            print(f"        Geometry type: {type(segment_line).__name__}")
+                    if coords_list is not None:
+                        print(f"        Coordinates count: {len(coords_list)}")
+                        
+                        if coords_list:
+                            first_coord = coords_list[0]
+                            last_coord = coords_list[-1]
+                            print(f"        First coord: ({first_coord[0]:.6f}, {first_coord[1]:.6f})")
+                            print(f"        Last coord: ({last_coord[0]:.6f}, {last_coord[1]:.6f})")
                             
-                            if hasattr(segment_line, 'coords'):
-                                coords_list = list(segment_line.coords)
-                                print(f"        Coordinates count: {len(coords_list)}")
-                                
-                                if coords_list:
-                                    first_coord = coords_list[0]
-                                    last_coord = coords_list[-1]
-                                    print(f"        First coord: ({first_coord[0]:.6f}, {first_coord[1]:.6f})")
-                                    print(f"        Last coord: ({last_coord[0]:.6f}, {last_coord[1]:.6f})")
-                                    
-                                    # Check if coordinates are in reasonable bounds
-                                    for coord_idx, coord in enumerate(coords_list):
-                                        lat, lon = coord[0], coord[1]
-                                        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
-                                            print(f"        ❌ INVALID COORD at index {coord_idx}: ({lat}, {lon})")
-                                        elif abs(lat) < 0.001 or abs(lon) < 0.001:
-                                            print(f"        ⚠️  SUSPICIOUS COORD at index {coord_idx}: ({lat}, {lon}) (too close to 0,0)")
-                                else:
-                                    print(f"        ❌ NO COORDINATES in geometry")
-                            else:
-                                print(f"        ❌ GEOMETRY has no coords attribute")
-                                
-                        except Exception as e:
-                            print(f"        ❌ ERROR processing geometry: {str(e)}")
+                            # Check if coordinates are in reasonable bounds
+                            for coord_idx, (lat, lon) in enumerate(coords_list):
+                                if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                                    print(f"        ❌ INVALID COORD at index {coord_idx}: ({lat}, {lon})")
+                                elif abs(lat) < 0.001 or abs(lon) < 0.001:
+                                    print(f"        ⚠️  SUSPICIOUS COORD at index {coord_idx}: ({lat}, {lon}) (too close to 0,0)")
+                        else:
+                            print(f"        ❌ NO COORDINATES in geometry")
                     else:
                         print(f"        ❌ NO GEOMETRY DATA")
                 
@@ -1112,7 +1035,7 @@ def visualize_location_data(db, location):
             # List which routes should appear in layer control
             print(f"\nRoutes that should appear in layer control:")
             for route_id, route_layer in route_layers.items():
-                route_name = next(r.name for r in routes if r.id == route_id)
+                route_name = next(r['name'] for r in routes if r['id'] == route_id)
                 print(f"  - Route {route_id}: {route_name} (Layer: {route_layer.layer_name if hasattr(route_layer, 'layer_name') else 'Unknown'})")
                 
         except Exception as e:
@@ -1286,22 +1209,9 @@ def visualize_location_data(db, location):
             
             # List the specific routes that failed
             print(f"\n📋 SPECIFIC ROUTES THAT FAILED TO RENDER:")
-            rendered_route_ids = set()
-            for route_id in route_segment_data.keys():
-                # Check if this route was actually rendered
-                route_found_in_layers = False
-                for layer_route_id in route_layers.keys():
-                    if layer_route_id == route_id:
-                        route_found_in_layers = True
-                        break
-                
-                if route_found_in_layers:
-                    rendered_route_ids.add(route_id)
-            
-            failed_routes = [r for r in routes if r.id not in rendered_route_ids]
+            failed_routes = [r for r in routes if r['id'] not in route_layers]
             for route in failed_routes:
-                segments_count = len(db.query(route_segments).filter(route_segments.c.route_id == route.id).all())
-                print(f"   - Route {route.id}: '{route.name}' ({segments_count} segments)")
+                print(f"   - Route {route['id']}: '{route['name']}' ({len(route['segments'])} segments)")
         
         # Check for feature group vs route rendering mismatches
         if rendering_stats['feature_groups_created'] != rendering_stats['feature_groups_added_to_map']:
@@ -1333,20 +1243,22 @@ def list_available_gpx_files(strava_folder='strava'):
     for filename in os.listdir(strava_folder):
         if filename.endswith('.gpx'):
             file_path = os.path.join(strava_folder, filename)
-            # Get file modification time
-            mtime = os.path.getmtime(file_path)
-            file_date = datetime.fromtimestamp(mtime)
+            # Get file size and modification time
+            stat = os.stat(file_path)
+            file_date = datetime.fromtimestamp(stat.st_mtime)
             gpx_files.append({
                 'filename': filename,
                 'path': file_path,
-                'date': file_date
+                'date': file_date,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime
             })
     
     # Sort by date (newest first)
     gpx_files.sort(key=lambda x: x['date'], reverse=True)
     return gpx_files
 
-def load_gpx_file_as_activity(db, user, gpx_file_path):
+def load_gpx_file_as_activity(db, user, gpx_file_path, simplify=False, archive_folder=None, gpx_content=None):
     """
     Load a GPX file and store it as an Activity with GPS points
     
@@ -1354,6 +1266,11 @@ def load_gpx_file_as_activity(db, user, gpx_file_path):
         db: SQLAlchemy session
         user: User object
         gpx_file_path: Path to the GPX file
+        simplify: Simplify the track (see track_processing.simplify_track) before it is
+            stored and matched; distance and elevation stats still use every point
+            left after filtering (see track_processing.filter_track)
+        archive_folder: Folder to archive the full-resolution track to when simplifying
+        gpx_content: Contents of the file if already read, to avoid reading it again
         
     Returns:
         Activity object if successful, None if failed
@@ -1361,8 +1278,11 @@ def load_gpx_file_as_activity(db, user, gpx_file_path):
     try:
         print(f"Loading GPX file: {gpx_file_path}")
         
-        with open(gpx_file_path, 'r') as gpx_file:
-            gpx = gpxpy.parse(gpx_file)
+        if gpx_content is not None:
+            gpx = gpxpy.parse(gpx_content)
+        else:
+            with open(gpx_file_path, 'r') as gpx_file:
+                gpx = gpxpy.parse(gpx_file)
         
         # Extract basic activity info
         activity_name = "Unknown Activity"
@@ -1402,6 +1322,20 @@ def load_gpx_file_as_activity(db, user, gpx_file_path):
             print("No valid GPS points found in the file")
             return None
         
+        # Elapsed time is measured on the raw track, so points the filter trims at
+        # either end still count
+        raw_points = gps_points_data
+        end_time = next((point['timestamp'] for point in reversed(raw_points) if point['timestamp']), None)
+        
+        # Drop repeated timestamps, GPS jumps and stationary clusters before anything is
+        # measured, stored or matched
+        raw_point_count = len(gps_points_data)
+        gps_points_data, filter_stats = filter_track(gps_points_data)
+        if len(gps_points_data) < raw_point_count:
+            print(f"Filtered {raw_point_count - len(gps_points_data)} of {raw_point_count} GPS points "
+                  f"({filter_stats['duplicates']} duplicate timestamps, {filter_stats['outliers']} jumps, "
+                  f"{filter_stats['dwell']} stationary)")
+        
         # Calculate basic statistics
         distance = None
         duration = None
@@ -1410,33 +1344,19 @@ def load_gpx_file_as_activity(db, user, gpx_file_path):
         
         # Calculate distance and elevation gain
         if len(gps_points_data) > 1:
-            total_distance = 0
-            total_elevation_gain = 0
-            
-            for i in range(1, len(gps_points_data)):
-                prev_point = gps_points_data[i-1]
-                curr_point = gps_points_data[i]
-                
-                # Calculate distance between consecutive points
-                point_distance = geodesic(
-                    (prev_point['latitude'], prev_point['longitude']),
-                    (curr_point['latitude'], curr_point['longitude'])
-                ).meters
-                total_distance += point_distance
-                
-                # Calculate elevation gain
-                if (prev_point['elevation'] is not None and 
-                    curr_point['elevation'] is not None):
-                    elev_diff = curr_point['elevation'] - prev_point['elevation']
-                    if elev_diff > 0:
-                        total_elevation_gain += elev_diff
-            
-            distance = total_distance
-            elevation_gain = total_elevation_gain
+            latlon = [(point['latitude'], point['longitude']) for point in gps_points_data]
+            distance = float(np.sum(consecutive_distances(latlon)))
+            
+            # Elevation gain counts climbs between consecutive points that both have an elevation
+            elevations = np.array(
+                [np.nan if point['elevation'] is None else point['elevation'] for point in gps_points_data],
+                dtype=float
+            )
+            climbs = np.diff(elevations)
+            elevation_gain = float(np.sum(climbs[climbs > 0]))
         
         # Calculate duration
-        if (start_time and gps_points_data[-1]['timestamp']):
-            end_time = gps_points_data[-1]['timestamp']
+        if start_time and end_time:
             duration = (end_time - start_time).total_seconds()
             
             # Calculate average speed
@@ -1454,7 +1374,7 @@ def load_gpx_file_as_activity(db, user, gpx_file_path):
         else:
             # Fallback if no timestamp available - use name and type with a hash of GPS points
             import hashlib
-            gps_hash = hashlib.md5(str(gps_points_data[:5]).encode()).hexdigest()[:8]  # Use first 5 points for hash
+            gps_hash = hashlib.md5(str(raw_points[:5]).encode()).hexdigest()[:8]  # Use first 5 raw points for hash
             strava_id = f"{safe_type}_{safe_name}_{gps_hash}"
         
         # Check if activity already exists
@@ -1463,6 +1383,13 @@ def load_gpx_file_as_activity(db, user, gpx_file_path):
             print(f"Activity from {activity_name} already exists in the database")
             return existing_activity
         
+        if simplify:
+            if archive_folder:
+                archive_raw_track(gps_points_data, os.path.join(archive_folder, f"{strava_id}.npz"))
+            raw_point_count = len(gps_points_data)
+            gps_points_data = simplify_track(gps_points_data)
+            print(f"Simplified track from {raw_point_count} to {len(gps_points_data)} GPS points")
+        
         # Create the activity
         activity = create_activity(
             db,
@@ -1486,8 +1413,22 @@ def load_gpx_file_as_activity(db, user, gpx_file_path):
             print(f"- Duration: {duration/60:.1f} minutes" if duration else "- Duration: Unknown")
             print(f"- Elevation Gain: {elevation_gain:.1f} m" if elevation_gain else "- Elevation Gain: Unknown")
             
+            # Match the activity onto the user's road segments around it once, at import
+            try:
+                nearby_segments = get_user_segments_in_bbox(
+                    db, user.id, activity.min_lat, activity.min_lon, activity.max_lat, activity.max_lon, margin=50
+                )
+                traversals = []
+                if nearby_segments:
+                    edge_index = edge_index_from_segments(nearby_segments)
+                    # Simplified tracks are densified so straight stretches stay matchable
+                    traversals = match_track(edge_index, matching_points(gps_points_data).tolist())
+            except Exception as e:
+                print(f"Warning: Could not map match activity: {str(e)}")
+                traversals = None
+            
             # Update road segment run status based on this activity
-            update_segment_run_status(db, user.id, activity.id)
+            update_segment_run_status(db, user.id, activity.id, traversals=traversals)
             print("Updated road segment run status based on this activity")
             
         return activity
@@ -1499,6 +1440,119 @@ def load_gpx_file_as_activity(db, user, gpx_file_path):
         traceback.print_exc()
         return None
 
+def find_new_gpx_files(db, user, gpx_files):
+    """
+    Select the GPX files whose size or modification time differ from the import manifest
+    
+    Files recorded as failed are skipped too, until they change. Files whose
+    activity has since been deleted are selected again.
+    """
+    manifest = {
+        path: (entry.size, entry.mtime)
+        for path, entry in get_import_manifest(db, user.id).items()
+        if entry.status == 'failed' or entry.activity_id is not None
+    }
+    return [
+        file_info for file_info in gpx_files
+        if manifest.get(file_info['path']) != (file_info['size'], file_info['mtime'])
+    ]
+
+def import_gpx_files(db, user, gpx_files, simplify=False, archive_folder=None):
+    """
+    Import GPX files as activities: parse, optionally simplify, store and match each one
+    
+    Files whose contents hash the same as an already imported file are only added
+    to the import manifest. Files that fail to load are recorded as failed, so
+    find_new_gpx_files skips them until they change.
+    
+    Args:
+        db: SQLAlchemy session
+        user: User object
+        gpx_files: File info dicts from list_available_gpx_files
+        simplify: Simplify tracks before storing them
+        archive_folder: Folder to archive raw tracks to when simplifying
+        
+    Returns:
+        Dictionary with the number of files loaded, skipped and failed, and the
+        number of GPS points stored
+    """
+    results = {'loaded': 0, 'skipped': 0, 'failed': 0, 'points': 0}
+    if not gpx_files:
+        return results
+    
+    known_activities = {activity_id for (activity_id,) in db.query(Activity.id).filter(Activity.user_id == user.id)}
+    manifest = get_import_manifest(db, user.id).values()
+    # Contents only count as imported while their activity still exists; the manifest
+    # row of a deleted activity is refreshed when the file is imported again
+    imported_hashes = {
+        entry.content_hash: entry.activity_id
+        for entry in manifest
+        if entry.status == 'imported' and entry.activity_id in known_activities
+    }
+    failed_hashes = {entry.content_hash for entry in manifest if entry.status == 'failed'}
+    
+    for i, file_info in enumerate(gpx_files, 1):
+        print(f"\n[{i}/{len(gpx_files)}] Processing {file_info['filename']}...")
+        
+        try:
+            with open(file_info['path'], 'rb') as gpx_file:
+                content = gpx_file.read()
+        except OSError as e:
+            results['failed'] += 1
+            print(f"  ✗  Failed to read file: {str(e)}")
+            continue
+        content_hash = hashlib.sha256(content).hexdigest()
+        
+        if content_hash in imported_hashes:
+            record_imported_file(
+                db, user.id, file_info['path'], file_info['size'], file_info['mtime'],
+                content_hash, imported_hashes[content_hash]
+            )
+            results['skipped'] += 1
+            print(f"  ⚠️  Skipped (contents already imported)")
+            continue
+        
+        if content_hash in failed_hashes:
+            record_imported_file(
+                db, user.id, file_info['path'], file_info['size'], file_info['mtime'],
+                content_hash, None, status='failed'
+            )
+            results['skipped'] += 1
+            print(f"  ⚠️  Skipped (contents previously failed to load)")
+            continue
+        
+        activity = load_gpx_file_as_activity(
+            db, user, file_info['path'], simplify, archive_folder, gpx_content=content
+        )
+        
+        if activity:
+            record_imported_file(
+                db, user.id, file_info['path'], file_info['size'], file_info['mtime'],
+                content_hash, activity.id
+            )
+            imported_hashes[content_hash] = activity.id
+            if activity.id in known_activities:
+                results['skipped'] += 1
+                print(f"  ⚠️  Skipped (already exists)")
+            else:
+                known_activities.add(activity.id)
+                results['loaded'] += 1
+                results['points'] += track_length(activity.track) if activity.track else 0
+                print(f"  ✓  Successfully loaded")
+        else:
+            # Recorded and committed straight away, since a failed load rolls back the session
+            record_imported_file(
+                db, user.id, file_info['path'], file_info['size'], file_info['mtime'],
+                content_hash, None, status='failed'
+            )
+            db.commit()
+            failed_hashes.add(content_hash)
+            results['failed'] += 1
+            print(f"  ✗  Failed to load")
+    
+    db.commit()
+    return results
+
 def handle_load_strava_gps_data(db, user):
     """Handle loading GPS data from Strava files"""
     print("\n=== Load GPS Data from Strava File ===")
@@ -1517,6 +1571,9 @@ def handle_load_strava_gps_data(db, user):
     
     print(f"A. Load ALL {len(gpx_files)} files")
     
+    simplify = input("\nSimplify GPS tracks before storing them (raw tracks are archived to 'raw_tracks')? (y/n): ").lower() == 'y'
+    archive_folder = 'raw_tracks' if simplify else None
+    
     while True:
         choice = input(f"\nSelect a file to load (1-{len(gpx_files)}, A for all, or 0 to go back): ")
         
@@ -1526,85 +1583,22 @@ def handle_load_strava_gps_data(db, user):
         if choice.upper() == "A":
             # Load all files
             print(f"\nLoading all {len(gpx_files)} GPX files...")
-            successful_loads = 0
-            failed_loads = 0
-            skipped_loads = 0
+            batch_start = time.time()
             
-            for i, file_info in enumerate(gpx_files, 1):
-                print(f"\n[{i}/{len(gpx_files)}] Processing {file_info['filename']}...")
-                
-                # Try to extract activity data from GPX for ID generation
-                try:
-                    with open(file_info['path'], 'r') as gpx_file:
-                        gpx = gpxpy.parse(gpx_file)
-                        
-                        # Extract basic activity info
-                        activity_name = "Unknown Activity"
-                        activity_type = "Run"  # Default to Run
-                        start_time = None
-                        
-                        # Process tracks
-                        for track in gpx.tracks:
-                            if track.name:
-                                activity_name = track.name
-                            if track.type:
-                                activity_type = track.type.capitalize()
-                                
-                            for segment in track.segments:
-                                for point in segment.points:
-                                    if point.time:
-                                        start_time = point.time
-                                        if start_time.tzinfo is None:
-                                            start_time = start_time.replace(tzinfo=timezone.utc)
-                                        break
-                                if start_time:
-                                    break
-                            if start_time:
-                                break
-                        
-                        # Generate unique Strava ID based on activity data from GPX file
-                        safe_name = activity_name.replace(" ", "_").replace("/", "_").replace("\\", "_")[:50]
-                        safe_type = activity_type.replace(" ", "_")
-                        
-                        if start_time:
-                            time_str = start_time.strftime('%Y%m%d_%H%M%S')
-                            strava_id = f"{safe_type}_{safe_name}_{time_str}"
-                        else:
-                            # Fallback - need to read some GPS points for hash
-                            gps_points_sample = []
-                            for track in gpx.tracks:
-                                for segment in track.segments:
-                                    for point in segment.points[:5]:  # Just first 5 points
-                                        if point.latitude is not None and point.longitude is not None:
-                                            gps_points_sample.append((point.latitude, point.longitude))
-                            import hashlib
-                            gps_hash = hashlib.md5(str(gps_points_sample).encode()).hexdigest()[:8]
-                            strava_id = f"{safe_type}_{safe_name}_{gps_hash}"
-                        
-                        existing_activity = get_activity_by_strava_id(db, strava_id)
-                        
-                        if existing_activity:
-                            skipped_loads += 1
-                            print(f"  ⚠️  Skipped (already exists)")
-                            continue
-                            
-                except Exception as e:
-                    print(f"  ⚠️  Error checking existing activity: {str(e)}")
-                
-                activity = load_gpx_file_as_activity(db, user, file_info['path'])
-                
-                if activity:
-                    successful_loads += 1
-                    print(f"  ✓  Successfully loaded")
-                else:
-                    failed_loads += 1
-                    print(f"  ✗  Failed to load")
+            # Files already imported are skipped when their size and modification time
+            # are unchanged
+            new_files = find_new_gpx_files(db, user, gpx_files)
+            results = import_gpx_files(db, user, new_files, simplify, archive_folder)
+            successful_loads = results['loaded']
+            failed_loads = results['failed']
+            skipped_loads = len(gpx_files) - len(new_files) + results['skipped']
             
             print(f"\n=== Batch Load Summary ===")
             print(f"Total files processed: {len(gpx_files)}")
             print(f"Successfully loaded: {successful_loads}")
             print(f"Skipped (already existed): {skipped_loads}")
             print(f"Failed to load: {failed_loads}")
+            print(f"Time taken: {time.time() - batch_start:.2f} seconds")
             
             if successful_loads > 0:
                 print(f"\n✓ {successful_loads} new activities have been added to your account!")
@@ -1618,9 +1612,10 @@ def handle_load_strava_gps_data(db, user):
                 selected_file = gpx_files[index]
                 
                 print(f"\nLoading {selected_file['filename']}...")
-                activity = load_gpx_file_as_activity(db, user, selected_file['path'])
+                # Imported like a batch of one so the file is recorded in the import manifest
+                results = import_gpx_files(db, user, [selected_file], simplify, archive_folder)
                 
-                if activity:
+                if not results['failed']:
                     print(f"\n✓ Successfully loaded GPS data from {selected_file['filename']}")
                     
                     # Ask if user wants to load another file
@@ -1638,6 +1633,77 @@ def handle_load_strava_gps_data(db, user):
         except ValueError:
             print("Invalid input. Please enter a number or 'A' for all files.")
 
+def handle_watch_strava_folder(db, user, strava_folder='strava'):
+    """Watch the Strava folder and import new GPX files in batches as they arrive"""
+    print("\n=== Watch Strava Folder for New GPS Data ===")
+    
+    try:
+        poll_interval = float(input("Seconds between folder checks (default 30): ") or 30)
+        batch_size = int(input("Maximum files per batch (default 20): ") or 20)
+    except ValueError:
+        print("Invalid number.")
+        return
+    if poll_interval <= 0 or batch_size <= 0:
+        print("Values must be positive.")
+        return
+    simplify = input("Simplify GPS tracks before storing them (raw tracks are archived to 'raw_tracks')? (y/n): ").lower() == 'y'
+    archive_folder = 'raw_tracks' if simplify else None
+    
+    print(f"\nWatching '{strava_folder}' every {poll_interval:g} seconds. Press Ctrl+C to stop.")
+    total = {'loaded': 0, 'skipped': 0, 'failed': 0, 'points': 0}
+    batches = 0
+    
+    try:
+        while True:
+            # Import oldest files first so first runs are attributed in order
+            new_files = find_new_gpx_files(db, user, list_available_gpx_files(strava_folder))
+            new_files.sort(key=lambda file_info: file_info['mtime'])
+            
+            for start in range(0, len(new_files), batch_size):
+                batch = new_files[start:start + batch_size]
+                batch_start = time.time()
+                results = import_gpx_files(db, user, batch, simplify, archive_folder)
+                latency = time.time() - batch_start
+                
+                batches += 1
+                for key in total:
+                    total[key] += results[key]
+                print(f"\n📥 Batch {batches}: {len(batch)} files in {latency:.2f}s "
+                      f"({len(batch) / latency:.1f} files/s, {results['points'] / latency:.0f} points/s) - "
+                      f"{results['loaded']} loaded, {results['skipped']} skipped, {results['failed']} failed")
+            
+            time.sleep(poll_interval)
+            
+    except KeyboardInterrupt:
+        print(f"\n\nStopped watching. {batches} batches: {total['loaded']} activities loaded "
+              f"({total['points']} GPS points), {total['skipped']} skipped, {total['failed']} failed.")
+
+def load_location_edge_samples(db, location_id, folder='cache'):
+    """
+    Load the cached edge samples of a location, if they still match its road segments
+    
+    Location ids can be reused after the database is cleared, so a cache file left
+    behind by another location is ignored unless it covers every segment of this
+    location's routes.
+    
+    Args:
+        db: SQLAlchemy session
+        location_id: ID of the location
+        folder: Folder holding the cache files
+        
+    Returns:
+        Edge sample arrays from build_edge_samples, or None if there is no usable cache
+    """
+    edge_samples = load_edge_samples(edge_samples_path(location_id, folder))
+    if edge_samples is None:
+        return None
+    
+    location_segment_ids = get_location_segment_ids(db, location_id)
+    if not location_segment_ids or not location_segment_ids <= set(edge_samples['segment_ids'].tolist()):
+        print(f"⚠️  Ignoring stale edge samples for location {location_id}")
+        return None
+    return edge_samples
+
 def handle_analyze_gps_data(db, user):
     """Analyze GPS data from user activities and update road segment run status"""
     print("\n=== Analyze GPS Data and Update Road Segments ===")
@@ -1651,6 +1717,10 @@ def handle_analyze_gps_data(db, user):
     
     print(f"Found {len(activities)} activities in your account.")
     
+    # Apply the segment coverage stored when activities were imported
+    marked_from_coverage = update_run_status_from_activity_segments(db, user.id)
+    print(f"Marked {marked_from_coverage} road segments as run from stored activity coverage.")
+    
     # Get all user road segments
     print("Loading your road segments...")
     user_segments = get_user_road_segments(db, user.id)
@@ -1662,15 +1732,41 @@ def handle_analyze_gps_data(db, user):
     
     print(f"Found {len(user_segments)} road segments to analyze.")
     
+    # Only activities overlapping the segments not yet run can mark any of them;
+    # each location is checked on its own so far-apart locations don't merge into one box
+    unrun_extents = get_user_segment_extents(db, user.id, run_status=False)
+    if not unrun_extents:
+        print("\nAll of your road segments are already marked as run.")
+        return
+    
+    activities = get_user_activities_in_areas(db, user.id, unrun_extents, margin=50)
+    print(f"{len(activities)} activities overlap your unrun road segments.")
+    
+    # Activities matched at import have their segment coverage applied above; only
+    # those never matched, or matched before the newest segments were added, need
+    # their GPS points scanned
+    newest_segment = max(
+        (segment.created_at for segment in user_segments if segment.created_at and not segment.has_been_run),
+        default=None
+    )
+    activities = [
+        activity for activity in activities
+        if activity.matched_at is None or (newest_segment and activity.matched_at < newest_segment)
+    ]
+    print(f"{len(activities)} activities need their GPS points analyzed.")
+    if not activities:
+        return
+    
     try:
-        # Collect all GPS points from user activities
-        print("Collecting GPS points from all activities...")
+        # Collect all GPS points from the overlapping activities
+        print("Collecting GPS points from overlapping activities...")
         all_gps_points = []
         
         for activity in activities:
-            gps_points = get_activity_gps_points(db, activity.id)
-            for point in gps_points:
-                all_gps_points.append((point.latitude, point.longitude))
+            track = get_activity_track(db, activity.id)
+            # Fill in the gaps of simplified tracks so every stretch of road run has nearby points
+            track = densify_track(np.column_stack((track['latitude'], track['longitude'])))
+            all_gps_points.extend(map(tuple, track.tolist()))
         
         if not all_gps_points:
             print("No GPS points found in activities.")
@@ -1693,12 +1789,59 @@ def handle_analyze_gps_data(db, user):
         print("Analyzing GPS coverage for each road segment...")
         
         from geoalchemy2.shape import to_shape
-        import numpy as np
         from scipy.spatial import cKDTree
         
-        # Create spatial index for GPS points for efficient matching
+        # Create spatial index for GPS points for efficient matching, on a metric
+        # plane centred on the GPS points so distances come out in meters
         gps_points_array = np.array(deduplicated_points)
-        gps_tree = cKDTree(gps_points_array)
+        origin = local_origin(gps_points_array)
+        gps_tree = cKDTree(project(gps_points_array, origin))
+        
+        # Segments stored with a location have precomputed edge samples; the rest are
+        # sampled here with the same routine, and all of them are scored in one query
+        pending_ids = {segment.segment_id for segment in user_segments if not segment.has_been_run}
+        sampled_ids = []
+        sampled_points = []
+        sampled_counts = []
+        for location in user.locations:
+            edge_samples = load_location_edge_samples(db, location.id)
+            if edge_samples is None:
+                continue
+            
+            sample_counts = np.diff(edge_samples['sample_offsets'])
+            wanted = np.isin(edge_samples['segment_ids'], list(pending_ids)) & (sample_counts > 0)
+            sampled_ids.extend(edge_samples['segment_ids'][wanted].tolist())
+            sampled_points.append(edge_samples['samples'][np.repeat(wanted, sample_counts)])
+            sampled_counts.append(sample_counts[wanted])
+            pending_ids -= set(edge_samples['segment_ids'][wanted].tolist())
+        cached_count = len(sampled_ids)
+        
+        uncached = [
+            (segment.segment_id, np.asarray(to_shape(segment.geometry).coords, dtype=float))  # (lat, lon)
+            for segment in user_segments
+            if segment.segment_id in pending_ids and segment.geometry is not None
+        ]
+        if uncached:
+            coord_offsets = np.concatenate(([0], np.cumsum([len(coords) for _, coords in uncached])))
+            _, samples, sample_offsets = sample_edges(np.vstack([coords for _, coords in uncached]), coord_offsets)
+            sample_counts = np.diff(sample_offsets)
+            sampled_ids.extend(segment_id for (segment_id, _), count in zip(uncached, sample_counts) if count > 0)
+            sampled_points.append(samples)
+            sampled_counts.append(sample_counts[sample_counts > 0])
+        
+        segment_deviations = {}
+        if sampled_ids:
+            sample_counts = np.concatenate(sampled_counts)
+            starts = np.concatenate(([0], np.cumsum(sample_counts)[:-1]))
+            distances_meters, _ = gps_tree.query(project(np.concatenate(sampled_points), origin), k=1, workers=-1)
+            avg_deviations = np.add.reduceat(distances_meters, starts) / sample_counts
+            min_deviations = np.minimum.reduceat(distances_meters, starts)
+            max_deviations = np.maximum.reduceat(distances_meters, starts)
+            segment_deviations = {
+                segment_id: deviations
+                for segment_id, *deviations in zip(sampled_ids, avg_deviations, min_deviations, max_deviations)
+            }
+            print(f"Scored {len(segment_deviations)} segments ({cached_count} from cached edge samples)")
         
         updates_made = 0
         segments_marked_run = 0
@@ -1746,41 +1889,12 @@ def handle_analyze_gps_data(db, user):
                         print(f"  Coord range - Lat: {min(c[0] for c in coords_list):.6f} to {max(c[0] for c in coords_list):.6f}")
                         print(f"  Coord range - Lon: {min(c[1] for c in coords_list):.6f} to {max(c[1] for c in coords_list):.6f}")
                 
-                # Sample points along the segment for analysis
-                segment_length = segment_line.length  # This is in degrees, approximate
-                if segment_length == 0:
-                    continue
-                
-                # Sample points along the segment (every ~10 meters equivalent in degrees)
-                sample_distance_degrees = 10 / 111000  # Approximate conversion
-                num_samples = max(3, int(segment_length / sample_distance_degrees))
-                
-                sampled_points = []
-                for i in range(num_samples):
-                    fraction = i / (num_samples - 1) if num_samples > 1 else 0
-                    point = segment_line.interpolate(fraction, normalized=True)
-                    # If geometry is stored as (lat, lon), then point.x = lat, point.y = lon
-                    sampled_points.append((point.x, point.y))  # (lat, lon)
-                
-                if not sampled_points:
-                    continue
-                
-                # Debug: Show sampled points for first few segments
-                if total_analyzed <= 3:
-                    print(f"  Sampled {len(sampled_points)} points: {sampled_points[:2]}...{sampled_points[-2:] if len(sampled_points) > 4 else ''}")
-                
-                # Find nearest GPS points for each sampled point
-                sampled_points_array = np.array(sampled_points)
-                distances, indices = gps_tree.query(sampled_points_array, k=1)
-                
-                # Convert distances from degrees to meters (approximate)
-                distances_meters = distances * 111000
+                if segment.segment_id not in segment_deviations:
+                    continue  # Too short to sample
+                avg_deviation, min_deviation, max_deviation = segment_deviations[segment.segment_id]
                 
                 # Check if GPS points are close enough to consider the segment as "run"
                 max_deviation_threshold = 15  # meters
-                avg_deviation = np.mean(distances_meters)
-                min_deviation = np.min(distances_meters)
-                max_deviation = np.max(distances_meters)
                 
                 # Debug: Show deviation analysis for first few segments
                 if total_analyzed <= 3:
@@ -1824,7 +1938,7 @@ def handle_analyze_gps_data(db, user):
             print(f"✓ {segments_marked_run} segments marked as run")
             
             # Show updated statistics
-            stats = get_user_segment_stats(db, user.id)
+            stats = get_user_segment_stats(db, user.id, from_rollup=True)
             if stats:
                 total_segments = stats.get('total_segments', 0)
                 run_segments = stats.get('run_segments', 0)
@@ -1991,9 +2105,9 @@ def visualize_user_progress(db, user):
         not_run_segments_layer.add_to(m)
         gps_tracks_layer.add_to(m)
         
-        # Get user's GPS activities for visualization
+        # Get user's GPS activities overlapping the segments for visualization
         print("Loading GPS tracks...")
-        activities = get_user_activities(db, user.id)
+        activities = get_user_activities_in_areas(db, user.id, get_user_segment_extents(db, user.id), margin=50)
         gps_tracks_added = 0
         
         if activities:
@@ -2002,10 +2116,10 @@ def visualize_user_progress(db, user):
             
             for i, activity in enumerate(activities):
                 try:
-                    gps_points = get_activity_gps_points(db, activity.id)
-                    if gps_points and len(gps_points) > 1:
+                    track = get_activity_track(db, activity.id)
+                    if track and len(track['latitude']) > 1:
                         # Create line from GPS points
-                        gps_coords = [(point.latitude, point.longitude) for point in gps_points]
+                        gps_coords = np.column_stack((track['latitude'], track['longitude'])).tolist()
                         
                         # Create popup for GPS track
                         gps_popup_text = f"""
@@ -2014,7 +2128,7 @@ def visualize_user_progress(db, user):
                         Type: {activity.activity_type}<br>
                         Distance: {activity.distance/1000:.1f}km<br>
                         Duration: {activity.duration/60:.0f}min<br>
-                        GPS Points: {len(gps_points)}
+                        GPS Points: {len(gps_coords)}
                         """
                         
                         # Add GPS track to GPS layer
@@ -2356,8 +2470,8 @@ def diagnose_road_segments(db, user):
         # Check GPS points
         total_gps_points = 0
         for activity in activities:
-            gps_points = get_activity_gps_points(db, activity.id)
-            total_gps_points += len(gps_points)
+            track = get_activity_track(db, activity.id)
+            total_gps_points += len(track['latitude']) if track else 0
         
         print(f"   Total GPS points: {total_gps_points}")
         
@@ -3037,6 +3151,7 @@ def main():
                 if confirm.lower() == 'yes':
                     print("\nClearing database...")
                     if clear_database(db):
+                        remove_edge_samples()
                         print("Database cleared successfully. Please restart the application.")
                         break
                     else:
@@ -3087,6 +3202,9 @@ def main():
             elif choice == "11":
                 cleanup_existing_files()
                 
+            elif choice == "12":
+                handle_watch_strava_folder(db, user)
+                
             else:
                 print("\nInvalid option. Please try again.")
             
@@ -1,8 +1,8 @@
 import os
+import glob
 import gpxpy
 import numpy as np
 import networkx as nx
-from geopy.distance import geodesic
 import logging
 from collections import defaultdict
 import time
@@ -10,7 +10,12 @@ import json
 from scipy.spatial import cKDTree
 from concurrent.futures import ProcessPoolExecutor
 import multiprocessing
+from multiprocessing import shared_memory
 import csv
+from graph_utils import get_node_index, nearest_nodes
+from projection import local_origin, project
+from track_processing import filter_track_arrays
+from geodesy import consecutive_distances, geodesic_distance, haversine_distance, pairwise_distances, path_lengths
 
 # Configure logging
 logging.basicConfig(
@@ -21,7 +26,8 @@ logging.basicConfig(
 
 def read_strava_files(folder_path):
     """Read all GPX files from the Strava folder and extract GPS coordinates.
-    Maintains a persistent deduplicated list of points and only processes new files."""
+    Maintains a persistent deduplicated list of points and only processes new or changed
+    files, recognised by their size and modification time."""
     from scipy.spatial import cKDTree
     
     # File to store deduplicated points and processed files
@@ -30,7 +36,7 @@ def read_strava_files(folder_path):
     # Initialize lists
     all_points = []
     deduplicated_points = []
-    processed_files = set()
+    processed_files = {}
     
     # Try to load existing cache
     if os.path.exists(cache_file):
@@ -38,7 +44,12 @@ def read_strava_files(folder_path):
             with open(cache_file, 'r') as f:
                 cache = json.load(f)
                 deduplicated_points = [tuple(point) for point in cache['points']]
-                processed_files = set(cache['processed_files'])
+                # Older caches list file names only; trust those as unchanged
+                cached_files = cache['processed_files']
+                if isinstance(cached_files, dict):
+                    processed_files = cached_files
+                else:
+                    processed_files = {filename: None for filename in cached_files}
                 logging.info(f"Loaded {len(deduplicated_points)} deduplicated points from cache")
                 logging.info(f"Found {len(processed_files)} previously processed files")
         except Exception as e:
@@ -47,15 +58,20 @@ def read_strava_files(folder_path):
     # Process new files
     new_files = False
     for filename in os.listdir(folder_path):
-        if filename.endswith('.gpx') and filename not in processed_files:
+        if not filename.endswith('.gpx'):
+            continue
+        file_path = os.path.join(folder_path, filename)
+        stat = os.stat(file_path)
+        fingerprint = [stat.st_size, stat.st_mtime]
+        if filename not in processed_files or processed_files[filename] not in (None, fingerprint):
             new_files = True
-            file_path = os.path.join(folder_path, filename)
             try:
                 with open(file_path, 'r') as gpx_file:
                     gpx = gpxpy.parse(gpx_file)
                     
                     # Process points from this file
                     file_points = []
+                    file_times = []
                     for track in gpx.tracks:
                         for segment in track.segments:
                             for point in segment.points:
@@ -64,6 +80,7 @@ def read_strava_files(folder_path):
                                     # Check for valid coordinate ranges
                                     if -90 <= point.latitude <= 90 and -180 <= point.longitude <= 180:
                                         file_points.append((point.latitude, point.longitude))
+                                        file_times.append(point.time.timestamp() if point.time else np.nan)
                                     else:
                                         logging.warning(f"Invalid coordinates in {filename}: lat={point.latitude}, lon={point.longitude}")
                     
@@ -71,6 +88,16 @@ def read_strava_files(folder_path):
                         logging.warning(f"No valid points found in {filename}")
                         continue
                     
+                    # Drop GPS noise before deduplication
+                    keep, filter_stats = filter_track_arrays(file_points, file_times)
+                    if not keep.all():
+                        logging.info(
+                            f"Filtered {len(keep) - np.count_nonzero(keep)} of {len(keep)} points from {filename} "
+                            f"({filter_stats['duplicates']} duplicate timestamps, {filter_stats['outliers']} jumps, "
+                            f"{filter_stats['dwell']} stationary)"
+                        )
+                        file_points = [point for point, kept in zip(file_points, keep) if kept]
+                    
                     # Add to all points
                     all_points.extend(file_points)
                     
@@ -84,20 +111,14 @@ def read_strava_files(folder_path):
                         points_added = len(file_points)
                     else:
                         try:
-                            # Convert existing points to numpy array and create KD-tree
-                            existing_points_array = np.array(deduplicated_points)
-                            kdtree = cKDTree(existing_points_array)
-                            
-                            # Convert new points to numpy array
+                            # Project existing and new points onto a metric plane around
+                            # this file's points and index the existing ones
                             new_points_array = np.array(file_points)
+                            origin = local_origin(new_points_array)
+                            kdtree = cKDTree(project(deduplicated_points, origin))
                             
                             # Find nearest neighbors for all new points at once
-                            distances, _ = kdtree.query(new_points_array, k=1)
-                            
-                            # Convert distances from degrees to meters (approximate)
-                            # 1 degree ≈ 111km at the equator
-                            # Add a small epsilon to avoid division by zero
-                            distances_meters = distances * 111000 + 1e-10
+                            distances_meters, _ = kdtree.query(project(new_points_array, origin), k=1)
                             
                             # Filter points that are far enough from existing points
                             far_enough = distances_meters > 5
@@ -111,14 +132,12 @@ def read_strava_files(folder_path):
                             logging.error(f"Error processing points from {filename}: {str(e)}")
                             # Fall back to original method if KD-tree fails
                             for point in file_points:
-                                distances = np.array([geodesic(point, existing_point).meters 
-                                                   for existing_point in deduplicated_points])
-                                if np.all(distances > 5):
+                                if np.all(pairwise_distances(point, deduplicated_points) > 5):
                                     deduplicated_points.append(point)
                             points_added = len(file_points)
                     
                     # Mark file as processed
-                    processed_files.add(filename)
+                    processed_files[filename] = fingerprint
                     total_time = time.time() - start_time
                     logging.info(f"Completed processing {filename}")
                     logging.info(f"Added {points_added} new unique points")
@@ -135,7 +154,7 @@ def read_strava_files(folder_path):
             with open(cache_file, 'w') as f:
                 json.dump({
                     'points': deduplicated_points,
-                    'processed_files': list(processed_files)
+                    'processed_files': processed_files
                 }, f)
             logging.info(f"Saved {len(deduplicated_points)} deduplicated points to cache")
         except Exception as e:
@@ -149,13 +168,7 @@ def read_strava_files(folder_path):
 
 def find_nearest_node(G, point):
     """Find the nearest node in the graph to a given GPS point."""
-    nodes = list(G.nodes())
-    node_coords = np.array([(G.nodes[node]['y'], G.nodes[node]['x']) for node in nodes])
-    point_coords = np.array([point[0], point[1]])
-    
-    distances = np.linalg.norm(node_coords - point_coords, axis=1)
-    nearest_idx = np.argmin(distances)
-    return nodes[nearest_idx]
+    return nearest_nodes(G, [point])[0]
 
 def preprocess_gps_points(points, min_distance=5):
     """Preprocess GPS points to remove duplicates and points that are too close together.
@@ -190,11 +203,8 @@ def preprocess_gps_points(points, min_distance=5):
             logging.info(f"Current unique points: {len(unique_points)}")
             last_progress_time = current_time
         
-        # Calculate distances to all unique points
-        distances = np.array([geodesic(point, unique_point).meters for unique_point in unique_points])
-        
         # Only add point if it's far enough from all existing points
-        if np.all(distances > min_distance):
+        if np.all(geodesic_distance(point, unique_points) > min_distance):
             unique_points.append(point)
             
             # Log when we find a unique point
@@ -275,281 +285,351 @@ def visualize_gps_points(points, title="GPS Points", output_file='gps_points.htm
     m.save(output_file)
     logging.info(f"GPS points visualization saved to {output_file}")
 
-def process_edge(args):
-    """Process a single edge and return its results."""
-    edge, edge_data, gps_tree, gps_points, sample_distance, max_deviation = args
+# Per-process state for parallel matching workers: the shared GPS point array and
+# the KD-tree rebuilt over it once when the worker starts
+_worker_state = {}
+
+def _init_match_worker(shm_name, shape, dtype):
+    """Attach a matching worker to the shared GPS point array and index it."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    gps_points = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _worker_state['shm'] = shm
+    _worker_state['gps_points'] = gps_points
+    _worker_state['gps_tree'] = cKDTree(gps_points)
+
+def score_edge_samples(gps_tree, samples, sample_counts, max_deviation, query_workers=-1):
+    """Score runs of edge samples against the GPS point index.
     
-    # Get edge geometry and calculate length
-    if edge_data and 'geometry' in edge_data[0]:
-        edge_coords = [(lat, lon) for lon, lat in edge_data[0]['geometry'].coords]
-    else:
-        # Get node coordinates from the edge tuple
-        u, v = edge
-        edge_coords = [
-            (edge_data[0]['y'], edge_data[0]['x']),  # Start node
-            (edge_data[0]['y'], edge_data[0]['x'])   # End node
-        ]
-    
-    # Calculate edge length
-    edge_length = 0
-    for i in range(len(edge_coords) - 1):
-        edge_length += geodesic(edge_coords[i], edge_coords[i + 1]).meters
+    Args:
+        gps_tree: cKDTree over the projected GPS points
+        samples: (S, 2) array of projected sample points, grouped by edge
+        sample_counts: Number of samples of each edge (all greater than zero)
+        max_deviation: Maximum average deviation in meters for an edge to count as run
+        query_workers: Threads for the KD-tree query; -1 uses every core, which only
+            suits a single process
+        
+    Returns:
+        Tuple of (avg_deviations, max_deviations, matched_indices) where the deviations
+        hold one value per edge and matched_indices are the GPS point indices matched by
+        edges that passed the early rejection threshold
+    """
+    if len(sample_counts) == 0:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
     
-    # Adaptive sampling: fewer points for longer edges
-    num_samples = min(50, int(edge_length / sample_distance) + 1)
-    
-    # Sample points along the edge
-    sampled_points = []
-    for i in range(len(edge_coords) - 1):
-        start = edge_coords[i]
-        end = edge_coords[i + 1]
-        segment_length = geodesic(start, end).meters
-        segment_samples = int(num_samples * (segment_length / edge_length))
+    distances_meters, indices = gps_tree.query(samples, k=1, workers=query_workers)
+    
+    # Per-edge mean and maximum deviation over each edge's run of samples
+    run_starts = np.cumsum(sample_counts) - sample_counts
+    avg_deviations = np.add.reduceat(distances_meters, run_starts) / sample_counts
+    max_deviations = np.maximum.reduceat(distances_meters, run_starts)
+    
+    # Early termination if average deviation is too high
+    kept = avg_deviations <= max_deviation * 2  # More lenient threshold for early termination
+    matched_indices = np.unique(indices[np.repeat(kept, sample_counts)])
+    
+    return avg_deviations, max_deviations, matched_indices
+
+def process_edge_chunk(args):
+    """Score one chunk of edges inside a matching worker process, on a single thread."""
+    samples, sample_counts, max_deviation = args
+    # The pool already runs one process per core; threads on top would oversubscribe it
+    return score_edge_samples(_worker_state['gps_tree'], samples, sample_counts, max_deviation, query_workers=1)
+
+def _score_edge_samples_parallel(gps_points, samples, sample_counts, max_deviation, workers):
+    """Score edge samples across worker processes.
+    
+    Edges are split into chunks of roughly equal sample count. The GPS points are
+    placed in shared memory once and every worker builds its own KD-tree over them
+    on startup, so only the sample chunks are sent with each task.
+    """
+    if len(sample_counts) == 0:
+        return score_edge_samples(None, samples, sample_counts, max_deviation)
+    
+    # Cut the edge list where the running sample count crosses each chunk boundary
+    num_chunks = min(len(sample_counts), workers * 4)
+    sample_ends = np.cumsum(sample_counts)
+    targets = sample_ends[-1] * np.arange(1, num_chunks) / num_chunks
+    edge_cuts = np.searchsorted(sample_ends, targets, side='right')
+    edge_bounds = np.unique(np.concatenate(([0], edge_cuts, [len(sample_counts)])))
+    sample_bounds = np.concatenate(([0], sample_ends))[edge_bounds]
+    
+    tasks = [
+        (samples[sample_bounds[i]:sample_bounds[i + 1]],
+         sample_counts[edge_bounds[i]:edge_bounds[i + 1]],
+         max_deviation)
+        for i in range(len(edge_bounds) - 1)
+    ]
+    
+    shm = shared_memory.SharedMemory(create=True, size=gps_points.nbytes)
+    try:
+        shared_points = np.ndarray(gps_points.shape, dtype=gps_points.dtype, buffer=shm.buf)
+        shared_points[:] = gps_points
         
-        for j in range(segment_samples):
-            fraction = j / (segment_samples - 1) if segment_samples > 1 else 0
-            lat = start[0] + fraction * (end[0] - start[0])
-            lon = start[1] + fraction * (end[1] - start[1])
-            sampled_points.append((lat, lon))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_match_worker,
+            initargs=(shm.name, gps_points.shape, gps_points.dtype)
+        ) as executor:
+            results = list(executor.map(process_edge_chunk, tasks))
+    finally:
+        shm.close()
+        shm.unlink()
+    
+    # Chunks come back in order, so concatenating restores the per-edge layout
+    avg_deviations = np.concatenate([result[0] for result in results])
+    max_deviations = np.concatenate([result[1] for result in results])
+    matched_indices = np.unique(np.concatenate([result[2] for result in results]))
+    return avg_deviations, max_deviations, matched_indices
+
+def collect_edge_coordinates(G):
+    """Flatten the geometry of every edge in the graph into one coordinate array.
     
-    # Convert sampled points to numpy array for faster processing
-    sampled_points_array = np.array(sampled_points)
+    Args:
+        G: NetworkX graph containing the road network
+        
+    Returns:
+        Tuple of (edges, edge_names, coords, coord_offsets) where edges is the list of
+        (sorted) edge tuples, edge_names maps each edge to its numbered road name,
+        coords is an (N, 2) array of (lat, lon) points and the points of edges[i]
+        are coords[coord_offsets[i]:coord_offsets[i + 1]]
+    """
+    edges = []
+    seen_edges = set()
+    edge_names = {}
+    road_segment_counts = {}
+    edge_coords = []
     
-    # Find nearest GPS points using spatial index
-    distances, indices = gps_tree.query(sampled_points_array, k=1)
+    for u, v, data in G.edges(data=True):
+        edge = tuple(sorted([u, v]))
+        edge_data = G.get_edge_data(u, v)
+        
+        # Get road name and assign segment number
+        base_road_name = str(edge_data[0].get('name', 'Unnamed Road'))
+        road_segment_counts[base_road_name] = road_segment_counts.get(base_road_name, 0) + 1
+        edge_names[edge] = f"{base_road_name}_{road_segment_counts[base_road_name]}"
+        
+        # Parallel edges share the geometry of the first edge between the two nodes
+        if edge in seen_edges:
+            continue
+        seen_edges.add(edge)
+        
+        if 'geometry' in edge_data[0]:
+            coords = np.asarray(edge_data[0]['geometry'].coords, dtype=float)[:, [1, 0]]
+        else:
+            coords = np.array([
+                (G.nodes[u]['y'], G.nodes[u]['x']),
+                (G.nodes[v]['y'], G.nodes[v]['x'])
+            ], dtype=float)
+        
+        edges.append(edge)
+        edge_coords.append(coords)
     
-    # Calculate statistics
-    avg_deviation = np.mean(distances)
-    max_single_deviation = np.max(distances)
+    coord_offsets = np.zeros(len(edges) + 1, dtype=np.int64)
+    coord_offsets[1:] = np.cumsum([len(coords) for coords in edge_coords])
+    coords = np.vstack(edge_coords) if edge_coords else np.empty((0, 2))
     
-    # Early termination if average deviation is too high
-    if avg_deviation > max_deviation * 2:  # More lenient threshold for early termination
-        return {
-            'edge': edge,
-            'length': edge_length,
-            'sampled_points': len(sampled_points),
-            'avg_deviation': avg_deviation,
-            'max_deviation': max_single_deviation,
-            'matched_points': set(),
-            'is_valid': False
-        }
+    return edges, edge_names, coords, coord_offsets
+
+def sample_edges(coords, coord_offsets, sample_distance=10, edge_mask=None):
+    """Sample points along every edge in one vectorized pass.
     
-    # Get matched GPS points
-    matched_gps_points = set(map(tuple, gps_points[indices]))
+    Each edge gets min(50, length / sample_distance + 1) samples (at least 2), spread
+    over its straight segments in proportion to their length. Edges shorter than 1m,
+    segments shorter than 0.1m and edges excluded by edge_mask get no samples.
+    
+    Args:
+        coords: (N, 2) array of (lat, lon) edge points from collect_edge_coordinates
+        coord_offsets: Offsets of each edge's points in coords
+        sample_distance: Distance in meters between sampled points along the road
+        edge_mask: Optional boolean array selecting which edges to sample
+        
+    Returns:
+        Tuple of (edge_lengths, samples, sample_offsets) where edge_lengths holds the
+        length of every edge in meters, samples is an (S, 2) array of (lat, lon)
+        points and the samples of edge i are samples[sample_offsets[i]:sample_offsets[i + 1]]
+    """
+    num_edges = len(coord_offsets) - 1
+    
+    # Consecutive coordinates form a segment when they belong to the same edge
+    coord_edges = np.repeat(np.arange(num_edges), np.diff(coord_offsets))
+    is_segment = coord_edges[:-1] == coord_edges[1:]
+    segment_edges = coord_edges[:-1][is_segment]
+    segment_starts = coords[:-1][is_segment]
+    segment_ends = coords[1:][is_segment]
+    segment_lengths = haversine_distance(segment_starts, segment_ends)
+    
+    edge_lengths = np.bincount(segment_edges, weights=segment_lengths, minlength=num_edges)
+    
+    # Adaptive sampling: fewer points for longer edges
+    num_samples = np.clip((edge_lengths // sample_distance).astype(np.int64) + 1, 2, 50)
+    sampled_edges = edge_lengths >= 1.0  # Skip edges shorter than 1 meter
+    if edge_mask is not None:
+        sampled_edges &= edge_mask
+    
+    # Samples per segment, proportional to its share of the edge length
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = segment_lengths / edge_lengths[segment_edges]
+    segment_samples = np.maximum(2, (num_samples[segment_edges] * share).astype(np.int64))
+    segment_samples[~sampled_edges[segment_edges] | (segment_lengths < 0.1)] = 0
+    
+    # Interpolate all samples at once
+    sample_segments = np.repeat(np.arange(len(segment_samples)), segment_samples)
+    first_sample = np.cumsum(segment_samples) - segment_samples
+    step = np.arange(len(sample_segments)) - first_sample[sample_segments]
+    fraction = step / (segment_samples[sample_segments] - 1)
+    samples = segment_starts[sample_segments] + fraction[:, None] * (
+        segment_ends[sample_segments] - segment_starts[sample_segments]
+    )
+    
+    sample_offsets = np.zeros(num_edges + 1, dtype=np.int64)
+    sample_offsets[1:] = np.cumsum(np.bincount(segment_edges, weights=segment_samples, minlength=num_edges)).astype(np.int64)
+    
+    return edge_lengths, samples, sample_offsets
+
+def edge_samples_path(location_id, folder='cache'):
+    """Path of the persisted edge sample arrays for a location."""
+    return os.path.join(folder, f"edge_samples_{location_id}.npz")
+
+def remove_edge_samples(location_id=None, folder='cache'):
+    """Delete the persisted edge sample arrays of a location, or of every location if none is given."""
+    if location_id is not None:
+        paths = [edge_samples_path(location_id, folder)]
+    else:
+        paths = glob.glob(os.path.join(folder, "edge_samples_*.npz"))
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+            logging.info(f"Removed edge samples {path}")
+
+def build_edge_samples(G, sample_distance=10, segment_id=None):
+    """Precompute the sample points of every edge in the road network.
+    
+    Road geometry for a location does not change, so these arrays can be built once
+    when its segments are stored and reused by every later matching run.
+    
+    Args:
+        G: NetworkX graph containing the road network
+        sample_distance: Distance in meters between sampled points along the road
+        segment_id: Optional function (osm_id, node_u, node_v) -> segment ID used to
+            label each edge with its road segment
+            
+    Returns:
+        Dictionary of arrays: edges ((E, 2) sorted node pairs), road_names, segment_ids,
+        lengths (geodesic edge lengths in meters), samples ((S, 2) lat/lon sample
+        points) and sample_offsets (the samples of edge i are
+        samples[sample_offsets[i]:sample_offsets[i + 1]])
+    """
+    edges, edge_names, coords, coord_offsets = collect_edge_coordinates(G)
+    _, samples, sample_offsets = sample_edges(coords, coord_offsets, sample_distance)
+    
+    lengths = path_lengths(coords, coord_offsets)
+    
+    segment_ids = [
+        segment_id(str(G.get_edge_data(u, v)[0].get('osmid', '')), u, v) if segment_id else ''
+        for u, v in edges
+    ]
     
     return {
-        'edge': edge,
-        'length': edge_length,
-        'sampled_points': len(sampled_points),
-        'avg_deviation': avg_deviation,
-        'max_deviation': max_single_deviation,
-        'matched_points': matched_gps_points,
-        'is_valid': avg_deviation <= max_deviation
+        'edges': np.array(edges).reshape(-1, 2),
+        'road_names': np.array([edge_names[edge] for edge in edges], dtype=str),
+        'segment_ids': np.array(segment_ids, dtype=str),
+        'lengths': lengths,
+        'samples': samples,
+        'sample_offsets': sample_offsets
     }
 
-def match_points_to_edges(G, points, max_deviation=15, sample_distance=10):
+def save_edge_samples(edge_samples, path):
+    """Persist edge sample arrays built by build_edge_samples."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    np.savez_compressed(path, **edge_samples)
+    logging.info(f"Saved {len(edge_samples['samples'])} samples for {len(edge_samples['edges'])} edges to {path}")
+
+def load_edge_samples(path):
+    """Load edge sample arrays saved by save_edge_samples, or None if there are none."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            return {key: data[key] for key in data.files}
+    except Exception as e:
+        logging.warning(f"Error loading edge samples from {path}: {str(e)}")
+        return None
+
+def match_points_to_edges(G, points, max_deviation=15, sample_distance=10, workers=1, edge_samples=None):
     """Match GPS points to edges in the graph.
     max_deviation: maximum average deviation in meters that GPS points can be from the road
-    sample_distance: distance in meters between sampled points along the road"""
-    from scipy.spatial import cKDTree
-    
-    valid_edges = set()
-    matched_points = set()
-    edge_deviations = {}
-    edge_max_deviations = {}
-    edge_names = {}  # Store road names for each edge
-    road_segment_counts = {}  # Track segment numbers for each road name
-    
+    sample_distance: distance in meters between sampled points along the road
+    workers: number of worker processes to score edges with (None for one per CPU)
+    edge_samples: precomputed arrays from build_edge_samples for this graph, built on the fly if not given"""
     # Use deduplicated points for matching
     original_points, deduplicated_points = points
     logging.info(f"Using {len(deduplicated_points)} deduplicated GPS points for matching")
+    start_time = time.time()
     
     # Convert to numpy array for faster distance calculations
     gps_points = np.array(deduplicated_points)
     
-    # Create spatial index for GPS points
-    logging.info("Creating spatial index for GPS points...")
-    gps_tree = cKDTree(gps_points)
+    if edge_samples is None:
+        edge_samples = build_edge_samples(G, sample_distance)
+    edges = [tuple(edge) for edge in edge_samples['edges'].tolist()]
+    edge_names = dict(zip(edges, edge_samples['road_names'].tolist()))
+    edge_lengths = edge_samples['lengths']
+    total_edges = len(edges)
     
-    # Get total number of edges and calculate total distance
-    total_edges = len(G.edges())
-    total_distance = 0
-    total_sampled_points = 0
-    
-    # Calculate total distance and points first
-    for u, v, data in G.edges(data=True):
-        edge_data = G.get_edge_data(u, v)
-        if edge_data and 'geometry' in edge_data[0]:
-            edge_coords = [(lat, lon) for lon, lat in edge_data[0]['geometry'].coords]
-        else:
-            edge_coords = [
-                (G.nodes[u]['y'], G.nodes[u]['x']),
-                (G.nodes[v]['y'], G.nodes[v]['x'])
-            ]
-        
-        # Calculate edge length
-        edge_length = 0
-        for i in range(len(edge_coords) - 1):
-            edge_length += geodesic(edge_coords[i], edge_coords[i + 1]).meters
-        
-        total_distance += edge_length
-        total_sampled_points += int(edge_length / sample_distance) + 1
+    # Project GPS points onto the same metric plane as the graph's node index
+    node_index = get_node_index(G)
+    origin = node_index['origin']
+    gps_xy = project(gps_points, origin)
     
+    # Create spatial index for GPS points
+    logging.info("Creating spatial index for GPS points...")
+    gps_tree = cKDTree(gps_xy)
+    
+    # Distance from every graph node to its nearest GPS point, in one batched query.
+    # Every point on an edge lies within half the edge length of one of its end nodes,
+    # so an edge whose end nodes are both further than that (plus the early rejection
+    # threshold) from any GPS point cannot pass the deviation checks below.
+    node_gps_distances, _ = gps_tree.query(node_index['xy'], k=1, workers=-1)
+    node_positions = node_index['positions']
+    
+    edge_nodes = np.array([(node_positions[u], node_positions[v]) for u, v in edges], dtype=np.int64).reshape(-1, 2)
+    reach = 1.01 * edge_lengths / 2 + max_deviation * 2
+    edge_mask = node_gps_distances[edge_nodes].min(axis=1) <= reach
+    logging.info(f"Skipping {total_edges - int(edge_mask.sum())} edges with no nearby GPS points")
+    
+    # Keep the samples of the remaining edges and find the nearest GPS point to
+    # every one of them in one query
+    sample_counts = np.diff(edge_samples['sample_offsets']) * edge_mask
+    samples = project(edge_samples['samples'][np.repeat(edge_mask, np.diff(edge_samples['sample_offsets']))], origin)
+    sample_offsets = np.concatenate(([0], np.cumsum(sample_counts)))
+    total_distance = edge_lengths.sum()
     logging.info(f"Total road network distance: {total_distance:.1f} meters")
-    logging.info(f"Total sampled points to check: {total_sampled_points}")
+    logging.info(f"Total sampled points to check: {len(samples)}")
+    
+    sample_counts = np.diff(sample_offsets)
+    sampled = np.flatnonzero(sample_counts > 0)
+    
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers > 1:
+        logging.info(f"Scoring edges across {workers} worker processes...")
+        avg_deviations, max_deviations, matched_indices = _score_edge_samples_parallel(
+            gps_xy, samples, sample_counts[sampled], max_deviation, workers
+        )
+    else:
+        avg_deviations, max_deviations, matched_indices = score_edge_samples(
+            gps_tree, samples, sample_counts[sampled], max_deviation
+        )
     
-    # Process edges
-    processed_edges = 0
-    processed_distance = 0
-    processed_points = 0
-    start_time = time.time()
+    kept = avg_deviations <= max_deviation * 2
+    valid = avg_deviations <= max_deviation
     
-    for u, v, data in G.edges(data=True):
-        try:
-            edge_start_time = time.time()
-            edge = tuple(sorted([u, v]))
-            processed_edges += 1
-            
-            # Get edge geometry and calculate length
-            edge_data = G.get_edge_data(u, v)
-            if edge_data and 'geometry' in edge_data[0]:
-                edge_coords = [(lat, lon) for lon, lat in edge_data[0]['geometry'].coords]
-            else:
-                edge_coords = [
-                    (G.nodes[u]['y'], G.nodes[u]['x']),
-                    (G.nodes[v]['y'], G.nodes[v]['x'])
-                ]
-            
-            # Get road name and assign segment number
-            base_road_name = str(edge_data[0].get('name', 'Unnamed Road'))
-            if base_road_name not in road_segment_counts:
-                road_segment_counts[base_road_name] = 1
-            else:
-                road_segment_counts[base_road_name] += 1
-            
-            road_name = f"{base_road_name}_{road_segment_counts[base_road_name]}"
-            edge_names[edge] = road_name
-            
-            # Calculate edge length
-            edge_length = 0
-            for i in range(len(edge_coords) - 1):
-                edge_length += geodesic(edge_coords[i], edge_coords[i + 1]).meters
-            
-            processed_distance += edge_length
-            
-            # Skip very short edges
-            if edge_length < 1.0:  # Skip edges shorter than 1 meter
-                logging.debug(f"Skipping very short edge {edge} with length {edge_length:.2f}m")
-                continue
-            
-            # Adaptive sampling: fewer points for longer edges
-            num_samples = min(50, max(2, int(edge_length / sample_distance) + 1))  # Ensure at least 2 samples
-            
-            # Sample points along the edge
-            sampled_points = []
-            for i in range(len(edge_coords) - 1):
-                start = edge_coords[i]
-                end = edge_coords[i + 1]
-                segment_length = geodesic(start, end).meters
-                
-                # Skip zero-length segments
-                if segment_length < 0.1:  # Skip segments shorter than 0.1 meters
-                    continue
-                
-                # Calculate number of samples for this segment
-                if edge_length > 0:  # Prevent division by zero
-                    segment_samples = max(2, int(num_samples * (segment_length / edge_length)))
-                else:
-                    segment_samples = 2  # Default to 2 samples if edge length is 0
-                
-                for j in range(segment_samples):
-                    if segment_samples > 1:  # Prevent division by zero
-                        fraction = j / (segment_samples - 1)
-                    else:
-                        fraction = 0
-                    lat = start[0] + fraction * (end[0] - start[0])
-                    lon = start[1] + fraction * (end[1] - start[1])
-                    sampled_points.append((lat, lon))
-            
-            # Skip edges with no valid samples
-            if not sampled_points:
-                logging.debug(f"Skipping edge {edge} with no valid samples")
-                continue
-            
-            processed_points += len(sampled_points)
-            
-            # Convert sampled points to numpy array for faster processing
-            sampled_points_array = np.array(sampled_points)
-            
-            # Find nearest GPS points using spatial index
-            distances, indices = gps_tree.query(sampled_points_array, k=1)
-            
-            # Convert distances from degrees to meters
-            # Note: This is an approximation. For more accuracy, we should use geodesic distance
-            # but that would be much slower. This approximation is reasonable for small distances.
-            distances_meters = distances * 111000  # 1 degree ≈ 111km at the equator
-            
-            # Calculate statistics
-            if len(distances_meters) > 0:  # Ensure we have distances to calculate
-                avg_deviation = np.mean(distances_meters)
-                max_single_deviation = np.max(distances_meters)
-                
-                # Log detailed deviation information
-                logging.debug(f"Edge {edge} deviations:")
-                logging.debug(f"  Min deviation: {np.min(distances_meters):.1f}m")
-                logging.debug(f"  Max deviation: {max_single_deviation:.1f}m")
-                logging.debug(f"  Avg deviation: {avg_deviation:.1f}m")
-                logging.debug(f"  Std deviation: {np.std(distances_meters):.1f}m")
-            else:
-                logging.debug(f"Skipping edge {edge} with no valid distances")
-                continue
-            
-            # Early termination if average deviation is too high
-            if avg_deviation > max_deviation * 2:  # More lenient threshold for early termination
-                logging.debug(f"Edge {edge} rejected early due to high average deviation: {avg_deviation:.1f}m")
-                continue
-            
-            # Get matched GPS points
-            matched_gps_points = set(map(tuple, gps_points[indices]))
-            matched_points.update(matched_gps_points)
-            
-            # Store deviations for visualization
-            edge_deviations[edge] = avg_deviation
-            edge_max_deviations[edge] = max_single_deviation
-            
-            # Log edge completion
-            edge_time = time.time() - edge_start_time
-            current_time = time.time()
-            total_elapsed = current_time - start_time
-            
-            # Prevent division by zero in speed calculations
-            if total_elapsed > 0:
-                edges_per_second = processed_edges / total_elapsed
-                estimated_remaining = (total_edges - processed_edges) / edges_per_second
-            else:
-                edges_per_second = 0
-                estimated_remaining = 0
-            
-            logging.info(f"Edge {processed_edges}/{total_edges} completed:")
-            logging.info(f"  Road: {road_name}")
-            logging.info(f"  Length: {edge_length:.1f}m (Total: {processed_distance:.1f}/{total_distance:.1f}m, {processed_distance/total_distance:.1%})")
-            logging.info(f"  Points: {len(sampled_points)} (Total: {processed_points}/{total_sampled_points}, {processed_points/total_sampled_points:.1%})")
-            logging.info(f"  Average deviation: {avg_deviation:.1f}m")
-            logging.info(f"  Maximum deviation: {max_single_deviation:.1f}m")
-            logging.info(f"  Processing time: {edge_time:.2f}s")
-            logging.info(f"  Average speed: {edges_per_second:.2f} edges/s")
-            logging.info(f"  Estimated time remaining: {estimated_remaining:.1f}s")
-            
-            if avg_deviation <= max_deviation:
-                valid_edges.add(edge)
-                logging.info("  Result: Marked as run (within deviation threshold)")
-            else:
-                logging.info("  Result: Exceeds deviation threshold")
-        
-        except Exception as e:
-            logging.error(f"Error processing edge {edge}: {str(e)}")
-            logging.error(f"Edge details: length={edge_length:.2f}m, samples={len(sampled_points)}")
-            continue
+    valid_edges = {edges[i] for i in sampled[valid]}
+    edge_deviations = {edges[i]: avg for i, avg in zip(sampled[kept], avg_deviations[kept])}
+    edge_max_deviations = {edges[i]: dev for i, dev in zip(sampled[kept], max_deviations[kept])}
+    
+    # Get matched GPS points
+    matched_points = set(map(tuple, gps_points[matched_indices]))
     
     # Log final statistics
     total_time = time.time() - start_time
@@ -560,28 +640,14 @@ def match_points_to_edges(G, points, max_deviation=15, sample_distance=10):
     
     logging.info(f"Completed processing {total_edges} edges in {total_time:.1f} seconds")
     logging.info(f"Total distance processed: {total_distance:.1f} meters")
-    logging.info(f"Total points checked: {total_sampled_points}")
-    logging.info(f"Found {len(valid_edges)} valid edges ({len(valid_edges)/total_edges:.1%} of total)")
+    logging.info(f"Total points checked: {len(samples)}")
+    if total_edges > 0:
+        logging.info(f"Found {len(valid_edges)} valid edges ({len(valid_edges)/total_edges:.1%} of total)")
     logging.info(f"Matched {len(matched_points)} GPS points to edges")
     logging.info(f"Average processing speed: {edges_per_second:.2f} edges/second")
     
     # Prepare classification for visualization
-    not_run_edges = set()
-    for u, v, data in G.edges(data=True):
-        edge = tuple(sorted([u, v]))
-        if edge not in valid_edges:
-            not_run_edges.add(edge)
-    
-    # Ensure all edges have names
-    for edge in valid_edges.union(not_run_edges):
-        if edge not in edge_names:
-            edge_data = G.get_edge_data(edge[0], edge[1])
-            base_road_name = str(edge_data[0].get('name', 'Unnamed Road'))
-            if base_road_name not in road_segment_counts:
-                road_segment_counts[base_road_name] = 1
-            else:
-                road_segment_counts[base_road_name] += 1
-            edge_names[edge] = f"{base_road_name}_{road_segment_counts[base_road_name]}"
+    not_run_edges = set(edges) - valid_edges
     
     classification = {
         'run_edges': valid_edges,
@@ -616,14 +682,12 @@ def analyze_not_run_segments(G, classification, output_file='segments_to_run.csv
         if edge_data and 'geometry' in edge_data[0]:
             # Use the full geometry if available
             coords = [(lat, lon) for lon, lat in edge_data[0]['geometry'].coords]
-            edge_length = 0
-            for i in range(len(coords) - 1):
-                edge_length += geodesic(coords[i], coords[i + 1]).meters
+            edge_length = float(np.sum(consecutive_distances(coords)))
         else:
             # Fall back to start and end points if no geometry
             start_coord = (G.nodes[edge[0]]['y'], G.nodes[edge[0]]['x'])
             end_coord = (G.nodes[edge[1]]['y'], G.nodes[edge[1]]['x'])
-            edge_length = geodesic(start_coord, end_coord).meters
+            edge_length = float(geodesic_distance(start_coord, end_coord))
         
         # Get deviation information if available
         avg_deviation = classification.get('deviation', {}).get(edge, 0)
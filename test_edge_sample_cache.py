@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that cached edge samples are only used for the location they were built for.
+"""
+
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from database.utils import get_location_segment_ids
+from strava_analysis import save_edge_samples, edge_samples_path
+from road_edge_cover import load_location_edge_samples
+
+def build_test_session():
+    """In-memory session with the route tables of two locations; the first one's routes use segments a, b and c"""
+    engine = create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE routes (id INTEGER PRIMARY KEY, location_id INTEGER)"))
+        conn.execute(text(
+            "CREATE TABLE route_segments (route_id INTEGER, segment_id VARCHAR, segment_order INTEGER, direction BOOLEAN)"
+        ))
+        conn.execute(text("INSERT INTO routes VALUES (1, 1), (2, 1), (3, 2)"))
+        conn.execute(text(
+            "INSERT INTO route_segments VALUES (1, 'a', 0, 1), (1, 'b', 1, 1), (2, 'b', 0, 0), (2, 'c', 1, 1), (3, 'x', 0, 1)"
+        ))
+    return sessionmaker(bind=engine)()
+
+def build_edge_samples(segment_ids):
+    """Edge sample arrays with two samples on each segment"""
+    count = len(segment_ids)
+    return {
+        'edges': np.arange(count * 2).reshape(-1, 2),
+        'road_names': np.array(segment_ids, dtype=str),
+        'segment_ids': np.array(segment_ids, dtype=str),
+        'lengths': np.full(count, 10.0),
+        'samples': np.zeros((count * 2, 2)),
+        'sample_offsets': np.arange(0, count * 2 + 1, 2)
+    }
+
+def test_location_segment_ids():
+    """The segments of a location's routes are returned once each"""
+    db = build_test_session()
+
+    assert get_location_segment_ids(db, 1) == {'a', 'b', 'c'}
+    assert get_location_segment_ids(db, 3) == set()
+
+def test_stale_cache_is_ignored():
+    """A cache covering the location's segments is used; one built for other roads is not"""
+    db = build_test_session()
+    with tempfile.TemporaryDirectory() as folder:
+        save_edge_samples(build_edge_samples(['a', 'b', 'c', 'd']), edge_samples_path(1, folder))
+        save_edge_samples(build_edge_samples(['a', 'b']), edge_samples_path(2, folder))
+        save_edge_samples(build_edge_samples(['a']), edge_samples_path(3, folder))
+
+        assert load_location_edge_samples(db, 1, folder)['segment_ids'].tolist() == ['a', 'b', 'c', 'd']
+        assert load_location_edge_samples(db, 2, folder) is None
+        assert load_location_edge_samples(db, 3, folder) is None
+        assert load_location_edge_samples(db, 4, folder) is None
+
+if __name__ == "__main__":
+    test_location_segment_ids()
+    test_stale_cache_is_ignored()
+    print("✅ Cached edge samples are only used for their own location")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the vectorized geodesy functions against geopy.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from geopy.distance import geodesic, great_circle
+
+from geodesy import (
+    EARTH_RADIUS, haversine_distance, geodesic_distance, pairwise_distances,
+    consecutive_distances, cumulative_distances, path_lengths
+)
+
+def random_pairs(scale, count=200, seed=0):
+    """Random point pairs around the globe, about scale degrees apart"""
+    rng = np.random.default_rng(seed)
+    start = np.column_stack((rng.uniform(-80, 80, count), rng.uniform(-180, 180, count)))
+    end = start + rng.normal(size=start.shape) * scale
+    end[:, 0] = np.clip(end[:, 0], -89, 89)
+    return start, end
+
+def test_geodesic_matches_geopy():
+    """Ellipsoidal distances stay within 2 mm per km of geopy from meters to thousands of km"""
+    for scale in [1e-5, 1e-3, 0.1, 10]:
+        start, end = random_pairs(scale)
+        expected = np.array([geodesic(a, b).meters for a, b in zip(start, end)])
+
+        assert np.all(np.abs(geodesic_distance(start, end) - expected) <= 2e-6 * expected + 1e-6)
+
+def test_haversine_matches_geopy():
+    """Great-circle distances match geopy on a sphere of the same radius"""
+    start, end = random_pairs(1.0)
+    expected = np.array([great_circle(a, b, radius=EARTH_RADIUS / 1000).meters for a, b in zip(start, end)])
+
+    assert np.allclose(haversine_distance(start, end), expected, rtol=1e-9)
+
+def test_path_functions():
+    """Pairwise, consecutive, cumulative and per-path distances agree with each other"""
+    start, _ = random_pairs(0.01, count=6)
+    path = start[0] + np.cumsum(np.full((6, 2), 1e-3), axis=0)
+    steps = np.array([geodesic(a, b).meters for a, b in zip(path[:-1], path[1:])])
+
+    assert np.allclose(consecutive_distances(path), steps, rtol=2e-6)
+    assert np.allclose(cumulative_distances(path), np.concatenate(([0], np.cumsum(steps))), rtol=2e-6)
+    assert np.allclose(np.diag(pairwise_distances(path[:-1], path[1:])), consecutive_distances(path))
+    assert geodesic_distance(path[0], path[0]) == 0
+
+    # Paths of 3, 1 and 2 points stored back to back
+    lengths = path_lengths(path, [0, 3, 4, 6])
+    assert np.allclose(lengths, [steps[0] + steps[1], 0, steps[4]])
+
+if __name__ == "__main__":
+    test_geodesic_matches_geopy()
+    test_haversine_matches_geopy()
+    test_path_functions()
+    print("✅ Geodesy functions match geopy")
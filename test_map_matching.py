@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that the HMM map matcher follows a GPS track along the road network.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from datetime import datetime, timedelta, timezone
+
+from map_matching import build_edge_index, match_track
+from track_processing import simplify_track, matching_points
+from strava_analysis import collect_edge_coordinates
+from test_parallel_matching import build_test_graph
+
+STEP = 0.0008
+
+def build_test_index():
+    """Build an edge index over the test grid, keyed by sorted node pairs"""
+    G = build_test_graph(size=30, step=STEP)
+    edges, _, coords, coord_offsets = collect_edge_coordinates(G)
+    return build_edge_index(edges, [coords[coord_offsets[i]:coord_offsets[i + 1]] for i in range(len(edges))])
+
+def build_test_track():
+    """Noisy track east along the first street for 10 blocks, then north for 8 blocks"""
+    rng = np.random.default_rng(3)
+    points = [(-32.93 + rng.normal() * 3e-5, 151.71 + t) for t in np.linspace(0, 10 * STEP, 300)]
+    points += [(-32.93 + t, 151.71 + 10 * STEP + rng.normal() * 3e-5) for t in np.linspace(0, 8 * STEP, 250)]
+    return points
+
+def expected_edges():
+    """Edges of the test track in travel order"""
+    edges = [(j, j + 1) for j in range(10)]
+    edges += [(10 + i * 30, 10 + (i + 1) * 30) for i in range(8)]
+    return edges
+
+def covered_edges(traversals, threshold=0.8):
+    """Edges in traversal order whose traversals cover more than threshold of the edge"""
+    covered = []
+    for edge, start, end in traversals:
+        if abs(end - start) > threshold and edge not in covered:
+            covered.append(edge)
+    return covered
+
+def test_track_follows_roads():
+    """The matched traversals cover exactly the roads of the track, in order"""
+    traversals = match_track(build_test_index(), build_test_track())
+
+    assert covered_edges(traversals) == expected_edges()
+
+def test_windows_do_not_change_result():
+    """Matching a streamed track in small windows gives the same roads as one window"""
+    edge_index = build_test_index()
+    points = build_test_track()
+
+    whole = match_track(edge_index, points, window_size=len(points))
+    windowed = match_track(edge_index, iter(points), window_size=40)
+
+    assert covered_edges(windowed) == covered_edges(whole) == expected_edges()
+
+def test_simplified_straight_run():
+    """A long straight run simplified to its end points still matches every block once densified"""
+    start = datetime(2025, 4, 15, 6, 0, tzinfo=timezone.utc)
+    points = [
+        {'latitude': -32.93, 'longitude': 151.71 + t, 'timestamp': start + timedelta(seconds=i)}
+        for i, t in enumerate(np.linspace(0, 25 * STEP, 750))
+    ]
+    simplified = simplify_track(points)
+    traversals = match_track(build_test_index(), matching_points(simplified).tolist())
+
+    assert len(simplified) == 2
+    assert covered_edges(traversals) == [(j, j + 1) for j in range(25)]
+
+if __name__ == "__main__":
+    test_track_follows_roads()
+    test_windows_do_not_change_result()
+    test_simplified_straight_run()
+    print("✅ Map matching follows the track along the road network")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that the SQL migration files split into the statements the runner executes.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database.sql_script import MIGRATIONS_FOLDER, read_statements, split_statements, strip_comments, created_indexes
+from database_migration import _numbered_migrations
+
+def test_numbered_migrations():
+    """Only numbered files are applied, in version order"""
+    assert _numbered_migrations() == [
+        ('001', '001_spatial_and_foreign_key_indexes.sql'),
+        ('002', '002_user_segment_stats_rollup.sql'),
+    ]
+
+def test_index_migration_statements():
+    """Every index of 001 is its own CONCURRENTLY statement, so none runs inside a transaction"""
+    statements = read_statements(os.path.join(MIGRATIONS_FOLDER, '001_spatial_and_foreign_key_indexes.sql'))
+
+    assert len(statements) == 8
+    assert all(statement.startswith('CREATE INDEX CONCURRENTLY IF NOT EXISTS') for statement in statements)
+    assert created_indexes(statements) == [
+        'idx_road_segments_geometry',
+        'idx_user_road_segments_geometry',
+        'idx_gps_points_location',
+        'idx_activities_path',
+        'ix_gps_points_activity_id',
+        'ix_routes_location_id',
+        'ix_route_segments_segment_id',
+        'ix_user_road_segments_user_run',
+    ]
+
+def test_rollup_migration_statements():
+    """The trigger function of 002 stays in one piece despite the semicolons in its body"""
+    statements = read_statements(os.path.join(MIGRATIONS_FOLDER, '002_user_segment_stats_rollup.sql'))
+
+    assert [statement.split('\n')[0] for statement in statements] == [
+        'CREATE TABLE IF NOT EXISTS user_segment_stats (',
+        'CREATE OR REPLACE FUNCTION user_segment_stats_apply() RETURNS trigger AS $$',
+        'DROP TRIGGER IF EXISTS user_segment_stats_insert ON user_road_segments',
+        'CREATE TRIGGER user_segment_stats_insert',
+        'DROP TRIGGER IF EXISTS user_segment_stats_update ON user_road_segments',
+        'CREATE TRIGGER user_segment_stats_update',
+        'DROP TRIGGER IF EXISTS user_segment_stats_delete ON user_road_segments',
+        'CREATE TRIGGER user_segment_stats_delete',
+        'INSERT INTO user_segment_stats (user_id, total_segments, run_segments, total_length, run_length)',
+    ]
+    function = statements[1]
+    assert function.endswith('$$ LANGUAGE plpgsql')
+    assert function.count(';') == 5 and 'RETURN NULL;' in function
+    assert created_indexes(statements) == []
+
+def test_comments_and_quotes():
+    """Comments are dropped, and semicolons in literals, comments and dollar quotes don't split"""
+    sql = """
+        -- leading comment; with a semicolon
+        SELECT 'a;''b' AS text; -- trailing comment;
+        /* block; comment */ CREATE UNIQUE INDEX CONCURRENTLY ix_test ON t (c);
+        DO $body$ BEGIN PERFORM 1; END $body$;
+        SELECT '-- not a comment'
+    """
+
+    assert split_statements(strip_comments(sql)) == [
+        "SELECT 'a;''b' AS text",
+        'CREATE UNIQUE INDEX CONCURRENTLY ix_test ON t (c)',
+        'DO $body$ BEGIN PERFORM 1; END $body$',
+        "SELECT '-- not a comment'",
+    ]
+    assert created_indexes(split_statements(strip_comments(sql))) == ['ix_test']
+
+if __name__ == "__main__":
+    test_numbered_migrations()
+    test_index_migration_statements()
+    test_rollup_migration_statements()
+    test_comments_and_quotes()
+    print("✅ Migration files split into the expected statements")
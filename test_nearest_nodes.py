@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that the node spatial index finds the same nearest nodes as a brute-force search.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import networkx as nx
+
+from graph_utils import get_node_index, nearest_nodes
+from geodesy import haversine_distance
+
+def build_test_graph(count=200):
+    """Graph of randomly placed nodes around Newcastle, NSW, with non-contiguous IDs"""
+    rng = np.random.default_rng(11)
+    G = nx.MultiDiGraph()
+    for i in range(count):
+        G.add_node(1000 + 7 * i, y=-32.93 + rng.uniform(-0.02, 0.02), x=151.71 + rng.uniform(-0.02, 0.02))
+    return G
+
+def brute_force_nearest(G, points):
+    """Nearest node ID and haversine distance for each point, checking every node"""
+    nodes = np.array(list(G.nodes))
+    node_latlon = np.array([(G.nodes[n]['y'], G.nodes[n]['x']) for n in nodes])
+    distances = haversine_distance(np.asarray(points)[:, None, :], node_latlon[None, :, :])
+    nearest = np.argmin(distances, axis=1)
+    return nodes[nearest], distances[np.arange(len(points)), nearest]
+
+def test_nearest_nodes_match_brute_force():
+    """Every query point gets the node a full haversine search picks, at the same distance"""
+    G = build_test_graph()
+    rng = np.random.default_rng(12)
+    points = np.column_stack((-32.93 + rng.uniform(-0.025, 0.025, 300), 151.71 + rng.uniform(-0.025, 0.025, 300)))
+
+    node_ids, distances = nearest_nodes(G, points, return_dist=True)
+    expected_ids, expected_distances = brute_force_nearest(G, points)
+
+    assert np.array_equal(node_ids, expected_ids)
+    assert np.allclose(distances, expected_distances, rtol=5e-3)
+
+def test_index_is_reused():
+    """The index is built once per graph and a node's own position maps back to it"""
+    G = build_test_graph()
+    index = get_node_index(G)
+
+    assert get_node_index(G) is index
+    node = list(G.nodes)[5]
+    assert nearest_nodes(G, [(G.nodes[node]['y'], G.nodes[node]['x'])])[0] == node
+
+if __name__ == "__main__":
+    test_nearest_nodes_match_brute_force()
+    test_index_is_reused()
+    print("✅ Nearest node search matches a brute-force haversine search")
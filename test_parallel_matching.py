@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that parallel GPS edge matching gives the same result as serial matching.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import networkx as nx
+import numpy as np
+from shapely.geometry import LineString
+
+from strava_analysis import match_points_to_edges
+
+def build_test_graph(size=30, step=0.0008):
+    """Build a grid road network near Newcastle, NSW with some curved edges"""
+    G = nx.MultiGraph()
+    for i in range(size):
+        for j in range(size):
+            G.add_node(i * size + j, y=-32.93 + i * step, x=151.71 + j * step)
+
+    rng = np.random.default_rng(42)
+    for i in range(size):
+        for j in range(size):
+            node = i * size + j
+            neighbours = []
+            if j < size - 1:
+                neighbours.append(node + 1)
+            if i < size - 1:
+                neighbours.append(node + size)
+            for other in neighbours:
+                start = (G.nodes[node]['x'], G.nodes[node]['y'])
+                end = (G.nodes[other]['x'], G.nodes[other]['y'])
+                data = {'name': f"Street {i}", 'length': step * 95000}
+                if rng.random() < 0.3:
+                    middle = ((start[0] + end[0]) / 2 + rng.normal() * 5e-5,
+                              (start[1] + end[1]) / 2 + rng.normal() * 5e-5)
+                    data['geometry'] = LineString([start, middle, end])
+                G.add_edge(node, other, **data)
+    return G
+
+def build_test_points():
+    """Build a noisy GPS track along one street and one avenue of the test grid"""
+    rng = np.random.default_rng(7)
+    points = [(-32.93 + rng.normal() * 2e-5, 151.71 + t) for t in np.linspace(0, 0.02, 2500)]
+    points += [(-32.93 + t, 151.7164 + rng.normal() * 2e-5) for t in np.linspace(0, 0.015, 2000)]
+    return [tuple(point) for point in points]
+
+def test_parallel_matching_matches_serial():
+    """Parallel and serial matching produce identical classifications"""
+    G = build_test_graph()
+    points = build_test_points()
+
+    serial, serial_matched = match_points_to_edges(G, (points, points), workers=1)
+    parallel, parallel_matched = match_points_to_edges(G, (points, points), workers=3)
+
+    assert serial['run_edges'], "expected the test track to cover some edges"
+    assert parallel['run_edges'] == serial['run_edges']
+    assert parallel['not_run_edges'] == serial['not_run_edges']
+    assert parallel['road_names'] == serial['road_names']
+    assert parallel['deviation'].keys() == serial['deviation'].keys()
+    for edge, deviation in serial['deviation'].items():
+        assert np.isclose(parallel['deviation'][edge], deviation)
+        assert np.isclose(parallel['max_deviation'][edge], serial['max_deviation'][edge])
+    assert parallel_matched == serial_matched
+
+if __name__ == "__main__":
+    test_parallel_matching_matches_serial()
+    print("✅ Parallel matching matches serial matching")
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that the local metric projection round-trips and measures true distances.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from projection import local_origin, project, unproject
+from geodesy import haversine_distance, geodesic_distance
+
+ORIGIN = (-32.93, 151.71)
+
+def build_test_points(count=500, spread=0.05):
+    """Random (lat, lon) points within about 5 km of ORIGIN"""
+    rng = np.random.default_rng(7)
+    return np.array(ORIGIN) + rng.uniform(-spread, spread, size=(count, 2))
+
+def test_round_trip():
+    """Unprojecting projected points gives back the original coordinates"""
+    latlon = build_test_points()
+    origin = local_origin(latlon)
+
+    assert np.allclose(unproject(project(latlon, origin), origin), latlon, rtol=0, atol=1e-9)
+    assert np.allclose(project([origin], origin), 0)
+
+def test_metric_distances():
+    """Plane distances match haversine and the ellipsoid at an off-equator origin"""
+    latlon = build_test_points()
+    xy = project(latlon, ORIGIN)
+    plane = np.hypot(*(xy[1:] - xy[:-1]).T)
+
+    # The sphere differs from the ellipsoid by up to half a percent
+    assert np.allclose(plane, haversine_distance(latlon[:-1], latlon[1:]), rtol=5e-3)
+    assert np.allclose(plane, geodesic_distance(latlon[:-1], latlon[1:]), rtol=1e-3)
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_metric_distances()
+    print("✅ Local projection round-trips and measures distances in meters")
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that segment coverage accumulates as a union of intervals across activities.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from database.coverage import merge_intervals, union_intervals, covered_fraction, encode_intervals, decode_intervals
+
+def test_merge_intervals():
+    """Overlapping, touching and reversed intervals merge into disjoint sorted intervals"""
+    merged = merge_intervals([(0.6, 0.4), (0.1, 0.2), (0.5, 0.7), (0.2, 0.3), (0.9, 1.2)])
+
+    assert np.allclose(merged, [(0.1, 0.3), (0.4, 0.7), (0.9, 1.0)])
+    assert np.isclose(covered_fraction(merged), 0.6)
+
+def test_activities_complete_segment_together():
+    """Two activities each covering half a segment cover all of it together"""
+    first = merge_intervals([(0.0, 0.55)])
+    second = merge_intervals([(1.0, 0.45)])
+
+    assert covered_fraction(first) < 0.8
+    assert covered_fraction(second) < 0.8
+    assert np.isclose(covered_fraction(union_intervals(first, second)), 1.0)
+
+def test_intervals_round_trip():
+    """Stored interval sets decode to the same intervals"""
+    intervals = merge_intervals([(0.125, 0.25), (0.5, 0.75)])
+
+    assert np.allclose(decode_intervals(encode_intervals(intervals)), intervals)
+    assert decode_intervals(None).shape == (0, 2)
+    assert covered_fraction(union_intervals(decode_intervals(None), intervals)) == 0.375
+
+if __name__ == "__main__":
+    test_merge_intervals()
+    test_activities_complete_segment_together()
+    test_intervals_round_trip()
+    print("✅ Segment coverage intervals merge correctly")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that compressed activity tracks decode to the stored GPS samples.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from database.track_codec import encode_track, decode_track
+
+def build_test_points():
+    """A minute of GPS samples with some missing elevation and heart rate values"""
+    start = datetime(2025, 4, 15, 6, 0, tzinfo=timezone.utc)
+    points = []
+    for i in range(60):
+        points.append({
+            'latitude': -32.93 + i * 1.3e-5,
+            'longitude': 151.71 + i * 2.1e-5,
+            'elevation': None if i % 7 == 3 else 20.0 + i * 0.1,
+            'timestamp': start + timedelta(seconds=i),
+            'heart_rate': None if i < 5 else 140 + i % 10,
+        })
+    return points
+
+def test_track_round_trip():
+    """Every column decodes to the encoded values, with NaN where values were missing"""
+    points = build_test_points()
+    track = decode_track(encode_track(points))
+
+    assert np.allclose(track['latitude'], [p['latitude'] for p in points], atol=1e-7)
+    assert np.allclose(track['longitude'], [p['longitude'] for p in points], atol=1e-7)
+    assert np.allclose(track['elevation'], [np.nan if p['elevation'] is None else p['elevation'] for p in points], atol=0.01, equal_nan=True)
+    assert np.allclose(track['timestamp'], [p['timestamp'].timestamp() for p in points])
+    assert np.allclose(track['heart_rate'], [np.nan if p['heart_rate'] is None else p['heart_rate'] for p in points], equal_nan=True)
+    assert np.isnan(track['cadence']).all()
+
+def test_track_is_compact():
+    """Delta encoding and compression keep a track far smaller than its raw floats"""
+    points = build_test_points()
+
+    assert len(encode_track(points)) < len(points) * 8
+    assert len(decode_track(encode_track([]))['latitude']) == 0
+
+def test_naive_timestamps_are_utc():
+    """Naive timestamps encode as UTC, whatever the local time zone"""
+    points = build_test_points()
+    naive = [dict(p, timestamp=p['timestamp'].replace(tzinfo=None)) for p in points]
+
+    assert np.array_equal(decode_track(encode_track(naive))['timestamp'], decode_track(encode_track(points))['timestamp'])
+
+if __name__ == "__main__":
+    test_track_round_trip()
+    test_track_is_compact()
+    test_naive_timestamps_are_utc()
+    print("✅ Compressed tracks decode to the stored GPS samples")
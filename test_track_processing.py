@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that track simplification keeps the shape of a GPS track.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from shapely.geometry import LineString, Point
+
+from projection import local_origin, project
+from track_processing import filter_track, simplify_track, densify_track
+
+def build_test_track():
+    """One point per second of a noisy run around three sides of a block"""
+    rng = np.random.default_rng(5)
+    corners = np.array([(-32.93, 151.71), (-32.93, 151.715), (-32.925, 151.715), (-32.925, 151.71)])
+    latlon = np.vstack([np.linspace(a, b, 400, endpoint=False) for a, b in zip(corners[:-1], corners[1:])])
+    latlon += rng.normal(scale=3e-6, size=latlon.shape)
+    start = datetime(2025, 4, 15, 6, 0, tzinfo=timezone.utc)
+    return [
+        {'latitude': lat, 'longitude': lon, 'elevation': None, 'timestamp': start + timedelta(seconds=i)}
+        for i, (lat, lon) in enumerate(latlon)
+    ]
+
+def test_simplified_track_stays_within_tolerance():
+    """Simplification drops most points but every raw point stays near the simplified line"""
+    points = build_test_track()
+    simplified = simplify_track(points, tolerance=2.0)
+
+    assert len(simplified) < len(points) / 10
+    assert simplified[0] is points[0] and simplified[-1] is points[-1]
+
+    latlon = np.array([(p['latitude'], p['longitude']) for p in points])
+    origin = local_origin(latlon)
+    line = LineString(project([(p['latitude'], p['longitude']) for p in simplified], origin))
+    assert max(line.distance(Point(xy)) for xy in project(latlon, origin)) <= 2.0 + 1e-6
+
+def test_densified_track_has_short_steps():
+    """Densifying a simplified track fills in the gaps between its points"""
+    simplified = simplify_track(build_test_track(), tolerance=2.0)
+    latlon = np.array([(p['latitude'], p['longitude']) for p in simplified])
+    dense = densify_track(latlon, max_step=10.0)
+
+    steps = np.hypot(*np.diff(project(dense, local_origin(dense)), axis=0).T)
+    assert steps.max() <= 10.0 + 1e-6
+    assert np.allclose(dense[[0, -1]], latlon[[0, -1]])
+
+def test_filter_removes_noise():
+    """Filtering drops repeated timestamps, jumps and a stop at the lights, keeping the run"""
+    points = build_test_track()
+    rng = np.random.default_rng(7)
+    stop = [
+        dict(points[600], latitude=points[600]['latitude'] + rng.normal(scale=3e-6),
+             timestamp=points[600]['timestamp'] + timedelta(seconds=i + 1))
+        for i in range(60)
+    ]
+    after = [dict(point, timestamp=point['timestamp'] + timedelta(seconds=61)) for point in points[601:]]
+    noisy = points[:601] + stop + after
+    noisy[100] = dict(noisy[100], latitude=noisy[100]['latitude'] + 0.01)  # jump
+    noisy[300] = dict(noisy[300], timestamp=noisy[299]['timestamp'])  # repeated timestamp
+
+    filtered, stats = filter_track(noisy)
+
+    assert stats['duplicates'] == 1 and stats['outliers'] == 1
+    assert noisy[100] not in filtered and noisy[300] not in filtered
+    assert sum(point in filtered for point in stop) <= 5
+    assert filtered[0] is noisy[0] and len(filtered) > 0.8 * len(points)
+
+if __name__ == "__main__":
+    test_simplified_track_stays_within_tolerance()
+    test_densified_track_has_short_steps()
+    test_filter_removes_noise()
+    print("✅ Track simplification keeps the track within tolerance")
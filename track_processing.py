@@ -0,0 +1,263 @@
+import logging
+import os
+import numpy as np
+from projection import local_origin, project
+from geodesy import consecutive_distances, geodesic_distance
+
+def _thin_track(xy, times, min_distance, min_interval):
+    """Indices of points at least min_distance meters and min_interval seconds after the previous kept point."""
+    keep = [0]
+    last = 0
+    for i in range(1, len(xy) - 1):
+        if np.hypot(*(xy[i] - xy[last])) < min_distance:
+            continue
+        if min_interval and not np.isnan(times[i]) and not np.isnan(times[last]) and times[i] - times[last] < min_interval:
+            continue
+        keep.append(i)
+        last = i
+    if len(xy) > 1:
+        keep.append(len(xy) - 1)
+    return np.array(keep, dtype=np.int64)
+
+def _douglas_peucker(xy, tolerance):
+    """Boolean mask of the points kept by Ramer-Douglas-Peucker simplification of a polyline."""
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(xy) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        # Perpendicular distance of the inner points to the chord, or to its start if it has no length
+        chord = xy[end] - xy[start]
+        offsets = xy[start + 1:end] - xy[start]
+        chord_length = np.hypot(*chord)
+        if chord_length > 0:
+            distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / chord_length
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+
+        furthest = int(np.argmax(distances))
+        if distances[furthest] > tolerance:
+            split = start + 1 + furthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+def _jumps(latlon, times, max_speed, max_burst):
+    """Mask of the points of a track that were reached by an impossible jump.
+
+    A jump is a step faster than max_speed. Up to max_burst points between a jump
+    away and a jump back are bad fixes when the track could plausibly have gone
+    straight from before the first jump to after the second. At either end of the
+    track, up to max_burst points cut off by a jump from a plausible track are dropped.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fast = np.flatnonzero(consecutive_distances(latlon) / np.diff(times) > max_speed)
+    bad = np.zeros(len(latlon), dtype=bool)
+    if len(fast) == 0:
+        return bad
+
+    # Pairs of consecutive jumps whose end points are reachable from each other,
+    # starting from a point that was not itself reached by a jump
+    away, back = fast[:-1], fast[1:]
+    close = (back - away <= max_burst) & ~np.isin(away - 1, fast)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bridged = geodesic_distance(latlon[away], latlon[back + 1]) / (times[back + 1] - times[away]) <= max_speed
+    for start, end in zip(away[close & bridged] + 1, back[close & bridged] + 1):
+        bad[start:end] = True
+
+    # Ends cut off by a jump, when the track is plausible on the other side of it
+    if fast[0] < max_burst and fast[0] + 1 not in fast:
+        bad[:fast[0] + 1] = True
+    if len(latlon) - 1 - fast[-1] <= max_burst and fast[-1] - 1 not in fast:
+        bad[fast[-1] + 1:] = True
+    return bad
+
+def filter_track_arrays(latlon, times, max_speed=12.0, dwell_radius=5.0, dwell_speed=0.5, dwell_window=5, max_burst=5):
+    """Mask of the points of a time-ordered track to keep after removing GPS noise.
+
+    Three kinds of points are dropped, in order:
+    - points repeating the previous point's timestamp
+    - bursts of up to max_burst points reached by a jump faster than max_speed
+      and left by a jump back
+    - all but the first point of each stationary cluster, a run of steps that move
+      slower than dwell_speed over the next dwell_window points and stay within
+      dwell_radius meters of where the run started
+
+    Points without a timestamp are never dropped.
+
+    Args:
+        latlon: (N, 2) array of (lat, lon) points in track order
+        times: (N,) array of timestamps in seconds, NaN where unknown
+        max_speed: Fastest plausible speed in meters per second
+        dwell_radius: Radius in meters within which a slow run counts as stationary
+        dwell_speed: Speed in meters per second below which a step counts as stationary
+        dwell_window: Number of points over which the speed of a step is measured
+        max_burst: Most consecutive points removed as one burst of bad fixes
+
+    Returns:
+        Tuple of (keep, stats) where keep is a boolean mask over the points and stats
+        counts the points removed as duplicates, outliers and dwell
+    """
+    latlon = np.asarray(latlon, dtype=float).reshape(-1, 2)
+    times = np.asarray(times, dtype=float)
+    keep = np.ones(len(latlon), dtype=bool)
+    stats = {'duplicates': 0, 'outliers': 0, 'dwell': 0}
+    if len(latlon) < 3:
+        return keep, stats
+
+    # Duplicate timestamps; NaN never compares equal so untimed points stay
+    keep[1:] = ~(times[1:] == times[:-1])
+    stats['duplicates'] = int(np.count_nonzero(~keep))
+
+    # Impossible jumps, measured between the points still kept; bursts next to each
+    # other are only separated after the first is removed
+    while True:
+        kept = np.flatnonzero(keep)
+        jumps = _jumps(latlon[kept], times[kept], max_speed, max_burst)
+        if not jumps.any():
+            break
+        keep[kept[jumps]] = False
+        stats['outliers'] += int(np.count_nonzero(jumps))
+
+    # Stationary clusters: runs of consecutive slow steps that stay close to their first point
+    kept = np.flatnonzero(keep)
+    if len(kept) >= 3:
+        xy = project(latlon[kept], local_origin(latlon[kept]))
+        # Speed over the next dwell_window points, which averages out jitter at walking pace
+        ahead = np.minimum(np.arange(1, len(kept)) + dwell_window - 1, len(kept) - 1)
+        displacement = np.hypot(*(xy[ahead] - xy[:-1]).T)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slow = displacement / (times[kept][ahead] - times[kept][:-1]) < dwell_speed
+
+        edges = np.diff(np.concatenate(([0], slow.astype(np.int8), [0])))
+        run_starts = np.flatnonzero(edges == 1)
+        run_ends = np.flatnonzero(edges == -1)  # exclusive, in steps; the run's last point
+        if len(run_starts):
+            run_of_step = np.repeat(np.arange(len(run_starts)), run_ends - run_starts)
+            slow_steps = np.flatnonzero(slow)
+            spread = np.hypot(*(xy[slow_steps + 1] - xy[run_starts[run_of_step]]).T)
+            stationary = np.maximum.reduceat(spread, np.cumsum(run_ends - run_starts) - (run_ends - run_starts)) <= dwell_radius
+
+            dropped = slow_steps[stationary[run_of_step]] + 1
+            keep[kept[dropped]] = False
+            stats['dwell'] = len(dropped)
+
+    return keep, stats
+
+def filter_track(gps_points_data, **kwargs):
+    """Remove duplicate timestamps, GPS jumps and stationary clusters from a track.
+
+    Args:
+        gps_points_data: List of GPS point dicts with latitude, longitude and timestamp,
+            in time order
+        **kwargs: Thresholds passed to filter_track_arrays
+
+    Returns:
+        Tuple of (kept GPS point dicts, stats) where stats counts the points removed
+        as duplicates, outliers and dwell
+    """
+    latlon = np.array([(p['latitude'], p['longitude']) for p in gps_points_data], dtype=float)
+    times = np.array([p['timestamp'].timestamp() if p.get('timestamp') else np.nan for p in gps_points_data])
+    keep, stats = filter_track_arrays(latlon, times, **kwargs)
+
+    removed = len(gps_points_data) - int(np.count_nonzero(keep))
+    if removed:
+        logging.info(
+            f"Filtered {removed} of {len(gps_points_data)} GPS points "
+            f"({stats['duplicates']} duplicate timestamps, {stats['outliers']} jumps, {stats['dwell']} stationary)"
+        )
+    return [point for point, kept in zip(gps_points_data, keep) if kept], stats
+
+def simplify_track(gps_points_data, tolerance=2.0, min_distance=1.0, min_interval=0):
+    """Simplify a GPS track before it is stored or matched.
+
+    Points closer than min_distance meters or min_interval seconds to the previous
+    kept point are dropped first, then the track is simplified with the
+    Ramer-Douglas-Peucker algorithm so no dropped point lies further than tolerance
+    meters from the simplified line. The first and last points are always kept.
+
+    Args:
+        gps_points_data: List of GPS point dicts with latitude, longitude and timestamp
+        tolerance: Maximum distance in meters between the raw and simplified track
+        min_distance: Minimum distance in meters between consecutive kept points
+        min_interval: Minimum time in seconds between consecutive kept points
+
+    Returns:
+        List of the kept GPS point dicts, in track order
+    """
+    if len(gps_points_data) < 3:
+        return list(gps_points_data)
+
+    latlon = np.array([(p['latitude'], p['longitude']) for p in gps_points_data], dtype=float)
+    xy = project(latlon, local_origin(latlon))
+    times = np.array([p['timestamp'].timestamp() if p.get('timestamp') else np.nan for p in gps_points_data])
+
+    thinned = _thin_track(xy, times, min_distance, min_interval)
+    kept = thinned[_douglas_peucker(xy[thinned], tolerance)]
+
+    logging.info(f"Simplified track from {len(gps_points_data)} to {len(kept)} points")
+    return [gps_points_data[i] for i in kept]
+
+def densify_track(latlon, max_step=10.0):
+    """Interpolate points along a track so consecutive points are at most max_step meters apart.
+
+    Simplified tracks have long straight gaps between points; filling them in lets
+    point-based matching treat them like the raw track.
+
+    Args:
+        latlon: (N, 2) array of (lat, lon) points in track order
+        max_step: Maximum distance in meters between consecutive points
+
+    Returns:
+        (M, 2) array of (lat, lon) points including the original ones
+    """
+    latlon = np.asarray(latlon, dtype=float).reshape(-1, 2)
+    if len(latlon) < 2:
+        return latlon
+
+    xy = project(latlon, local_origin(latlon))
+    steps = np.hypot(*np.diff(xy, axis=0).T)
+    pieces = np.maximum(1, np.ceil(steps / max_step).astype(np.int64))
+
+    # Each gap contributes its start point plus evenly spaced points up to its end
+    gap = np.repeat(np.arange(len(steps)), pieces)
+    fraction = (np.arange(len(gap)) - np.repeat(np.cumsum(pieces) - pieces, pieces)) / pieces[gap]
+    points = latlon[gap] + fraction[:, None] * (latlon[gap + 1] - latlon[gap])
+    return np.vstack((points, latlon[-1:]))
+
+def matching_points(gps_points_data, max_step=10.0):
+    """(lat, lon) points of a stored track to map match, densified with densify_track.
+
+    Simplification leaves points hundreds of meters apart on straight roads, further
+    than the map matcher searches between consecutive points.
+
+    Args:
+        gps_points_data: List of GPS point dicts with latitude and longitude, in track order
+        max_step: Maximum distance in meters between consecutive points
+
+    Returns:
+        (M, 2) array of (lat, lon) points
+    """
+    latlon = np.array([(p['latitude'], p['longitude']) for p in gps_points_data], dtype=float).reshape(-1, 2)
+    return densify_track(latlon, max_step)
+
+def archive_raw_track(gps_points_data, path):
+    """Save the full-resolution track to a compressed file before it is simplified.
+
+    Args:
+        gps_points_data: List of GPS point dicts with latitude, longitude, elevation and timestamp
+        path: Destination .npz file
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    np.savez_compressed(
+        path,
+        latitude=np.array([p['latitude'] for p in gps_points_data], dtype=float),
+        longitude=np.array([p['longitude'] for p in gps_points_data], dtype=float),
+        elevation=np.array([np.nan if p.get('elevation') is None else p['elevation'] for p in gps_points_data], dtype=float),
+        timestamp=np.array([p['timestamp'].timestamp() if p.get('timestamp') else np.nan for p in gps_points_data])
+    )
+    logging.info(f"Archived {len(gps_points_data)} raw GPS points to {path}")